@@ -41,6 +41,12 @@ class Args:
     verbose: Annotated[bool, Arg(short=True, propagate=True)] = False
     """Increase the verbosity of log messages."""
 
+    trace: Annotated[bool, Arg(long=True, propagate=True)] = False
+    """Record how long each install and import stage takes to `trace.json` next to the log file, viewable in Perfetto or chrome://tracing."""
+
+    jobs: Annotated[int | None, Arg(short='-j', long=True, propagate=True)] = None
+    """Number of worker processes used to process particle files during an install or a particle mod import, defaults to the number of CPUs."""
+
 
 @dataclass
 class FolderConfig:
@@ -73,6 +79,15 @@ class FolderConfig:
     modsinfo_file: Path | Dep[Path] = Dep(lambda project_dir: project_dir / 'modsinfo.json')
     """File that records the last-downloaded version of 'bundled' mods"""
 
+    staging_dir:   Path | Dep[Path] = Dep(lambda project_dir: project_dir / 'staging')
+    """Transformed addon files kept between installs, so unchanged content is not processed again"""
+    pcf_cache_dir: Path | Dep[Path] = Dep(lambda project_dir: project_dir / 'pcf_cache')
+    """Decoded vanilla PCFs, keyed by content hash so a game update invalidates them"""
+    fragment_library_file: Path | Dep[Path] = Dep(lambda project_dir: project_dir / 'particle_fragments.bin')
+    """Every vanilla particle system as a standalone fragment, rebuilt when the vanilla PCFs change"""
+    processed_pcf_cache_dir: Path | Dep[Path] = Dep(lambda project_dir: project_dir / 'processed_pcf_cache')
+    """Compressed particle files from previous installs, keyed by the contents of everything they are built from"""
+
     particles_dir: Path | Dep[Path] = Dep(lambda mods_dir: mods_dir / 'particles')
     """Location where PARTICLE mods are stored"""
     addons_dir:    Path | Dep[Path] = Dep(lambda mods_dir: mods_dir / 'addons')
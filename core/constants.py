@@ -94,6 +94,24 @@ BACKUP_MAINMENU_FOLDER = "zz_run_preloader_again_if_you_add_a_custom_hud_or_else
 
 MOD_EXPORT_VPK_SPLIT_SIZE = 200 * (2**20)
 
+# encoded size of the extracted particle systems a mod import keeps in memory, the rest is spilled to disk
+PARTICLE_IMPORT_MEMORY_BUDGET = 256 * (2**20)
+
+# processed particle files kept between installs, the least recently used are dropped past this size
+PROCESSED_PCF_CACHE_MAX_BYTES = 256 * (2**20)
+
+# staged file types nothing rewrites in place, so staging may hard link them to the addon's files
+HARDLINK_SAFE_SUFFIXES = {
+    ".ani",
+    ".mp3",
+    ".ogg",
+    ".phy",
+    ".vtf",
+    ".vtx",
+    ".vvd",
+    ".wav",
+}
+
 QUICKPRECACHE_FILE_SUFFIXES = [
     ".dx80.vtx",
     ".dx90.vtx",
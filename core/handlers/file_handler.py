@@ -1,11 +1,12 @@
 import logging
-import os
 import shutil
 from pathlib import Path
 
 from valve_parsers import PCFFile, VPKFile
 
 from core.config import config
+from core.util.pcf import encode_pcf
+from core.util.vpk import VPKPatchBatch
 
 log = logging.getLogger()
 
@@ -52,8 +53,13 @@ def copy_config_files(custom_content_dir):
 
 
 class FileHandler:
-    def __init__(self, vpk_file: Path):
-        self.vpk = VPKFile(vpk_file)
+    def __init__(self, vpk_file: Path | VPKFile, batch: VPKPatchBatch | None = None):
+        # when a batch is given, patches are queued into it and only written once the caller commits it
+        self.vpk = vpk_file if isinstance(vpk_file, VPKFile) else VPKFile(vpk_file)
+        self.batch = batch
+
+    def encode(self, pcf: PCFFile) -> bytes:
+        return encode_pcf(pcf)
 
     def list_pcf_files(self) -> list[str]:
         return self.vpk.find_files('*.pcf')
@@ -71,10 +77,6 @@ class FileHandler:
         else:
             full_path = file_name
 
-        # create temp file for processing in working directory
-        temp_path = config.temp_dir / f"temp_{Path(file_name).name}"
-        temp_path.parent.mkdir(parents=True, exist_ok=True)
-
         try:
             # get original file info
             file_info = self.vpk.get_file_info(full_path)
@@ -85,12 +87,10 @@ class FileHandler:
 
             if isinstance(content, PCFFile):
                 # encode PCF to get bytes
-                content.encode(temp_path)
-                with open(temp_path, 'rb') as f:
-                    new_data = f.read()
-            elif isinstance(content, bytes):
+                new_data = self.encode(content)
+            elif isinstance(content, (bytes, bytearray, memoryview)):
                 # already have bytes
-                new_data = content
+                new_data = bytes(content)
             else:
                 log.error(f"Unsupported content type '{type(content).__name__}' for file {file_name}", stack_info=True)
                 return False
@@ -110,13 +110,10 @@ class FileHandler:
                     return False
 
             # patch back into VPK
+            if self.batch is not None:
+                return self.batch.queue(full_path, new_data)
             return self.vpk.patch_file(full_path, new_data, create_backup=False)
 
         except Exception:
             log.exception(f"Error processing file {file_name}")
             return False
-
-        finally:
-            # cleanup
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
@@ -1,18 +1,17 @@
 import logging
 from pathlib import Path
 
-from valve_parsers import VPKFile
-
 from core.constants import COSMETIC_VMT_PATHS
 from core.handlers.file_handler import FileHandler
-from core.util.vpk import get_vpk_name
+from core.util.vpk import VPKPatchBatch, get_vpk_name
 
 log = logging.getLogger()
 
-def find_cosmetics(tf_path: Path, proxy_name: bytes) -> list[tuple[str, bytes]]:
-    vpk_path = tf_path / get_vpk_name(tf_path)
-    vpk = VPKFile(vpk_path)
-    file_handler = FileHandler(vpk_path)
+def find_cosmetics(tf_path: Path, proxy_name: bytes, batch: VPKPatchBatch | None = None) -> list[tuple[str, bytes]]:
+    # reading through the batch sees patches that are queued but not written yet
+    if batch is None:
+        batch = VPKPatchBatch(tf_path / get_vpk_name(tf_path))
+    file_handler = FileHandler(batch.vpk)
 
     results = []
     for vmt_path in file_handler.list_vmt_files():
@@ -21,7 +20,7 @@ def find_cosmetics(tf_path: Path, proxy_name: bytes) -> list[tuple[str, bytes]]:
             continue
 
         try:
-            content = vpk.get_file_data(vmt_path)
+            content = batch.read(vmt_path)
             if content and proxy_name in content:
                 results.append((vmt_path, content))
         except Exception:
@@ -30,9 +29,13 @@ def find_cosmetics(tf_path: Path, proxy_name: bytes) -> list[tuple[str, bytes]]:
     return results
 
 
-def disable_paints(tf_path: Path):
-    file_handler = FileHandler(tf_path / get_vpk_name(tf_path))
-    painted = find_cosmetics(tf_path, b'"ItemTintColor"')
+def disable_paints(tf_path: Path, batch: VPKPatchBatch | None = None):
+    # without a caller-owned batch, patches are written once we're done
+    owns_batch = batch is None
+    if owns_batch:
+        batch = VPKPatchBatch(tf_path / get_vpk_name(tf_path))
+    file_handler = FileHandler(batch.vpk, batch)
+    painted = find_cosmetics(tf_path, b'"ItemTintColor"', batch)
 
     patched = 0
     for vmt_path, content in painted:
@@ -43,13 +46,19 @@ def disable_paints(tf_path: Path):
         except Exception:
             log.exception(f"Error processing VMT: {vmt_path}")
 
+    if owns_batch:
+        batch.commit()
+
     log.info(f"Patched {patched} cosmetic VMTs to disable paints")
 
 
-def enable_paints(tf_path: Path):
-    file_handler = FileHandler(tf_path / get_vpk_name(tf_path))
+def enable_paints(tf_path: Path, batch: VPKPatchBatch | None = None):
+    owns_batch = batch is None
+    if owns_batch:
+        batch = VPKPatchBatch(tf_path / get_vpk_name(tf_path))
+    file_handler = FileHandler(batch.vpk, batch)
 
-    disabled = find_cosmetics(tf_path, b'"XtemTintColor"')
+    disabled = find_cosmetics(tf_path, b'"XtemTintColor"', batch)
     if not disabled:
         return 0
 
@@ -62,5 +71,8 @@ def enable_paints(tf_path: Path):
         except Exception:
             log.exception(f"Error restoring paint VMT: {vmt_path}")
 
+    if owns_batch:
+        batch.commit()
+
     if restored > 0:
         log.info(f"Restored {restored} paint VMTs")
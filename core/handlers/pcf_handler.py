@@ -1,15 +1,25 @@
+import hashlib
+import json
 import logging
+from collections import defaultdict
+from functools import cache, lru_cache
 from pathlib import Path
 
-from valve_parsers import PCFElement, PCFFile, VPKFile
+from valve_parsers import AttributeType, PCFElement, PCFFile
 
 from core.config import config
-from core.util.vpk import get_vpk_name
+from core.constants import PROCESSED_PCF_CACHE_MAX_BYTES
+from core.operations.pcf_compress import COMPRESSOR_VERSION, remove_duplicate_elements
+from core.util.artifact_cache import ArtifactCache
+from core.util.pcf import PCFIndex, PCFLayout, decode_pcf, encode_pcf
+from core.util.pcf_cache import copy_pcf, load_vanilla_pcf, pcf_digest
+from core.util.vpk import VPKPatchBatch, get_vpk_name
+from core.version import VERSION
 
 log = logging.getLogger()
 
 
-def restore_particle_files(tf_path: Path) -> int:
+def restore_particle_files(tf_path: Path, batch: VPKPatchBatch | None = None) -> int:
     backup_particles_dir = config.backup_dir / "particles"
     if not backup_particles_dir.is_dir():
         raise FileNotFoundError(backup_particles_dir)
@@ -20,7 +30,10 @@ def restore_particle_files(tf_path: Path) -> int:
         log.error(f"missing {vpk_name}, is the path correct?")
         return 0
 
-    vpk = VPKFile(vpk_path)
+    # without a caller-owned batch, patches are written once we're done
+    owns_batch = batch is None
+    if owns_batch:
+        batch = VPKPatchBatch(vpk_path)
     patched_count = 0
 
     for pcf_file in backup_particles_dir.glob("*.pcf"):
@@ -32,66 +45,217 @@ def restore_particle_files(tf_path: Path) -> int:
             with open(pcf_file, 'rb') as f:
                 original_content = f.read()
 
-            if vpk.patch_file(file_path, original_content, create_backup=False):
+            if batch.queue(file_path, original_content):
                 patched_count += 1
 
         except Exception:
             log.exception(f"Error patching particle file {file_name}")
 
+    if owns_batch:
+        batch.commit()
+
     return patched_count
 
 
-def get_parent_elements(pcf: PCFFile) -> set[str]:
+def get_parent_elements(pcf: PCFFile, index: PCFIndex | None = None) -> set[str]:
+    index = index or PCFIndex(pcf)
+
     # get all system definitions
-    system_defs = pcf.get_elements_by_type('DmeParticleSystemDefinition')
-    system_definitions = {elem.element_name.decode('ascii') for elem in system_defs}
+    system_definitions = index.names_of_type('DmeParticleSystemDefinition')
 
     # get all child elements
-    child_elems = pcf.get_elements_by_type('DmeParticleChild')
-    child_elements = {elem.element_name.decode('ascii') for elem in child_elems}
+    child_elements = index.names_of_type('DmeParticleChild')
 
     # parent elements are those that aren't also children
     parent_elements = system_definitions - child_elements
     return parent_elements
 
 
-def check_parents(pcf: PCFFile, parents: set[str]) -> bool:
-    # get all system definitions
-    system_defs = pcf.get_elements_by_type('DmeParticleSystemDefinition')
-    for element in system_defs:
-        element_name = element.element_name.decode('ascii')
-        if element_name in parents:
-            return True
-    return False
+def check_parents(pcf: PCFFile, parents: set[str], index: PCFIndex | None = None) -> bool:
+    index = index or PCFIndex(pcf)
+
+    # any system definition named like a parent
+    return not parents.isdisjoint(index.names_of_type('DmeParticleSystemDefinition'))
+
 
+def update_materials(base: PCFFile, mod: PCFFile, base_index: PCFIndex | None = None) -> PCFFile:
+    base_index = base_index or PCFIndex(base)
 
-def update_materials(base: PCFFile, mod: PCFFile) -> PCFFile:
     # build map of element name to material
     mod_materials = {}
     for element in mod.elements:
-        element_name = element.element_name.decode('ascii')
         if b'material' in element.attributes:
-            mod_materials[element_name] = element.attributes[b'material']
+            mod_materials[element.element_name] = element.attributes[b'material']
 
     result = PCFFile(base.input_file)
     result.version = base.version
     result.string_dictionary = base.string_dictionary.copy()
-    result.elements = []
 
-    for element in base.elements:
-        # create copy
-        new_element = PCFElement(
+    # create copies
+    result.elements = [
+        PCFElement(
             type_name_index=element.type_name_index,
             element_name=element.element_name,
             data_signature=element.data_signature,
             attributes=element.attributes.copy()
         )
+        for element in base.elements
+    ]
 
-        # update material
-        element_name = element.element_name.decode('ascii')
-        if element_name in mod_materials:
-            new_element.attributes[b'material'] = mod_materials[element_name]
-
-        result.elements.append(new_element)
+    # update materials
+    for element_name, material in mod_materials.items():
+        for idx in base_index.indices_of(element_name):
+            result.elements[idx].attributes[b'material'] = material
 
     return result
+
+
+@lru_cache(maxsize=1)
+def _load_base_pcf(base_path: Path, base_digest: str) -> PCFIndex:
+    # decoded and indexed once per process and base contents, the GUI process outlives game updates
+    return PCFIndex(load_vanilla_pcf(base_path))
+
+
+@lru_cache(maxsize=1)
+def _load_compressed_base(base_path: Path, base_digest: str) -> PCFLayout:
+    # the base as `process_particle_file()` would write it without any material changes
+    return PCFLayout(encode_pcf(remove_duplicate_elements(copy_pcf(_load_base_pcf(base_path, base_digest).pcf))))
+
+
+def patch_materials(base_index: PCFIndex, base_layout: PCFLayout, mod_layout: PCFLayout) -> bytes | None:
+    """
+    Apply a mod's materials to the compressed base PCF by patching its encoded bytes.
+
+    Produces the same bytes as `update_materials()` followed by compressing and encoding, without decoding the
+    mod or compressing the base again. Only material changes that cannot affect the compression are patched:
+    string materials on particle systems that already have a non-default one, and on child references.
+
+    This deliberately handles materials only, since they are all `update_materials()` takes from a mod's copy of
+    the base PCF. It is not a general patcher for other attributes, those go through the decoded PCFs.
+
+    Args:
+        base_index: Index of the decoded base PCF.
+        base_layout: Layout of the compressed base PCF, see `_load_compressed_base()`.
+        mod_layout: Layout of the mod's PCF.
+
+    Returns:
+        The encoded PCF, or None if the materials have to be applied to the decoded PCFs instead.
+    """
+
+    base = base_index.pcf
+    default_material = b'vgui/white'
+
+    # later elements win, like `update_materials()`
+    mod_materials = {}
+    for idx, element_name in enumerate(mod_layout.element_names):
+        material = mod_layout.value(idx, b'material')
+        if material is not None:
+            mod_materials[element_name] = material
+
+    targets = defaultdict(set)
+    for idx, element_name in enumerate(base_layout.element_names):
+        type_name = base_layout.type_name(idx)
+        if type_name in (b'DmeParticleSystemDefinition', b'DmeParticleChild'):
+            targets[element_name].add(idx)
+
+    # children pointing at the same system are merged regardless of their names
+    child_names = defaultdict(set)
+    for idx in base_index.of_type('DmeParticleChild'):
+        element = base.elements[idx]
+        child = element.attributes.get(b'child')
+        if child is not None:
+            child_names[child[1]].add(element.element_name)
+
+    values = {}
+    for element_name, (attr_type, material) in mod_materials.items():
+        indices = base_index.indices_of(element_name)
+        if not indices:
+            continue
+        # default materials are dropped from systems, a different one would change what gets compressed
+        if attr_type != AttributeType.STRING or material == default_material:
+            return None
+        for idx in indices:
+            element = base.elements[idx]
+            type_name = base.string_dictionary[element.type_name_index]
+            current = element.attributes.get(b'material')
+            if type_name == b'DmeParticleSystemDefinition':
+                if current is None or current[0] != AttributeType.STRING or current[1] == default_material:
+                    return None
+            elif type_name != b'DmeParticleChild' or current is not None:
+                # children without materials all stay alike, anything else might merge differently
+                return None
+            elif len(child_names[element.attributes.get(b'child', (None, None))[1]]) > 1:
+                return None
+        for idx in targets[element_name]:
+            values[idx, b'material'] = material
+
+    try:
+        return base_layout.patch(values)
+    except ValueError:
+        return None
+
+
+@cache
+def processed_pcf_cache() -> ArtifactCache:
+    """Encoded outputs of `process_particle_file()` in `config.processed_pcf_cache_dir`, shared by this process."""
+    return ArtifactCache(config.processed_pcf_cache_dir, PROCESSED_PCF_CACHE_MAX_BYTES, suffix='.pcf')
+
+
+def _processed_pcf_key(pcf_path: Path, data: bytes, base_path: Path, base_digest: str, base_parents: set[str]) -> str:
+    # everything the output depends on
+    state = {
+        'version': VERSION,
+        'compressor': COMPRESSOR_VERSION,
+        'mod': pcf_digest(data),
+        'base': base_digest,
+        'is_base': pcf_path.name == base_path.name,
+        'base_parents': sorted(base_parents),
+    }
+    return hashlib.blake2b(json.dumps(state, sort_keys=True).encode(), digest_size=20).hexdigest()
+
+
+def process_particle_file(pcf_path: Path, base_path: Path, base_digest: str, base_parents: set[str]) -> bytes | None:
+    """
+    Decode, compress and encode a single staged particle file.
+
+    Runs inside the install's process pool, so it only takes and returns picklable values. Results are memoized in
+    `processed_pcf_cache()` by the contents of the mod and base PCF, so files that did not change since a previous
+    install skip the whole pipeline. Skipped files are stored as empty entries.
+
+    Args:
+        pcf_path: The staged mod PCF.
+        base_path: The vanilla base PCF (disguise.pcf) that owns the default parent systems.
+        base_digest: `pcf_digest()` of the base PCF, computed once by the caller rather than in every worker call.
+        base_parents: Parent systems of the base PCF, see `get_parent_elements()`.
+
+    Returns:
+        The encoded PCF, or None if the file would override the base PCF's systems and should be skipped.
+    """
+
+    data = pcf_path.read_bytes()
+    cache = processed_pcf_cache()
+    key = _processed_pcf_key(pcf_path, data, base_path, base_digest, base_parents)
+    encoded_pcf = cache.get(key)
+    if encoded_pcf is None:
+        encoded_pcf = _process_particle_data(pcf_path, data, base_path, base_digest, base_parents) or b''
+        cache.put(key, encoded_pcf)
+    return encoded_pcf or None
+
+
+def _process_particle_data(pcf_path: Path, data: bytes, base_path: Path, base_digest: str,
+                           base_parents: set[str]) -> bytes | None:
+    if pcf_path.name == base_path.name:
+        encoded_pcf = patch_materials(_load_base_pcf(base_path, base_digest),
+                                      _load_compressed_base(base_path, base_digest), PCFLayout(data))
+        if encoded_pcf is not None:
+            return encoded_pcf
+
+    mod_pcf = decode_pcf(pcf_path, data)
+
+    if pcf_path.name == base_path.name:
+        base_index = _load_base_pcf(base_path, base_digest)
+        mod_pcf = update_materials(base_index.pcf, mod_pcf, base_index)
+    elif check_parents(mod_pcf, base_parents):
+        return None
+
+    return encode_pcf(remove_duplicate_elements(mod_pcf))
@@ -2,11 +2,9 @@ import logging
 import shutil
 from pathlib import Path
 
-from valve_parsers import VPKFile
-
 from core.config import config
 from core.handlers.file_handler import FileHandler
-from core.util.vpk import get_vpk_name
+from core.util.vpk import VPKPatchBatch, get_vpk_name
 
 log = logging.getLogger()
 
@@ -16,7 +14,7 @@ def is_skybox_vmt(file_path: Path) -> bool:
             file_path.suffix.lower() == '.vmt')
 
 
-def handle_skybox_mods(temp_dir: Path, tf_path: Path) -> int:
+def handle_skybox_mods(temp_dir: Path, tf_path: Path, batch: VPKPatchBatch | None = None) -> int:
     # use specific path for skybox VMTs for better performance
     skybox_dir = temp_dir / 'materials' / 'skybox'
     if not skybox_dir.exists():
@@ -27,9 +25,12 @@ def handle_skybox_mods(temp_dir: Path, tf_path: Path) -> int:
         return 0
 
     log.info(f"Found {len(skybox_vmts)} skybox vmts in {temp_dir.name}")
-    vpk_file = tf_path / get_vpk_name(tf_path)
+    # without a caller-owned batch, patches are written once we're done
+    owns_batch = batch is None
+    if owns_batch:
+        batch = VPKPatchBatch(tf_path / get_vpk_name(tf_path))
     patched_count = 0
-    file_handler = FileHandler(vpk_file)
+    file_handler = FileHandler(batch.vpk, batch)
     for vmt_file in skybox_vmts:
         try:
             with vmt_file.open('rb') as f:
@@ -63,15 +64,20 @@ def handle_skybox_mods(temp_dir: Path, tf_path: Path) -> int:
         except Exception:
             log.exception(f"Error processing skybox VMT {vmt_file}")
 
+    if owns_batch:
+        batch.commit()
+
     return patched_count
 
 
-def restore_skybox_files(tf_path: Path) -> int:
+def restore_skybox_files(tf_path: Path, batch: VPKPatchBatch | None = None) -> int:
     backup_skybox_dir = config.install_dir / "backup/materials/skybox"
     if not backup_skybox_dir.exists():
         return 0
 
-    vpk = VPKFile(tf_path / get_vpk_name(tf_path))
+    owns_batch = batch is None
+    if owns_batch:
+        batch = VPKPatchBatch(tf_path / get_vpk_name(tf_path))
     restored_count = 0
 
     for skybox_vmt in backup_skybox_dir.glob("*.vmt"):
@@ -83,10 +89,13 @@ def restore_skybox_files(tf_path: Path) -> int:
             with open(skybox_vmt, 'rb') as f:
                 original_content = f.read()
 
-            if vpk.patch_file(file_path, original_content, create_backup=False):
+            if batch.queue(file_path, original_content):
                 restored_count += 1
 
         except Exception:
             log.exception(f"Error restoring skybox {vmt_name}")
 
+    if owns_batch:
+        batch.commit()
+
     return restored_count
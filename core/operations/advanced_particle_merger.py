@@ -1,18 +1,24 @@
 import logging
+import os
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from pathlib import Path
 
 from valve_parsers import PCFFile
 
 from core.config import config
-from core.constants import PARTICLE_SPLITS
-from core.operations.pcf_merge import merge_pcf_files
+from core.constants import PARTICLE_IMPORT_MEMORY_BUDGET, PARTICLE_SPLITS
+from core.operations.pcf_merge import merge_many, merge_pcf_files
 from core.operations.pcf_rebuild import (
-    extract_elements,
+    extract_element_groups,
     get_pcf_element_names,
     load_particle_system_map,
     rebuild_particle_files,
 )
+from core.util.pcf import decode_pcf, encoded_size
+from core.util.pcf_fragments import fragment_library
+from core.util.pcf_toc import write_pcf
+from core.util.stages import process_pool
 
 log = logging.getLogger()
 
@@ -20,19 +26,12 @@ log = logging.getLogger()
 def sequential_merge(pcf_files: list[PCFFile]):
     if not pcf_files:
         return None
-    result = pcf_files[0]
-    for pcf in pcf_files[1:]:
-        try:
-            result = merge_pcf_files(result, pcf)
-        except ValueError:
-            log.warning("Skipping PCF file due to merge error")
-            continue
-    return result
+    return merge_many(pcf_files)
 
 
-def default_max_size_for_mod_merge(pcf_files: list[Path]) -> int:
+def default_max_size_for_mod_merge(pcf_sizes: list[int]) -> int:
     # this is just for simplicity’s sake, might change this later
-    file_sizes = [(i, Path(file).stat().st_size) for i, file in enumerate(pcf_files)]
+    file_sizes = list(enumerate(pcf_sizes))
     return max(file_sizes, key=lambda x: x[1])[0]
 
 
@@ -44,6 +43,24 @@ def find_duplicate_elements(pcf_files: list[PCFFile]) -> dict[str, list[int]]:
     return {elem: sources for elem, sources in element_sources.items() if len(sources) > 1}
 
 
+def missing_systems(group_files: list[tuple[PCFFile | Path, int, list[str]]], vanilla_systems: list[str]) -> set[str]:
+    """
+    Particle systems of a target file that a mod's PCFs for it leave out, these are filled in from vanilla.
+
+    Same as `process_particle_group()` decides once the PCFs are decoded: if they share a system only the largest
+    one is kept, otherwise they are merged.
+    """
+
+    file_names = [names for _, _, names in group_files]
+    all_names = {name for names in file_names for name in names}
+    # like `find_duplicate_elements()`, a name counts as a duplicate even if it's twice in the same PCF
+    if sum(len(names) for names in file_names) > len(all_names):
+        elements_we_have = set(file_names[default_max_size_for_mod_merge([size for _, size, _ in group_files])])
+    else:
+        elements_we_have = all_names
+    return {element for element in vanilla_systems if element not in elements_we_have}
+
+
 def save_split_files(merged_pcf: PCFFile, out_dir: Path, split_filters: dict) -> None:
     mod_elements = get_pcf_element_names(merged_pcf)
     split_elements = {}  # {split_name: set(elements)}
@@ -61,18 +78,72 @@ def save_split_files(merged_pcf: PCFFile, out_dir: Path, split_filters: dict) ->
                 unmatched_elements -= matched
 
     # save splits to actual_particles/
-    for split_name, elements in split_elements.items():
-        split_pcf = extract_elements(merged_pcf, elements)
+    for split_name, split_pcf in extract_element_groups(merged_pcf, split_elements).items():
         output_path = out_dir / "actual_particles" / split_name
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        split_pcf.encode(output_path)
+        write_pcf(split_pcf, output_path)
+
+
+def process_particle_group(particle_group: str, group_files: list[tuple[PCFFile | Path, int, list[str]]],
+                           elements_we_still_need: set[str], vanilla_path: Path, out_dir: Path) -> None:
+    """
+    Merge everything a mod has for one target particle file and write the result to `actual_particles/`.
+
+    Runs inside the import's process pool, so it only takes picklable values.
+
+    Args:
+        particle_group: The target particle file, e.g. `item_fx.pcf`.
+        group_files: The extracted PCFs, or the paths they were spilled to, their encoded sizes and system names.
+        elements_we_still_need: The systems to fill in, see `missing_systems()`.
+        vanilla_path: The vanilla target, missing systems are filled in from its fragments.
+        out_dir: The mod's folder.
+    """
+
+    pcf_files = [particle if isinstance(particle, PCFFile) else decode_pcf(particle)
+                 for particle, _, _ in group_files]
+    duplicates = find_duplicate_elements(pcf_files)
+
+    if duplicates:
+        choice = default_max_size_for_mod_merge([size for _, size, _ in group_files])
+        chosen_pcf = pcf_files[choice]
+    else:
+        result = sequential_merge(pcf_files)
+
+    if elements_we_still_need:
+        game_elements = fragment_library().assemble(vanilla_path, elements_we_still_need)
+
+        if duplicates:
+            try:
+                result = merge_pcf_files(chosen_pcf, game_elements)
+            except ValueError:
+                log.warning("Failed to merge with game elements")
+                result = chosen_pcf
+        else:
+            pcf_files.append(game_elements)
+            result = sequential_merge(pcf_files)
+    else:
+        result = chosen_pcf if duplicates else result
+
+    if particle_group in PARTICLE_SPLITS:
+        save_split_files(result, out_dir, PARTICLE_SPLITS[particle_group])
+    else:
+        actual_particles = Path(out_dir / "actual_particles" / particle_group)
+        actual_particles.parent.mkdir(parents=True, exist_ok=True)
+        write_pcf(result, actual_particles)
 
 
 class AdvancedParticleMerger:
-    def __init__(self, progress_callback=None):
+    def __init__(self, progress_callback=None, memory_budget: int = PARTICLE_IMPORT_MEMORY_BUDGET,
+                 workers: int | None = None):
         self.progress_callback = progress_callback
+        # processes used for the target files, defaults to `--jobs` or the CPU count
+        self.workers = workers
         self.particle_map = load_particle_system_map(config.data_dir / "particle_system_map.json")
-        self.vpk_groups = defaultdict(lambda: defaultdict(list))  # {vpk_name: {particle_file: [paths]}}
+        # {vpk_name: {particle_file: [(extracted PCF or the path it was spilled to, encoded size, system names)]}}
+        self.vpk_groups = defaultdict(lambda: defaultdict(list))
+        # extracted PCFs are handed to process_vpk_group() as-is until their encoded size passes the budget
+        self.memory_budget = memory_budget
+        self.memory_used = 0
 
     def update_progress(self, progress, message: str):
         if self.progress_callback:
@@ -89,62 +160,68 @@ class AdvancedParticleMerger:
 
         # group files by their target particle file
         for particle in particles_filter:
-            for particle_file_target, elements_to_extract, source_pcf in (
-                    rebuild_particle_files(particle, self.particle_map)):
-                output_path = (
-                    config.temp_to_be_processed_dir
-                    / f"{len(self.vpk_groups[vpk_folder_name][particle_file_target])}_{particle_file_target}"
-                )
-                output_path.parent.mkdir(parents=True, exist_ok=True)
-                extract_elements(source_pcf, elements_to_extract).encode(output_path)
-                self.vpk_groups[vpk_folder_name][particle_file_target].append(output_path)
+            targets = rebuild_particle_files(particle, self.particle_map)
+            if not targets:
+                continue
+
+            # every target comes from the same mod PCF, extract them all in one go
+            source_pcf = targets[0][2]
+            elements_to_extract = {particle_file_target: elements for particle_file_target, elements, _ in targets}
+            for particle_file_target, target_pcf in extract_element_groups(source_pcf, elements_to_extract).items():
+                group = self.vpk_groups[vpk_folder_name][particle_file_target]
+                size = encoded_size(target_pcf)
+                names = get_pcf_element_names(target_pcf)
+                if self.memory_used + size > self.memory_budget:
+                    output_path = config.temp_to_be_processed_dir / f"{len(group)}_{particle_file_target}"
+                    output_path.parent.mkdir(parents=True, exist_ok=True)
+                    target_pcf.encode(output_path)
+                    group.append((output_path, size, names))
+                else:
+                    # the extracted PCFs share the source's string dictionary, merging appends to it
+                    target_pcf.string_dictionary = target_pcf.string_dictionary.copy()
+                    self.memory_used += size
+                    group.append((target_pcf, size, names))
 
         self.process_vpk_group(vpk_folder_name, out_dir)
 
     def process_vpk_group(self, vpk_name: str, out_dir: Path) -> None:
-        splits_config = PARTICLE_SPLITS
-
-        for particle_group, group_files in self.vpk_groups[vpk_name].items():
-            pcf_files = [PCFFile(particle).decode() for particle in group_files]
-            duplicates = find_duplicate_elements(pcf_files)
-
-            if duplicates:
-                choice = default_max_size_for_mod_merge(group_files)
-                chosen_pcf = pcf_files[choice]
-                elements_we_have = get_pcf_element_names(chosen_pcf)
-            else:
-                result = sequential_merge(pcf_files)
-                elements_we_have = get_pcf_element_names(result)
-
-            elements_we_still_need = set()
-            for element in self.particle_map[f'particles/{particle_group}']:
-                if element not in elements_we_have:
-                    elements_we_still_need.add(element)
-
-            if elements_we_still_need:
-                game_file_path = config.temp_to_be_referenced_dir / particle_group
-                game_file_path.parent.mkdir(parents=True, exist_ok=True)
-                game_file_in = PCFFile(game_file_path).decode()
-                game_elements = extract_elements(game_file_in, elements_we_still_need)
-
-                if duplicates:
-                    try:
-                        result = merge_pcf_files(chosen_pcf, game_elements)
-                    except ValueError:
-                        log.warning("Failed to merge with game elements")
-                        result = chosen_pcf
-                else:
-                    pcf_files.append(game_elements)
-                    result = sequential_merge(pcf_files)
-            else:
-                result = chosen_pcf if duplicates else result
-
-            if particle_group in splits_config:
-                save_split_files(result, out_dir, splits_config[particle_group])
-            else:
-                actual_particles = Path(out_dir / "actual_particles" / particle_group)
-                actual_particles.parent.mkdir(parents=True, exist_ok=True)
-                result.encode(actual_particles)
+        groups = self.vpk_groups.pop(vpk_name, {})
+        missing = {particle_group: missing_systems(group_files, self.particle_map[f'particles/{particle_group}'])
+                   for particle_group, group_files in groups.items()}
+
+        # build the fragments of every vanilla file that fills in systems in one go, workers only read them
+        fragment_library().update(config.temp_to_be_referenced_dir / particle_group
+                                  for particle_group, systems in missing.items() if systems)
+
+        def next_group() -> tuple:
+            particle_group = next(iter(groups))
+            return (particle_group, groups.pop(particle_group), missing[particle_group],
+                    config.temp_to_be_referenced_dir / particle_group, out_dir)
+
+        def finished(group_files: list[tuple[PCFFile | Path, int, list[str]]]) -> None:
+            self.memory_used -= sum(size for particle, size, _ in group_files if isinstance(particle, PCFFile))
+
+        # every target file is independent, big packs touching dozens of them get spread over worker processes
+        workers = min(self.workers or config.jobs or os.cpu_count() or 1, len(groups)) or 1
+        if workers > 1:
+            log.info(f"Processing {len(groups)} particle files with {workers} worker(s)")
+            with process_pool(workers) as executor:
+                # in-memory PCFs are pickled to the workers, only one group per worker is handed over at a time so
+                # the pickled copies stay within a few groups on top of the budget
+                running: dict[Future, list] = {}
+                while groups or running:
+                    while groups and len(running) < workers:
+                        group_args = next_group()
+                        running[executor.submit(process_particle_group, *group_args)] = group_args[1]
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finished(running.pop(future))
+                        future.result()
+        else:
+            while groups:
+                group_args = next_group()
+                process_particle_group(*group_args)
+                finished(group_args[1])
 
         for file in config.temp_to_be_processed_dir.glob('*'):
             file.unlink()
@@ -4,6 +4,7 @@ from pathlib import Path
 from valve_parsers import PCFFile, VPKFile
 
 from core.handlers.pcf_handler import get_parent_elements
+from core.util.pcf_cache import load_vanilla_pcf
 
 log = logging.getLogger()
 
@@ -94,7 +95,7 @@ def initialize_pcf(dir: Path) -> tuple[PCFFile, set[str]]:
             "interfering with the temp folder."
         )
 
-    default_base_pcf = PCFFile(default_base_path).decode()
+    default_base_pcf = load_vanilla_pcf(default_base_path)
     return default_base_pcf, get_parent_elements(default_base_pcf)
 
 
@@ -25,7 +25,7 @@ from pathlib import Path
 
 from valve_parsers import MDLFile
 
-from core.util.file import move
+from core.util.file import move, unshare
 
 log = logging.getLogger()
 
@@ -308,6 +308,8 @@ def _relocate_one_mdl(
             except OSError:
                 break
 
+    # staged files may be links to the addon's own files
+    unshare(mdl_path)
     mdl.rewrite_material_dirs(new_dirs + fallback_dirs)
     return relocations
 
@@ -413,6 +415,7 @@ def _relocate_material_names(working_root: Path, mdl_paths: list[Path], relocati
         new_names = [rewrite_name(m) for m in mdl.materials]
         if new_names == mdl.materials:
             continue
+        unshare(mdl_path)
         mdl.rewrite_materials(new_names)
         for old, new in zip(mdl.materials, new_names):
             if old != new:
@@ -435,6 +438,7 @@ def _update_vmt_refs(working_root: Path, relocations: list[Relocation]) -> None:
         text = original.replace("\\", "/")
         new_text = _apply_path_rewrites(text, pattern, mapping, materials_root)
         if new_text != original:
+            unshare(vmt)
             vmt.write_text(new_text, encoding="utf-8")
             log.debug(f"rewrote refs in materials/{vmt.relative_to(materials_root)}")
 
@@ -1,204 +1,256 @@
+import hashlib
+import marshal
+from array import array
+
 from valve_parsers import PCFElement, PCFFile, AttributeType
 
 from core.constants import ATTRIBUTE_DEFAULTS, ELEMENT_DEFAULTS
-
-
-
-def get_element_hash(element: PCFElement):
-    sorted_attrs = tuple(
-        (name, attr_type, value if not isinstance(value, list) else tuple(value))
-        for name, (attr_type, value) in sorted(element.attributes.items())
-    )
-    return hash(sorted_attrs)
-
-
-def find_duplicate_array_elements(pcf: PCFFile):
-    # find duplicate elements referenced in array attributes
-    hash_to_indices = {}
-
-    for element in pcf.elements:
-        for attr_name, (attr_type, value) in element.attributes.items():
-            if attr_type == AttributeType.ELEMENT_ARRAY:
-                for idx in value:
-                    if idx < len(pcf.elements):
-                        referenced_element = pcf.elements[idx]
-                        ref_type_name = pcf.string_dictionary[referenced_element.type_name_index].decode('ascii')
-                        if ref_type_name not in ('DmeElement','DmElement', 'DmeParticleSystemDefinition'):
-                            element_hash = get_element_hash(referenced_element)
-                            if element_hash not in hash_to_indices:
-                                hash_to_indices[element_hash] = []
-                            hash_to_indices[element_hash].append(idx)
-
-    return {hash_: indices for hash_, indices in hash_to_indices.items() if len(indices) > 1}
-
-
-def update_array_indices(pcf: PCFFile, duplicates):
-    # update ELEMENT_ARRAY indices to reuse the first occurrence of duplicate elements.
-    # create a mapping of old indices to their replacement
-    index_map = {}
-    for indices in duplicates.values():
-        # deduplicate the indices list first
-        unique_indices = list(dict.fromkeys(indices))
-        first_index = unique_indices[0]
-        for idx in unique_indices[1:]:
-            index_map[idx] = first_index
-
-    # update all ELEMENT_ARRAY attributes in the PCF
-    for element in pcf.elements:
-        for attr_name, (attr_type, value) in element.attributes.items():
-            if attr_type == AttributeType.ELEMENT_ARRAY:
-                # update indices in the array
-                new_value = [index_map.get(idx, idx) for idx in value]
-                element.attributes[attr_name] = (attr_type, new_value)
-
-
-def reorder_elements(pcf: PCFFile, duplicates):
-    # deduplicate indices lists and build mapping
-    # same index can appear multiple times if referenced from multiple arrays
-    duplicate_indices = set()
-    duplicate_to_first = {}
-
-    for indices in duplicates.values():
-        unique_indices = list(dict.fromkeys(indices))
-        first_idx = unique_indices[0]
-        for dup_idx in unique_indices[1:]:
-            duplicate_indices.add(dup_idx)
-            duplicate_to_first[dup_idx] = first_idx
-
-    # create new list without duplicates and mapping of old to new indices
+from core.util.pcf import NULL_ELEMENT, PCFIndex, PCFVisitor, element_references
+
+
+# compiled once, keyed by raw attribute name, only types `_remove_default_attributes` can compare
+def _compile_defaults(defaults: list[tuple[str, object]]) -> dict[bytes, object]:
+    return {
+        name.encode('ascii'): value for name, value in defaults
+        if isinstance(value, (int, float, bool, bytes)) or (isinstance(value, tuple) and len(value) in (3, 4))
+    }
+
+
+_ELEMENT_DEFAULTS = _compile_defaults(ELEMENT_DEFAULTS)
+_ATTRIBUTE_DEFAULTS = _compile_defaults(ATTRIBUTE_DEFAULTS)
+
+# part of the keys of memoized outputs, bump whenever `remove_duplicate_elements()` produces different bytes
+COMPRESSOR_VERSION = 2
+
+# never merged, the root is referenced by position and systems are looked up by name
+UNMERGEABLE_TYPES = {b'DmeElement', b'DmElement', b'DmeParticleSystemDefinition'}
+
+_FLOAT_TYPES = {
+    AttributeType.VECTOR2, AttributeType.VECTOR3, AttributeType.VECTOR4, AttributeType.QANGLE,
+    AttributeType.QUATERNION, AttributeType.MATRIX, AttributeType.FLOAT_ARRAY, AttributeType.TIME_ARRAY,
+    AttributeType.VECTOR2_ARRAY, AttributeType.VECTOR3_ARRAY, AttributeType.VECTOR4_ARRAY,
+    AttributeType.QANGLE_ARRAY, AttributeType.QUATERNION_ARRAY, AttributeType.MATRIX_ARRAY,
+}
+
+
+def _unsigned_zeros(value):
+    # -0.0 == 0.0, but marshal keeps the sign and equal values would get different digests
+    if isinstance(value, float):
+        return value + 0.0
+    if isinstance(value, (tuple, list)):
+        return tuple(_unsigned_zeros(item) for item in value)
+    return value
+
+
+def find_duplicate_subtrees(pcf: PCFFile, visitor: PCFVisitor | None = None) -> dict[int, int]:
+    """
+    Find elements whose entire subtree is identical to that of an earlier element.
+
+    Every element gets a digest computed bottom-up from its type, name, attributes and the digests of the
+    elements it references, so two elements only share a digest when everything below them matches too.
+    Unmergeable elements and references that close a cycle stand for their own index instead. Float components
+    are compared by value, so `-0.0` matches `0.0`. Child references that point at a system are compared without
+    their names, which are only used to find the system when the reference is missing.
+
+    Args:
+        pcf: The PCF to search.
+        visitor: Passes to run on every element first, fused into the same traversal. Each element is visited
+                 before its references are followed, so its digest covers the rewritten subtree.
+
+    Returns:
+        Mapping of each duplicate's index to the index of the first element with the same subtree.
+    """
+
+    elements = pcf.elements
+    count = len(elements)
+    unmergeable = {i for i, string in enumerate(pcf.string_dictionary) if string in UNMERGEABLE_TYPES}
+    child_types = {i for i, string in enumerate(pcf.string_dictionary) if string == b'DmeParticleChild'}
+    tokens: list[bytes | None] = [None] * count
+    state = bytearray(count)  # 0 unvisited, 1 children pending, 2 done
+
+    def token(idx: int) -> bytes:
+        if idx == NULL_ELEMENT:
+            return b'-'
+        if idx >= count or state[idx] != 2:
+            return b'#%d' % idx
+        return tokens[idx]
+
+    first_by_digest: dict[bytes, int] = {}
+    duplicate_to_first: dict[int, int] = {}
+    for start in range(count):
+        if state[start]:
+            continue
+
+        # iterative post-order walk, children get their digest before their parents
+        stack = [start]
+        while stack:
+            idx = stack[-1]
+            if state[idx] == 0:
+                state[idx] = 1
+                if visitor is not None:
+                    visitor.visit(idx)
+                element = elements[idx]
+                if element.type_name_index in unmergeable:
+                    tokens[idx] = b'#%d' % idx
+                    state[idx] = 2
+                    stack.pop()
+                    continue
+                stack.extend(child for child in element_references(element) if child < count and not state[child])
+                continue
+
+            stack.pop()
+            if state[idx] == 2:
+                continue
+
+            element = elements[idx]
+            attributes = []
+            for attr_name, (attr_type, value) in sorted(element.attributes.items()):
+                if attr_type == AttributeType.ELEMENT:
+                    value = token(value)
+                elif attr_type == AttributeType.ELEMENT_ARRAY:
+                    value = tuple(token(child) for child in value)
+                elif attr_type == AttributeType.FLOAT or attr_type == AttributeType.TIME:
+                    value = value + 0.0
+                elif attr_type in _FLOAT_TYPES:
+                    value = _unsigned_zeros(value)
+                attributes.append((attr_name, int(attr_type), value))
+
+            # marshal format 2 has no back-references, equal keys always serialize to the same bytes
+            element_name = element.element_name
+            if element.type_name_index in child_types:
+                attr_type, child = element.attributes.get(b'child', (None, NULL_ELEMENT))
+                if attr_type == AttributeType.ELEMENT and child != NULL_ELEMENT and child < count:
+                    element_name = b''
+            key = (pcf.string_dictionary[element.type_name_index], element_name, tuple(attributes))
+            digest = hashlib.blake2b(marshal.dumps(key, 2), digest_size=16).digest()
+            tokens[idx] = digest
+            state[idx] = 2
+
+            first = first_by_digest.setdefault(digest, idx)
+            if first != idx:
+                duplicate_to_first[idx] = first
+
+    return duplicate_to_first
+
+
+def compact_elements(pcf: PCFFile, duplicate_to_first: dict[int, int] | None = None) -> PCFFile:
+    """
+    Drop duplicate elements and unused strings, remapping every reference in a single pass.
+
+    The duplicate mapping and the new positions of the kept elements are composed into one old to new index
+    array up front. References to dropped elements point at their first occurrence, references past the end of
+    the element list are removed from arrays and left alone otherwise. The string dictionary is rebuilt from the
+    type and attribute names still in use, sorted for consistency.
+    """
+
+    duplicate_to_first = duplicate_to_first or {}
+    elements = pcf.elements
+    count = len(elements)
+
+    # compose "first occurrence of" with "new position of" into a single lookup array
+    old_to_new = array('I', bytes(4 * count))
     new_elements = []
-    old_to_new = {}
-    new_index = 0
-
-    for old_index, element in enumerate(pcf.elements):
-        if old_index not in duplicate_indices:
-            old_to_new[old_index] = new_index
+    for old_index, element in enumerate(elements):
+        if old_index not in duplicate_to_first:
+            old_to_new[old_index] = len(new_elements)
             new_elements.append(element)
-            new_index += 1
+    for old_index, first_index in duplicate_to_first.items():
+        old_to_new[old_index] = old_to_new[first_index]
 
-    # update all references in every element
+    used_strings = set()
+    type_names = []
     for element in new_elements:
+        type_name = pcf.string_dictionary[element.type_name_index]
+        type_names.append(type_name)
+        used_strings.add(type_name)
+        used_strings.update(element.attributes.keys())
+
         for attr_name, (attr_type, value) in element.attributes.items():
             if attr_type == AttributeType.ELEMENT_ARRAY:
-                # map each index to its new position
-                new_value = []
-                for idx in value:
-                    # if it's a duplicate, use the first occurrence
-                    if idx in duplicate_to_first:
-                        idx = duplicate_to_first[idx]
-                    # only add if valid index
-                    if idx in old_to_new:
-                        new_value.append(old_to_new[idx])
-                element.attributes[attr_name] = (attr_type, new_value)
-            elif attr_type == AttributeType.ELEMENT:
-                # handle single element references
-                if value in duplicate_to_first:
-                    value = duplicate_to_first[value]
+                # only keep valid indices
+                element.attributes[attr_name] = (attr_type, [old_to_new[idx] for idx in value if idx < count])
+            elif attr_type == AttributeType.ELEMENT and value < count:
                 # only update if valid index, otherwise leave alone
-                if value in old_to_new:
-                    element.attributes[attr_name] = (attr_type, old_to_new[value])
-
-    # replace the elements list with our reordered version
-    pcf.elements = new_elements
-
-
-def optimize_string_dictionary(pcf: PCFFile):
-    # collect used strings in one pass
-    used_strings = set()
-    for element in pcf.elements:
-        # add type name
-        used_strings.add(pcf.string_dictionary[element.type_name_index])
-        # add attribute names
-        used_strings.update(element.attributes.keys())
-
-    # create new minimal dictionary
-    new_dictionary = sorted(list(used_strings))  # sort for consistency
-    old_to_new = {old_str: i for i, old_str in enumerate(new_dictionary)}
+                element.attributes[attr_name] = (attr_type, old_to_new[value])
 
-    # update element type name indices
-    for element in pcf.elements:
-        old_type = pcf.string_dictionary[element.type_name_index]
-        element.type_name_index = old_to_new[old_type]
+    # create new minimal dictionary and update element type name indices
+    new_dictionary = sorted(used_strings)
+    string_indices = {string: i for i, string in enumerate(new_dictionary)}
+    for element, type_name in zip(new_elements, type_names):
+        element.type_name_index = string_indices[type_name]
 
-    # set new dictionary
+    pcf.elements = new_elements
     pcf.string_dictionary = new_dictionary
-
     return pcf
 
 
-def _remove_default_attributes(element: PCFElement, defaults_dict: dict):
+def _remove_default_attributes(element: PCFElement, defaults: dict[bytes, object]):
     # helper
-    attributes_to_remove = []
-    for attr_name, (attr_type, value) in element.attributes.items():
-        attr_name_str = attr_name.decode('ascii')
-        if attr_name_str in defaults_dict:
-            default_value = defaults_dict[attr_name_str]
-            matches_default = False
-            if isinstance(default_value, (int, float, bool)):
-                matches_default = value == default_value
-            elif isinstance(default_value, tuple) and len(default_value) in (3, 4):
-                matches_default = value == default_value
-            elif isinstance(default_value, bytes):
-                matches_default = value == default_value
-            if matches_default:
-                attributes_to_remove.append(attr_name)
-
+    attributes_to_remove = [
+        attr_name for attr_name, (attr_type, value) in element.attributes.items()
+        if attr_name in defaults and value == defaults[attr_name]
+    ]
     for attr_name in attributes_to_remove:
         del element.attributes[attr_name]
 
 
-def combined_cleanup_pass(pcf: PCFFile):
-    # convert defaults lists to dicts for O(1) lookup
-    attribute_defaults_dict = {name: value for name, value in ATTRIBUTE_DEFAULTS}
-    element_defaults_dict = {name: value for name, value in ELEMENT_DEFAULTS}
+def cleanup_visitor(pcf: PCFFile, index: PCFIndex | None = None) -> PCFVisitor:
+    """
+    The cleanup passes as element handlers, see `combined_cleanup_pass()`.
+
+    Args:
+        pcf: The PCF to clean up.
+        index: Index of `pcf`, used to find the particle systems.
+    """
 
-    # first build system indices map for child reference fixing
+    # system indices map for child reference fixing
     system_indices = {}
-    system_defs = pcf.get_elements_by_type('DmeParticleSystemDefinition')
-    for element in system_defs:
-        name = element.element_name.decode('ascii')
-        system_indices[name] = pcf.elements.index(element)
-
-    # single pass over all elements
-    for element in pcf.elements:
-        type_name = pcf.string_dictionary[element.type_name_index].decode('ascii')
-
-        # fix child references
-        if type_name == 'DmeParticleChild':
-            child_value = pcf.get_attribute_value(element, 'child')
-            if child_value == 4294967295:  # invalid reference
-                name = element.element_name.decode('ascii')
-                if name in system_indices:
-                    attr_type, _ = element.attributes[b'child']
-                    element.attributes[b'child'] = (attr_type, system_indices[name])
-
-        # clean children arrays + check defaults for system definitions
-        elif type_name == 'DmeParticleSystemDefinition':
-            children_value = pcf.get_attribute_value(element, 'children')
-            if children_value is not None:
-                unique_indices = list(dict.fromkeys(children_value))
-                if len(unique_indices) != len(children_value):
-                    attr_type, _ = element.attributes[b'children']
-                    element.attributes[b'children'] = (attr_type, unique_indices)
-
-            _remove_default_attributes(element, element_defaults_dict)
-
-        # rename operators + check defaults
-        elif type_name == 'DmeParticleOperator':
-            element.element_name = str('').encode('ascii')
-            _remove_default_attributes(element, attribute_defaults_dict)
+    if index is not None:
+        for idx in index.of_type('DmeParticleSystemDefinition'):
+            system_indices[pcf.elements[idx].element_name] = idx
+    else:
+        # a full index isn't worth building for a single lookup
+        system_types = {i for i, string in enumerate(pcf.string_dictionary) if string == b'DmeParticleSystemDefinition'}
+        for idx, element in enumerate(pcf.elements):
+            if element.type_name_index in system_types:
+                system_indices[element.element_name] = idx
+
+    def fix_child_reference(idx: int, element: PCFElement):
+        child = element.attributes.get(b'child')
+        if child is not None and child[1] == NULL_ELEMENT and element.element_name in system_indices:
+            element.attributes[b'child'] = (child[0], system_indices[element.element_name])
+
+    def clean_system(idx: int, element: PCFElement):
+        # clean children arrays + check defaults
+        children = element.attributes.get(b'children')
+        if children is not None:
+            unique_indices = list(dict.fromkeys(children[1]))
+            if len(unique_indices) != len(children[1]):
+                element.attributes[b'children'] = (children[0], unique_indices)
+
+        _remove_default_attributes(element, _ELEMENT_DEFAULTS)
+
+    def clean_operator(idx: int, element: PCFElement):
+        # rename + check defaults
+        element.element_name = b''
+        _remove_default_attributes(element, _ATTRIBUTE_DEFAULTS)
+
+    visitor = PCFVisitor(pcf)
+    visitor.on(b'DmeParticleChild', fix_child_reference)
+    visitor.on(b'DmeParticleSystemDefinition', clean_system)
+    visitor.on(b'DmeParticleOperator', clean_operator)
+    return visitor
+
+
+def combined_cleanup_pass(pcf: PCFFile, index: PCFIndex | None = None):
+    cleanup_visitor(pcf, index).run()
+
+    # operators were renamed and child references fixed in place
+    if index is not None:
+        index.invalidate()
 
 
 def remove_duplicate_elements(pcf: PCFFile) -> PCFFile:
-    combined_cleanup_pass(pcf)
-
-    # find duplicates
-    duplicates = find_duplicate_array_elements(pcf)
-
-    if duplicates:
-        update_array_indices(pcf, duplicates)
-        reorder_elements(pcf, duplicates)
-
-    final_result = optimize_string_dictionary(pcf)
-
-    return final_result
+    # cleanup runs within the duplicate search, the remap and string dictionary rebuild in one last pass
+    duplicates = find_duplicate_subtrees(pcf, cleanup_visitor(pcf))
+    return compact_elements(pcf, duplicates)
@@ -1,94 +1,94 @@
 import logging
+from itertools import accumulate
 
-from valve_parsers import PCFElement, PCFFile, AttributeType
+from valve_parsers import AttributeType, PCFElement, PCFFile
+
+from core.util.pcf import NULL_ELEMENT
 
 log = logging.getLogger()
 
 
-def copy_element(element: PCFElement, offset: int, source_pcf: PCFFile,
-                 target_pcf: PCFFile) -> PCFElement:
-    # get the type name string from the source PCF
-    type_name = source_pcf.string_dictionary[element.type_name_index]
-
-    # handle DmeElement root and find/add type name in target PCF's string dictionary
-    try:
-        if type_name == b'DmeElement':
-            new_type_name_index = 0
-        else:
-            try:
-                new_type_name_index = target_pcf.string_dictionary.index(type_name)
-            except ValueError:
-                # add new type name to dictionary if it doesn't exist
-                new_type_name_index = len(target_pcf.string_dictionary)
-                target_pcf.string_dictionary.append(type_name)
-    except Exception:
-        log.execption(f"Failed to process particle element '{type_name.decode('ascii', errors='replace')}' during merge")
-        raise ValueError(f"PCF merge failed while processing element type '{type_name.decode('ascii', errors='replace')}')")
-
-    new_element = PCFElement(
-        type_name_index=new_type_name_index,
-        element_name=element.element_name,
-        data_signature=element.data_signature,
-        attributes={}
-    )
-
-    # copy and update attributes
-    for attr_name, (attr_type, value) in element.attributes.items():
-        # first ensure the attribute name exists in target PCF's string dictionary
-        try:
-            target_pcf.string_dictionary.index(attr_name)
-        except ValueError:
-            # add new attribute name if it doesn't exist
-            target_pcf.string_dictionary.append(attr_name)
-
-        # now handle the attribute value based on type
-        if attr_type == AttributeType.ELEMENT:
-            # update single element reference
-            new_value = value + offset if value != 4294967295 else value
-            new_element.attributes[attr_name] = (attr_type, new_value)
-
-        elif attr_type == AttributeType.ELEMENT_ARRAY:
-            # update array of element references
-            new_value = [idx + offset if idx != 4294967295 else idx for idx in value]
-            new_element.attributes[attr_name] = (attr_type, new_value)
-
-        else:
-            # copy other attributes as-is
-            new_element.attributes[attr_name] = (attr_type, value)
-
-    return new_element
+def merge_many(pcfs: list[PCFFile]) -> PCFFile:
+    """
+    Merge PCFs into the first one, in a single pass.
 
+    Same result as merging them pairwise with `merge_pcf_files()` from left to right, without rescanning the
+    string dictionary for every copied name. Strings are interned through one map, every source's element
+    offset is known up front and the root's particleSystemDefinitions is updated once at the end.
 
-def merge_pcf_files(pcf1: PCFFile, pcf2: PCFFile) -> PCFFile:
-    # get starting offset for element indices
-    element_offset = len(pcf1.elements)
+    Args:
+        pcfs: The PCFs to merge, the first one is modified in place.
 
-    # root is always index 0
-    root_idx = 0
-    root_element = pcf1.elements[root_idx]
+    Returns:
+        The first PCF, now holding every other PCF's elements except their roots.
+    """
 
-    # copy and update non-root elements from pcf2
-    new_elements = []
-    new_system_indices = []
+    if not pcfs:
+        raise ValueError("No PCF files to merge")
+
+    target = pcfs[0]
+    string_dictionary = target.string_dictionary
 
-    for i, element in enumerate(pcf2.elements):
-        # skip the root element from pcf2
-        if i == root_idx:
-            continue
+    # the first occurrence wins, like `list.index()`
+    string_indices: dict[bytes, int] = {}
+    for i, string in enumerate(string_dictionary):
+        string_indices.setdefault(string, i)
 
-        new_element = copy_element(element, element_offset - 1, pcf2, pcf1)
-        new_elements.append(new_element)
+    def intern(string: bytes) -> int:
+        index = string_indices.get(string)
+        if index is None:
+            index = string_indices[string] = len(string_dictionary)
+            string_dictionary.append(string)
+        return index
 
-        # track new particle system definitions
-        type_name = pcf2.string_dictionary[element.type_name_index]
-        if type_name == b'DmeParticleSystemDefinition':
-            new_system_indices.append(len(pcf1.elements) + len(new_elements) - 1)
+    # root is always index 0 and skipped in every source, which shifts its references down by one
+    sources = pcfs[1:]
+    offsets = list(accumulate((len(source.elements) - 1 for source in sources), initial=len(target.elements) - 1))
+
+    new_elements = []
+    new_system_indices = []
+    for source, offset in zip(sources, offsets):
+        type_indices: dict[int, int] = {}
+        for element in source.elements[1:]:
+            # find/add type name in target PCF's string dictionary, DmeElement always maps to 0
+            new_type_name_index = type_indices.get(element.type_name_index)
+            if new_type_name_index is None:
+                type_name = source.string_dictionary[element.type_name_index]
+                new_type_name_index = 0 if type_name == b'DmeElement' else intern(type_name)
+                type_indices[element.type_name_index] = new_type_name_index
+
+            # other attribute values are shared with the source, only references are replaced
+            attributes = element.attributes.copy()
+            for attr_name, (attr_type, value) in attributes.items():
+                intern(attr_name)
+
+                if attr_type == AttributeType.ELEMENT:
+                    if value != NULL_ELEMENT:
+                        attributes[attr_name] = (attr_type, value + offset)
+                elif attr_type == AttributeType.ELEMENT_ARRAY:
+                    attributes[attr_name] = (attr_type, [idx if idx == NULL_ELEMENT else idx + offset for idx in value])
+
+            new_elements.append(PCFElement(
+                type_name_index=new_type_name_index,
+                element_name=element.element_name,
+                data_signature=element.data_signature,
+                attributes=attributes
+            ))
+
+            # track new particle system definitions
+            if source.string_dictionary[element.type_name_index] == b'DmeParticleSystemDefinition':
+                new_system_indices.append(len(target.elements) + len(new_elements) - 1)
 
     # update the root element's particleSystemDefinitions array with new system indices
+    root_element = target.elements[0]
     attr_type, existing_systems = root_element.attributes[b'particleSystemDefinitions']
     root_element.attributes[b'particleSystemDefinitions'] = (attr_type, existing_systems + new_system_indices)
 
-    # add all new elements to pcf1
-    pcf1.elements.extend(new_elements)
+    # add all new elements to the target
+    target.elements.extend(new_elements)
+
+    return target
 
-    return pcf1
+
+def merge_pcf_files(pcf1: PCFFile, pcf2: PCFFile) -> PCFFile:
+    return merge_many([pcf1, pcf2])
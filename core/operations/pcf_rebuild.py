@@ -1,46 +1,24 @@
 import json
+from collections import defaultdict
+from collections.abc import Iterable
 from pathlib import Path
 
 from valve_parsers import AttributeType, PCFElement, PCFFile
 
+from core.util.pcf import PCFIndex, decode_pcf
+
 
 def load_particle_system_map(map_path: Path) -> dict[str, list[str]]:
     with map_path.open('r') as f:
         return json.load(f)
 
 
-def find_child_elements(pcf: PCFFile, element_idx: int, visited: set[int]) -> set[int]:
-    if element_idx in visited:
-        return set()
-
-    visited.add(element_idx)
-    children = set()
-    element = pcf.elements[element_idx]
-    children.add(element_idx)
-
-    for attr_name, (attr_type, value) in element.attributes.items():
-        if attr_type == AttributeType.ELEMENT and value != 4294967295:
-            children.add(value)
-            children.update(find_child_elements(pcf, value, visited))
-        elif attr_type == AttributeType.ELEMENT_ARRAY:
-            for child_idx in value:
-                if child_idx != 4294967295:
-                    children.add(child_idx)
-                    children.update(find_child_elements(pcf, child_idx, visited))
-
-    return children
+def find_element_by_name(pcf: PCFFile, element_name: str, index: PCFIndex | None = None):
+    return (index or PCFIndex(pcf)).index_of(element_name)
 
 
-def find_element_by_name(pcf: PCFFile, element_name: str):
-    element = pcf.find_element_by_name(element_name)
-    if element:
-        return pcf.elements.index(element)
-    return None
-
-
-def get_element_tree(pcf: PCFFile, element_idx: int) -> dict[int, PCFElement]:
-    visited = set()
-    indices = find_child_elements(pcf, element_idx, visited)
+def get_element_tree(pcf: PCFFile, element_idx: int, index: PCFIndex | None = None) -> dict[int, PCFElement]:
+    indices = (index or PCFIndex(pcf)).closure(element_idx)
     return {idx: pcf.elements[idx] for idx in indices}
 
 
@@ -58,79 +36,91 @@ def build_reverse_element_map(particle_system_map) -> dict[str, str]:
     return element_to_pcf
 
 
-def extract_elements(pcf: PCFFile, element_names) -> PCFFile:
-    # create new PCF file with same version and string dictionary
-    pcf_output = PCFFile(pcf.input_file, version=pcf.version)
-    pcf_output.string_dictionary = pcf.string_dictionary
-
-    # start with the root element (index 0)
-    elements_to_keep = {0: pcf.elements[0]}
-
-    # extract elements and their children
-    for element_name in element_names:
-        element_idx = find_element_by_name(pcf, element_name)
-        if element_idx is not None:
-            element_tree = get_element_tree(pcf, element_idx)
-            elements_to_keep.update(element_tree)
-
-    # create mapping of old indices to new sequential indices
-    old_to_new = {old_idx: new_idx for new_idx, old_idx in enumerate(elements_to_keep.keys())}
-
-    # build new elements list
-    new_elements = []
-    for old_idx, element in elements_to_keep.items():
-        new_element = PCFElement(
-            type_name_index=element.type_name_index,
-            element_name=element.element_name,
-            data_signature=element.data_signature,
-            attributes={}
-        )
-
-        # update element references
-        for attr_name, (attr_type, value) in element.attributes.items():
-            if attr_type == AttributeType.ELEMENT:
-                # handle single element reference
-                if value != 4294967295 and value in old_to_new:
-                    new_element.attributes[attr_name] = (attr_type, old_to_new[value])
+def extract_elements(pcf: PCFFile, element_names, index: PCFIndex | None = None) -> PCFFile:
+    # pass an index when extracting from the same PCF repeatedly
+    return extract_element_groups(pcf, {None: element_names}, index)[None]
+
+
+def extract_element_groups[K](pcf: PCFFile, groups: dict[K, Iterable[str]],
+                              index: PCFIndex | None = None) -> dict[K, PCFFile]:
+    """
+    Extract several sets of particle systems from one PCF at once.
+
+    Each group's systems and their children are found through the index's reachability, then every needed
+    element is copied in a single pass over the PCF, once per group that uses it, with its references
+    remapped to that group's element order.
+
+    Args:
+        pcf: The PCF to extract from.
+        groups: Names of the particle systems to extract, per output.
+        index: Index of `pcf`, pass one when extracting from the same PCF repeatedly.
+
+    Returns:
+        A PCF per group, holding the root element and the group's systems and their children in their
+        original order.
+    """
+
+    index = index or PCFIndex(pcf)
+
+    # mapping of old indices to new sequential indices per group, the root element (index 0) always comes first
+    old_to_new: dict[K, dict[int, int]] = {}
+    element_groups: dict[int, list[K]] = defaultdict(list)
+    for key, element_names in groups.items():
+        element_indices = (index.index_of(element_name) for element_name in element_names)
+        kept_indices = [0] + [idx for idx in index.reachable(idx for idx in element_indices if idx is not None) if idx != 0]
+        old_to_new[key] = {old_idx: new_idx for new_idx, old_idx in enumerate(kept_indices)}
+        for old_idx in kept_indices:
+            element_groups[old_idx].append(key)
+
+    # build new elements lists, visiting every element once no matter how many groups share it
+    new_elements: dict[K, list[PCFElement]] = {key: [] for key in groups}
+    for old_idx in sorted(element_groups):
+        element = pcf.elements[old_idx]
+        references = [(attr_name, attr_type, value) for attr_name, (attr_type, value) in element.attributes.items()
+                      if attr_type in (AttributeType.ELEMENT, AttributeType.ELEMENT_ARRAY)]
+
+        for key in element_groups[old_idx]:
+            mapping = old_to_new[key]
+
+            # copy non-reference attributes as-is and update element references, NULL_ELEMENT is never mapped
+            attributes = element.attributes.copy()
+            for attr_name, attr_type, value in references:
+                if attr_type == AttributeType.ELEMENT:
+                    attributes[attr_name] = (attr_type, mapping.get(value, value))
                 else:
-                    new_element.attributes[attr_name] = (attr_type, value)
-            elif attr_type == AttributeType.ELEMENT_ARRAY:
-                # handle array of element references
-                new_value = []
-                for idx in value:
-                    if idx != 4294967295 and idx in old_to_new:
-                        new_value.append(old_to_new[idx])
-                    else:
-                        new_value.append(idx)
-                new_element.attributes[attr_name] = (attr_type, new_value)
-            else:
-                # copy non-reference attributes as-is
-                new_element.attributes[attr_name] = (attr_type, value)
-
-        new_elements.append(new_element)
+                    attributes[attr_name] = (attr_type, [mapping.get(idx, idx) for idx in value])
 
-    # update root particleSystemDefinitions array
-    root = new_elements[0]
-    attr_type, _ = root.attributes[b'particleSystemDefinitions']
+            new_elements[key].append(PCFElement(
+                type_name_index=element.type_name_index,
+                element_name=element.element_name,
+                data_signature=element.data_signature,
+                attributes=attributes
+            ))
 
-    # add all particle system elements to root's definitions
-    particle_system_indices = []
-    for idx, element in enumerate(new_elements[1:], 1):  # skip root element
-        type_name = pcf_output.string_dictionary[element.type_name_index]
-        if type_name == b'DmeParticleSystemDefinition':
-            particle_system_indices.append(idx)
+    outputs = {}
+    for key, elements in new_elements.items():
+        # create new PCF file with same version and string dictionary
+        pcf_output = PCFFile(pcf.input_file, version=pcf.version)
+        pcf_output.string_dictionary = pcf.string_dictionary
 
-    root.attributes[b'particleSystemDefinitions'] = (attr_type, particle_system_indices)
+        # update root particleSystemDefinitions array with all particle system elements
+        root = elements[0]
+        attr_type, _ = root.attributes[b'particleSystemDefinitions']
+        particle_system_indices = [
+            idx for idx, element in enumerate(elements[1:], 1)  # skip root element
+            if pcf.string_dictionary[element.type_name_index] == b'DmeParticleSystemDefinition'
+        ]
+        root.attributes[b'particleSystemDefinitions'] = (attr_type, particle_system_indices)
 
-    # set elements in output PCF
-    pcf_output.elements = new_elements
+        pcf_output.elements = elements
+        outputs[key] = pcf_output
 
-    return pcf_output
+    return outputs
 
 
 def rebuild_particle_files(mod_pcf_path: str, particle_system_map):
     # load the mod PCF
-    mod_pcf = PCFFile(mod_pcf_path).decode()
+    mod_pcf = decode_pcf(mod_pcf_path)
 
     # get all element names from the mod PCF
     mod_elements = get_pcf_element_names(mod_pcf)
@@ -7,9 +7,9 @@ log = logging.getLogger()
 
 
 def migrate_old_particle_files():
-    from valve_parsers import PCFFile
-
     from core.operations.advanced_particle_merger import AdvancedParticleMerger, save_split_files
+    from core.util.pcf import decode_pcf
+    from core.util.pcf_toc import toc_path
 
     mods_to_migrate = []
     mods_missing_source = []
@@ -58,6 +58,7 @@ def migrate_old_particle_files():
                     old_file = mod_dir / "actual_particles" / original_file
                     if old_file.exists():
                         old_file.unlink()
+                        toc_path(old_file).unlink(missing_ok=True)
 
                 # re-run AdvancedParticleMerger to regenerate with splits
                 merger = AdvancedParticleMerger()
@@ -84,9 +85,10 @@ def migrate_old_particle_files():
                     old_file = actual_particles / original_file
 
                     if old_file.exists():
-                        pcf = PCFFile(old_file).decode()
+                        pcf = decode_pcf(old_file)
                         save_split_files(pcf, mod_dir, split_defs)
                         old_file.unlink()
+                        toc_path(old_file).unlink(missing_ok=True)
 
             except Exception:
                 log.exception(f"Failed to migrate {mod_name}")
@@ -7,6 +7,7 @@ from core.config import config
 from core.quickprecache.precache_list import make_precache_list
 from core.quickprecache.r_rootlod import check_root_lod
 from core.quickprecache.studio_mdl import StudioMDL
+from core.util.trace import span, traced
 
 log = logging.getLogger()
 
@@ -227,6 +228,7 @@ class QuickPrecache:
             except Exception:
                 log.exception(f"Error removing temporary file {temp_file}")
 
+    @traced('precache.run')
     def run(self, auto: bool = False, list_file: str = "", flush: bool = False) -> bool:
         # main process
         try:
@@ -248,7 +250,9 @@ class QuickPrecache:
             # step 3: get the model list
             if auto:
                 log.info("Auto-scanning for models...")
-                self.model_list = make_precache_list(self.game_path)
+                with span('precache.scan') as scan_span:
+                    self.model_list = make_precache_list(self.game_path)
+                    scan_span.items = len(self.model_list)
 
                 # save the list if requested
                 if list_file:
@@ -267,8 +271,9 @@ class QuickPrecache:
                 log.info(f"{model}")
 
             # step 4: create QC files and compile them
-            self.make_precache_sub_list(self.model_list)
-            self.make_precache_list_file()
+            with span('precache.compile', items=len(self.model_list)):
+                self.make_precache_sub_list(self.model_list)
+                self.make_precache_list_file()
 
             # step 5: report any failed VPKs
             if self.failed_vpks:
@@ -10,6 +10,7 @@ from core.config import config
 from core.operations.advanced_particle_merger import AdvancedParticleMerger
 from core.structure_validator import StructureValidator
 from core.util.file import copy, delete, move
+from core.util.trace import span, traced
 from core.util.zip import extract
 
 log = logging.getLogger()
@@ -37,6 +38,7 @@ class ImportService:
     def __init__(self):
         self.validator = StructureValidator()
 
+    @traced('import.folder')
     def process_folder(
         self,
         folder_path: Path,
@@ -60,7 +62,8 @@ class ImportService:
                 particle_merger = AdvancedParticleMerger(
                     progress_callback=lambda p, m: progress_callback(50 + int(p / 2), m) if progress_callback else None
                 )
-                particle_merger.preprocess_vpk(destination)
+                with span('import.particle_merge'):
+                    particle_merger.preprocess_vpk(destination)
             else:
                 # it is an addon
                 destination = config.addons_dir / folder_name
@@ -85,6 +88,7 @@ class ImportService:
             log.exception(f"Error processing folder {folder_name}")
             return False, f"Error processing folder {folder_name}: {e!s}"
 
+    @traced('import.zip')
     def process_zip_file(
         self,
         zip_path: Path,
@@ -98,7 +102,8 @@ class ImportService:
             with tempfile.TemporaryDirectory() as temp_dir:
                 temp_path = Path(temp_dir)
 
-                extract(zip_path, temp_path)
+                with span('import.zip_extract'):
+                    extract(zip_path, temp_path)
 
                 # analyze extracted structure to find mod folders
                 extracted_items = list(temp_path.iterdir())
@@ -151,6 +156,7 @@ class ImportService:
             log.exception(f"Error processing ZIP file {zip_name}")
             return False, f"Error processing ZIP file {zip_name}: {e!s}"
 
+    @traced('import.vpk')
     def process_vpk_file(
         self,
         file_path: Path,
@@ -180,7 +186,9 @@ class ImportService:
 
             if progress_callback:
                 progress_callback(15, "Extracting files...")
-            extracted_count = vpk_handler.extract_all(str(extracted_particles_dir))
+            with span('import.vpk_extract') as extract_span:
+                extracted_count = vpk_handler.extract_all(str(extracted_particles_dir))
+                extract_span.items = extracted_count
             if progress_callback:
                 progress_callback(35, f"Extracted {extracted_count} files")
 
@@ -191,7 +199,8 @@ class ImportService:
                 particle_merger = AdvancedParticleMerger(
                     progress_callback=lambda p, m: progress_callback(50 + int(p / 2), m) if progress_callback else None
                 )
-                particle_merger.preprocess_vpk(extracted_particles_dir)
+                with span('import.particle_merge'):
+                    particle_merger.preprocess_vpk(extracted_particles_dir)
             else:
                 # for non-particle mods, create addon folder
                 if progress_callback:
@@ -222,6 +231,7 @@ class ImportService:
             log.exception(error_msg)
             return False, error_msg
 
+    @traced('import.dropped_items')
     def process_dropped_items(
         self,
         item_paths: list[Path],
@@ -1,10 +1,10 @@
 import json
 import logging
+import os
+import threading
 from collections.abc import Callable
 from pathlib import Path
 
-from valve_parsers import PCFFile, VPKFile
-
 from core.backup_manager import prepare_working_copy
 from core.config import config
 from core.constants import (
@@ -13,14 +13,15 @@ from core.constants import (
     CUSTOM_VPK_NAMES,
     CUSTOM_VPK_SPLIT_PATTERN,
     DX8_LIST,
+    HARDLINK_SAFE_SUFFIXES,
     Sourcemods,
 )
 from core.handlers.file_handler import FileHandler, copy_config_files, generate_config
 from core.handlers.paint_handler import disable_paints, enable_paints
 from core.handlers.pcf_handler import (
-    check_parents,
+    process_particle_file,
+    processed_pcf_cache,
     restore_particle_files,
-    update_materials,
 )
 from core.handlers.skybox_handler import handle_skybox_mods, restore_skybox_files
 from core.handlers.sound_handler import SoundHandler
@@ -34,13 +35,16 @@ from core.operations.for_the_love_of_god_add_vmts_to_your_mods import (
     generate_missing_vmt_files,
 )
 from core.operations.mdl_relocate import relocate_mdl_paths
-from core.operations.pcf_compress import remove_duplicate_elements
 from core.operations.pcf_rebuild import extract_elements, load_particle_system_map
 from core.operations.vgui_preload import patch_mainmenuoverride
 from core.quickprecache.precache_list import make_precache_list
 from core.quickprecache.quick_precache import QuickPrecache
-from core.util.file import check_writable, copy, delete, move
-from core.util.vpk import get_vpk_name
+from core.staging import StagingGroup, file_states, staging_group_name
+from core.util.file import check_writable, clone, copy, delete, move
+from core.util.pcf_cache import load_vanilla_pcf, pcf_digest
+from core.util.stages import StageGraph, process_pool
+from core.util.trace import span, traced
+from core.util.vpk import VPKPatchBatch, get_vpk_name, update_vpk
 
 log = logging.getLogger()
 
@@ -85,6 +89,66 @@ class InstallService:
         for item in items_to_delete:
             delete(item)
 
+    @staticmethod
+    def collect_addon_files(selected_addons: list[str]) -> tuple[dict[Path, tuple[Path, int]], dict[str, Path]]:
+        """
+        Resolve which addon file ends up at each staging path.
+
+        Args:
+            selected_addons: List of addon directory names, later ones override earlier ones
+
+        Returns:
+            The staging path of every file mapped to the file that wins it and that addon's load-order index,
+            and the HUD addons by lowercase name, which are installed as folders instead.
+        """
+
+        # load order is resolved here rather than by overwriting files while staging, so only the file that wins
+        # each path gets copied
+        files_to_copy: dict[Path, tuple[Path, int]] = {}
+        overridden_files = 0
+        hud_addons = {}
+
+        for addon_index, addon_path in enumerate(selected_addons):
+            addon_dir = config.addons_dir / addon_path
+            if addon_dir.exists() and addon_dir.is_dir():
+                mod_json_path = addon_dir / 'mod.json'
+                if mod_json_path.exists():
+                    try:
+                        with open(mod_json_path, 'r') as f:
+                            mod_info = json.load(f)
+                            if mod_info.get('type', '').lower() == 'hud':
+                                addon_path = addon_path.lower()
+
+                                if hud_addons.get(addon_path) is None:
+                                    hud_addons[addon_path] = addon_dir
+                                    continue
+                                else:
+                                    raise Exception(f"There are 2 mods that have directory names which resolve to the same case-insensitive name:\n'{hud_addons[addon_path].name}'\n'{addon_dir.name}'")
+                    except json.JSONDecodeError:
+                        log.warning(f"Invalid JSON in {mod_json_path}", exc_info=True)
+
+                for src_path in addon_dir.glob('**/*'):
+                    if src_path.is_file() and src_path.name != 'mod.json' and src_path.name != 'sound.cache':
+                        rel_path = src_path.relative_to(addon_dir)
+                        if (rel_path.parts[0] == 'scripts' and
+                            len(rel_path.parts) >= 2 and
+                            'sound' in src_path.name.lower() and
+                            src_path.suffix == '.txt'):
+                            continue
+
+                        if src_path.suffix.lower() == '.pcf':
+                            dest_path = config.temp_to_be_patched_dir / rel_path
+                        else:
+                            dest_path = config.temp_to_be_vpk_dir / rel_path
+                        if dest_path in files_to_copy:
+                            overridden_files += 1
+                        files_to_copy[dest_path] = (src_path, addon_index)
+
+        if overridden_files:
+            log.info(f"Skipping {overridden_files} addon files overridden by addons later in the load order")
+        return files_to_copy, hud_addons
+
+    @traced('install')
     def install(
         self,
         tf_path: Path,
@@ -110,58 +174,36 @@ class InstallService:
         """
 
         self.cancel_requested = False
+        progress_lock = threading.Lock()
+        highest_progress = 0
 
         def progress(pct: int, msg: str):
-            if on_progress:
-                on_progress(pct, msg)
+            # concurrent stages report interleaved percentages, the bar only ever moves forward
+            nonlocal highest_progress
+            with progress_lock:
+                highest_progress = max(highest_progress, pct)
+                if on_progress:
+                    on_progress(highest_progress, msg)
 
         try:
             is_tf2 = sourcemod == Sourcemods.TF2
 
             file_handler = None
+            vpk_batch = None
             base_default_pcf = None
             base_default_parents = None
             if is_tf2:
                 working_vpk_path = tf_path / get_vpk_name(tf_path)
                 if not check_writable(working_vpk_path):
                     raise PermissionError(f'Please close {sourcemod.full_name} before installing.')
-                file_handler = FileHandler(working_vpk_path)
+                # every game VPK patch made by the install is queued here and written in one go
+                vpk_batch = VPKPatchBatch(working_vpk_path)
+                file_handler = FileHandler(vpk_batch.vpk, vpk_batch)
                 base_default_pcf, base_default_parents = initialize_pcf(config.temp_to_be_referenced_dir)
             progress(0, "Installing addons...")
 
-            total_files = 0
-            files_to_copy = []
-            hud_addons = {}
-
-            for addon_index, addon_path in enumerate(selected_addons):
-                addon_dir = config.addons_dir / addon_path
-                if addon_dir.exists() and addon_dir.is_dir():
-                    mod_json_path = addon_dir / 'mod.json'
-                    if mod_json_path.exists():
-                        try:
-                            with open(mod_json_path, 'r') as f:
-                                mod_info = json.load(f)
-                                if mod_info.get('type', '').lower() == 'hud':
-                                    addon_path = addon_path.lower()
-
-                                    if hud_addons.get(addon_path) is None:
-                                        hud_addons[addon_path] = addon_dir
-                                        continue
-                                    else:
-                                        raise Exception(f"There are 2 mods that have directory names which resolve to the same case-insensitive name:\n'{hud_addons[addon_path].name}'\n'{addon_dir.name}'")
-                        except json.JSONDecodeError:
-                            log.warning(f"Invalid JSON in {mod_json_path}", exc_info=True)
-
-                    for src_path in addon_dir.glob('**/*'):
-                        if src_path.is_file() and src_path.name != 'mod.json' and src_path.name != 'sound.cache':
-                            rel_path = src_path.relative_to(addon_dir)
-                            if (rel_path.parts[0] == 'scripts' and
-                                len(rel_path.parts) >= 2 and
-                                'sound' in src_path.name.lower() and
-                                src_path.suffix == '.txt'):
-                                continue
-                            total_files += 1
-                            files_to_copy.append((src_path, addon_dir, addon_index))
+            files_to_copy, hud_addons = self.collect_addon_files(selected_addons)
+            total_files = len(files_to_copy)
 
             self._check_cancelled()
 
@@ -176,7 +218,8 @@ class InstallService:
                     if hud_dest.exists():
                         log.info(f'{hud_dest} already exists, skipping as to not overwrite possible user-modified files')
                         continue
-                    copy(addon_dir, hud_dest)
+                    # users edit HUDs in place, so only reflinks are fine here
+                    clone(addon_dir, hud_dest)
 
                     hud_mod_json = hud_dest / 'mod.json'
                     if hud_mod_json.exists():
@@ -191,70 +234,95 @@ class InstallService:
 
             self._check_cancelled()
             if is_tf2:
-                restore_skybox_files(tf_path)
-                restore_particle_files(tf_path)
-                enable_paints(tf_path)
+                # vanilla contents are only queued, mod patches later in the install replace them in the batch
+                # and whatever ends up identical to what's already in the game VPK is never written
+                with span('install.restore') as restore_span:
+                    restore_skybox_files(tf_path, batch=vpk_batch)
+                    restore_particle_files(tf_path, batch=vpk_batch)
+                    enable_paints(tf_path, batch=vpk_batch)
+                    restore_span.items = len(vpk_batch)
 
             self._check_cancelled()
 
             if apply_particle_selections:
                 apply_particle_selections()
 
-            # dest_path -> addon load-order index, used by mdl_relocate to
-            # resolve per-file collisions when merging un-prefixed mod content
-            # into a destination that another mod already shipped pre-prefixed.
-            file_origin: dict[Path, int] = {}
+            custom_content_dir = config.temp_to_be_vpk_dir
+
+            # sounds, models and materials are transformed as a group and the results are kept between installs,
+            # so they are only handed to their group here. the group keeps each file's addon load-order index,
+            # mdl_relocate needs it to resolve per-file collisions when merging un-prefixed mod content into a
+            # destination that another mod already shipped pre-prefixed.
+            staging_groups = {
+                'sound': StagingGroup(config.staging_dir, 'sound', 'sound_mapping'),
+                'models': StagingGroup(config.staging_dir, 'models',
+                                       'mdl_relocation+vmt_generation' if fix_mdl_paths else 'vmt_generation'),
+            }
 
             if files_to_copy:
                 progress_range = 25
                 completed_files = 0
                 progress(10, f"Installing addons... (0/{total_files} files)")
 
-                for src_path, addon_dir, addon_index in files_to_copy:
-                    self._check_cancelled()
+                with span('install.staging_copy', items=total_files):
+                    for dest_path, (src_path, addon_index) in files_to_copy.items():
+                        self._check_cancelled()
 
-                    rel_path = src_path.relative_to(addon_dir)
-                    if src_path.suffix.lower() == '.pcf':
-                        dest_path = config.temp_to_be_patched_dir / rel_path
-                    else:
-                        dest_path = config.temp_to_be_vpk_dir / rel_path
+                        group_name = None
+                        if is_tf2 and dest_path.is_relative_to(custom_content_dir):
+                            rel_path = dest_path.relative_to(custom_content_dir).as_posix()
+                            group_name = staging_group_name(rel_path)
 
-                    copy(src_path, dest_path)
-                    file_origin[dest_path] = addon_index
+                        if group_name:
+                            staging_groups[group_name].add(rel_path, src_path, addon_index)
+                        else:
+                            clone(src_path, dest_path, hardlink=dest_path.suffix.lower() in HARDLINK_SAFE_SUFFIXES)
 
-                    completed_files += 1
-                    current_progress = 10 + int((completed_files / total_files) * progress_range)
-                    progress(current_progress, f"Installing addons... ({completed_files}/{total_files} files)")
+                        completed_files += 1
+                        current_progress = 10 + int((completed_files / total_files) * progress_range)
+                        progress(current_progress, f"Installing addons... ({completed_files}/{total_files} files)")
 
-                if is_tf2:
-                    progress(35, "Processing sound mods...")
-                    backup_scripts_dir = config.backup_dir / 'scripts'
+            # everything past staging is declared as stages along with the data they touch, the graph runs
+            # stages that don't share anything concurrently and keeps the declared order for the rest
+            stages = StageGraph('install')
+
+            def map_sounds():
+                progress(35, "Processing sound mods...")
+                backup_scripts_dir = config.backup_dir / 'scripts'
 
-                    vpk_paths = []
-                    misc_vpk = tf_path / "tf2_sound_misc_dir.vpk"
-                    if misc_vpk.exists():
-                        vpk_paths.append(misc_vpk)
-                    vo_vpks = list(tf_path.glob("tf2_sound_vo_*_dir.vpk"))
-                    vpk_paths.extend(vo_vpks)
+                vpk_paths = []
+                misc_vpk = tf_path / "tf2_sound_misc_dir.vpk"
+                if misc_vpk.exists():
+                    vpk_paths.append(misc_vpk)
+                vo_vpks = list(tf_path.glob("tf2_sound_vo_*_dir.vpk"))
+                vpk_paths.extend(vo_vpks)
 
+                def build(group_dir: Path, file_origin: dict[Path, int]):
                     sound_result = self.sound_handler.process_temp_sound_mods(
-                        config.temp_to_be_vpk_dir,
+                        group_dir,
                         backup_scripts_dir,
                         vpk_paths
                     )
                     if sound_result:
                         progress(50, sound_result['message'])
 
-                self._check_cancelled()
+                # the sound scripts are rebuilt from the backed up ones, a game update refreshes those too
+                backup_scripts = sorted(path for path in backup_scripts_dir.rglob('*') if path.is_file())
+                staging_groups['sound'].sync(custom_content_dir, build, {
+                    'game_vpks': file_states(vpk_paths),
+                    'backup_scripts': file_states(backup_scripts),
+                })
 
-                if is_tf2:
-                    handle_skybox_mods(config.temp_to_be_vpk_dir, tf_path)
+            def patch_skybox():
+                self._check_cancelled()
+                handle_skybox_mods(custom_content_dir, tf_path, batch=vpk_batch)
 
-                if is_tf2 and disable_paint_colors:
-                    progress(52, "Disabling paint colors...")
-                    disable_paints(tf_path)
+            def patch_paints():
+                self._check_cancelled()
+                progress(52, "Disabling paint colors...")
+                disable_paints(tf_path, batch=vpk_batch)
 
-            if is_tf2:
+            def patch_particles():
                 duplicate_effects = [
                     "item_fx.pcf",
                     "halloween.pcf",
@@ -267,7 +335,7 @@ class InstallService:
                         source_path = config.temp_to_be_referenced_dir / duplicate_effect
                         target_path.parent.mkdir(parents=True, exist_ok=True)
                         if source_path.exists():
-                            extract_elements(PCFFile(source_path).decode(),
+                            extract_elements(load_vanilla_pcf(source_path),
                                              load_particle_system_map(config.particle_system_map_file)
                                              [f'particles/{target_path.name}']).encode(target_path)
 
@@ -283,39 +351,66 @@ class InstallService:
                 completed_files = 0
                 progress(start_progress, f"Processing particle files... (0/{total_files})")
 
-                for pcf_file in particle_files:
-                    self._check_cancelled()
+                with span('install.particles', items=len(particle_files)):
+                    # decoding, compressing and encoding happens in worker processes, results come back as encoded
+                    # bytes in submission order and get queued into the game VPK from here
+                    workers = min(config.jobs or os.cpu_count() or 1, len(particle_files)) or 1
+                    base_path = base_default_pcf.input_file
+                    base_digest = pcf_digest(base_path.read_bytes())
+                    log.info(f"Processing {len(particle_files)} particle files with {workers} worker(s)")
+
+                    if workers > 1:
+                        # this runs next to other stages' threads
+                        executor = process_pool(workers)
+                        results = executor.map(process_particle_file, particle_files,
+                                               [base_path] * len(particle_files),
+                                               [base_digest] * len(particle_files),
+                                               [base_default_parents] * len(particle_files))
+                    else:
+                        executor = None
+                        results = (process_particle_file(pcf_file, base_path, base_digest, base_default_parents)
+                                   for pcf_file in particle_files)
 
-                    base_name = pcf_file.name
+                    try:
+                        for pcf_file, encoded_pcf in zip(particle_files, results):
+                            self._check_cancelled()
 
-                    mod_pcf = PCFFile(pcf_file).decode()
+                            if encoded_pcf is None:
+                                continue
 
-                    if base_name != base_default_pcf.input_file.name and check_parents(mod_pcf, base_default_parents):
-                        continue
+                            if pcf_file.stem in DX8_LIST:
+                                dx_80_name = pcf_file.stem + "_dx80.pcf"
+                                file_handler.process_file(dx_80_name, encoded_pcf)
 
-                    if base_name == base_default_pcf.input_file.name:
-                        mod_pcf = update_materials(base_default_pcf, mod_pcf)
+                                completed_files += 1
+                                current_progress = start_progress + int((completed_files / total_files) * progress_range)
+                                progress(current_progress, f"Processing particle files... ({completed_files}/{total_files})")
 
-                    processed_pcf = remove_duplicate_elements(mod_pcf)
+                            file_handler.process_file(pcf_file.name, encoded_pcf)
+                            pcf_file.unlink()
 
-                    if pcf_file.stem in DX8_LIST:
-                        dx_80_name = pcf_file.stem + "_dx80.pcf"
-                        file_handler.process_file(dx_80_name, processed_pcf)
+                            completed_files += 1
+                            current_progress = start_progress + int((completed_files / total_files) * progress_range)
+                            progress(current_progress, f"Processing particle files... ({completed_files}/{total_files})")
+                    finally:
+                        if executor is not None:
+                            # drop whatever hasn't started yet if we're bailing out early
+                            executor.shutdown(cancel_futures=True)
 
-                        completed_files += 1
-                        current_progress = start_progress + int((completed_files / total_files) * progress_range)
-                        progress(current_progress, f"Processing particle files... ({completed_files}/{total_files})")
+                    # workers only add entries, trimming the cache is left to this process
+                    processed_pcf_cache().prune()
 
-                    file_handler.process_file(base_name, processed_pcf)
-                    pcf_file.unlink()
+                self._check_cancelled()
+                progress(start_progress + progress_range, "Patching game files...")
+                queued = len(vpk_batch)
+                with span('install.vpk_patch', items=queued):
+                    patched = vpk_batch.commit()
+                log.info(f"Patched {patched} of {queued} entries in {working_vpk_path.name}, the rest were unchanged")
 
-                    completed_files += 1
-                    current_progress = start_progress + int((completed_files / total_files) * progress_range)
-                    progress(current_progress, f"Processing particle files... ({completed_files}/{total_files})")
-            else:
+            def copy_particles():
                 particle_files = list(config.temp_to_be_patched_dir.glob("*.pcf"))
                 if particle_files:
-                    particles_dir = config.temp_to_be_vpk_dir / 'particles'
+                    particles_dir = custom_content_dir / 'particles'
                     particles_dir.mkdir(parents=True, exist_ok=True)
 
                     total_files = len(particle_files)
@@ -331,51 +426,58 @@ class InstallService:
                         current_progress = start_progress + int(((i + 1) / total_files) * progress_range)
                         progress(current_progress, f"Copying particle files... ({i + 1}/{total_files})")
 
-            self._check_cancelled()
-
-            progress(80, "Making custom VPK")
+            def prepare_custom_dir():
+                game_type(tf_path / 'gameinfo.txt', uninstall=False)
 
-            game_type(tf_path / 'gameinfo.txt', uninstall=False)
-
-            if is_tf2:
-                backup_mainmenu_folder = custom_dir / BACKUP_MAINMENU_FOLDER
-                delete(backup_mainmenu_folder, not_exist_ok=True)
-
-            for custom_vpk in CUSTOM_VPK_NAMES:
-                vpk_path = custom_dir / custom_vpk
-                cache_path = custom_dir / (custom_vpk + ".sound.cache")
-                if vpk_path.exists():
-                    vpk_path.unlink()
-                if cache_path.exists():
-                    cache_path.unlink()
-
-            custom_content_dir = config.temp_to_be_vpk_dir
-            copy_config_files(custom_content_dir)
+                if is_tf2:
+                    backup_mainmenu_folder = custom_dir / BACKUP_MAINMENU_FOLDER
+                    delete(backup_mainmenu_folder, not_exist_ok=True)
 
-            if is_tf2:
-                patch_mainmenuoverride(tf_path)
-                if fix_mdl_paths:
-                    progress(78, "Relocating model material paths...")
-                    relocate_mdl_paths(custom_content_dir, file_origin=file_origin)
-                generate_missing_vmt_files(custom_content_dir, tf_path)
+                for custom_vpk in CUSTOM_VPK_NAMES:
+                    vpk_path = custom_dir / custom_vpk
+                    cache_path = custom_dir / (custom_vpk + ".sound.cache")
+                    if vpk_path.exists():
+                        vpk_path.unlink()
+                    if cache_path.exists():
+                        cache_path.unlink()
 
-            for split_file in custom_dir.glob(f"{CUSTOM_VPK_SPLIT_PATTERN}*.vpk"):
-                split_file.unlink()
-                cache_file = custom_dir / (split_file.name + ".sound.cache")
-                if cache_file.exists():
-                    cache_file.unlink()
-
-            if custom_content_dir.exists() and any(custom_content_dir.iterdir()):
-                split_size = 2 ** 31
-                vpk_base_path = custom_dir / CUSTOM_VPK_NAME.replace('.vpk', '')
+                if is_tf2:
+                    patch_mainmenuoverride(tf_path)
+
+                # the split VPK itself is kept and updated in place by create_custom_vpk
+                for split_file in custom_dir.glob(f"{CUSTOM_VPK_SPLIT_PATTERN}*.vpk"):
+                    cache_file = custom_dir / (split_file.name + ".sound.cache")
+                    if cache_file.exists():
+                        cache_file.unlink()
+
+            def process_models():
+                def build(group_dir: Path, file_origin: dict[Path, int]):
+                    if fix_mdl_paths:
+                        progress(78, "Relocating model material paths...")
+                        with span('install.models.mdl_relocation') as relocation_span:
+                            relocation_span.items = relocate_mdl_paths(group_dir, file_origin=file_origin)
+                    with span('install.models.vmt_generation') as vmt_span:
+                        vmt_span.items = generate_missing_vmt_files(group_dir, tf_path)
+
+                # missing VMTs are generated from the game's own, a game update has to rebuild the group
+                game_vpk_path = tf_path / get_vpk_name(tf_path)
+                staging_groups['models'].sync(custom_content_dir, build, {'game_vpks': file_states([game_vpk_path])})
+
+            def create_custom_vpk():
+                self._check_cancelled()
+                progress(80, "Making custom VPK")
 
-                custom_content_dir.mkdir(parents=True, exist_ok=True) # INFO: technically not necessary, but VPKFile does not check if `source_dir` exists
-                if not VPKFile.create(str(custom_content_dir), str(vpk_base_path), split_size):
-                    raise Exception("Failed to create custom VPK")
+                if custom_content_dir.exists() and any(custom_content_dir.iterdir()):
+                    split_size = 2 ** 31
+                    vpk_base_path = custom_dir / CUSTOM_VPK_NAME.replace('.vpk', '')
+                    update_vpk(custom_content_dir, vpk_base_path, split_size)
+                else:
+                    for split_file in custom_dir.glob(f"{CUSTOM_VPK_SPLIT_PATTERN}*.vpk"):
+                        split_file.unlink()
 
-            self._check_cancelled()
+            def build_precache():
+                self._check_cancelled()
 
-            if is_tf2:
                 # Always flush prior precache state and clear stale precache VPKs,
                 # even when scan+build is skipped — otherwise the user keeps loading
                 # whatever was generated by the last install that did run it.
@@ -393,7 +495,9 @@ class InstallService:
                 else:
                     progress(85, "Scanning for models to precache...")
 
-                    precache_prop_set = make_precache_list(tf_path.parents[0])
+                    with span('install.precache_scan') as scan_span:
+                        precache_prop_set = make_precache_list(tf_path.parents[0])
+                        scan_span.items = len(precache_prop_set)
                     if precache_prop_set:
                         precache = QuickPrecache(
                             tf_path.parents[0],
@@ -403,6 +507,7 @@ class InstallService:
                         precache.run(auto=True)
                         copy(config.install_dir / 'core/quickprecache/_QuickPrecache.vpk', custom_dir / '_QuickPrecache.vpk')
 
+            def configure():
                 self._check_cancelled()
 
                 progress(95, "Configuring...")
@@ -422,6 +527,37 @@ class InstallService:
                     vpk_handler = FileHandler(custom_vpk_path)
                     vpk_handler.process_file('cfg/w/config.cfg', config_content.encode('utf-8'))
 
+            # staged_* resources are subtrees of the staging folders, game_vpk is the shared patch batch
+            # and custom_dir is everything the game loads from tf/custom
+            if files_to_copy and is_tf2:
+                stages.add('sound_mapping', map_sounds, writes={'staged_sounds', 'staged_scripts'})
+                stages.add('skybox', patch_skybox, writes={'staged_skybox', 'game_vpk'})
+                if disable_paint_colors:
+                    stages.add('paints', patch_paints, writes={'game_vpk'})
+
+            if is_tf2:
+                stages.add('particle_patch', patch_particles, writes={'staged_particles', 'game_vpk'})
+            else:
+                stages.add('particle_copy', copy_particles, writes={'staged_particles'})
+
+            stages.add('custom_dir', prepare_custom_dir, writes={'custom_dir', 'gameinfo'})
+            stages.add('config_files', lambda: copy_config_files(custom_content_dir), writes={'staged_scripts', 'staged_config'})
+
+            if is_tf2:
+                # VMT generation only reads weapon and pattern VMTs from the game VPK, which nothing here patches
+                stages.add('models', process_models, writes={'staged_models', 'staged_materials'})
+
+            stages.add('vpk_create', create_custom_vpk,
+                       reads={'staged_sounds', 'staged_scripts', 'staged_skybox', 'staged_materials', 'staged_particles',
+                              'staged_config', 'staged_models'},
+                       writes={'custom_dir'})
+
+            if is_tf2:
+                stages.add('precache', build_precache, writes={'custom_dir', 'game_models'})
+                stages.add('configure', configure, writes={'custom_dir'})
+
+            stages.run()
+
             progress(97, "Finalizing...")
 
             get_from_custom_dir(custom_dir)
@@ -431,6 +567,7 @@ class InstallService:
         finally:
             prepare_working_copy()
 
+    @traced('uninstall')
     def uninstall(self, tf_path: Path, on_progress: ProgressCallback | None = None, sourcemod: Sourcemods = Sourcemods.DEFAULT):
         # resets everything
         def progress(pct: int, msg: str):
@@ -439,6 +576,7 @@ class InstallService:
 
         try:
             prepare_working_copy()
+            delete(config.staging_dir, not_exist_ok=True)
             custom_dir = tf_path / 'custom'
             custom_dir.mkdir(exist_ok=True)
 
@@ -446,9 +584,11 @@ class InstallService:
 
             if sourcemod == Sourcemods.TF2:
                 self.cleanup_huds(custom_dir)
-                restore_skybox_files(tf_path)
-                restore_particle_files(tf_path)
-                enable_paints(tf_path)
+                vpk_batch = VPKPatchBatch(tf_path / get_vpk_name(tf_path))
+                restore_skybox_files(tf_path, batch=vpk_batch)
+                restore_particle_files(tf_path, batch=vpk_batch)
+                enable_paints(tf_path, batch=vpk_batch)
+                vpk_batch.commit()
 
                 QuickPrecache(tf_path.parents[0], debug=False).run(flush=True)
                 quick_precache_path = custom_dir / "_QuickPrecache.vpk"
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from core.constants import HARDLINK_SAFE_SUFFIXES
+from core.util.file import clone, delete
+from core.version import VERSION
+
+log = logging.getLogger()
+
+STAGING_FORMAT = 1
+
+
+@dataclass
+class StagedFile:
+    source: str
+    size: int
+    mtime_ns: int
+    hash: str
+    addon_index: int
+
+
+def _hash_file(file: Path) -> str:
+    with open(file, 'rb') as f:
+        return hashlib.file_digest(f, 'blake2b').hexdigest()
+
+
+def file_states(files: list[Path]) -> dict[str, list[int]]:
+    """Size and mtime of each existing file, for transforms that depend on files outside the group (e.g. game VPKs)."""
+    return {str(file): [file.stat().st_size, file.stat().st_mtime_ns] for file in files if file.exists()}
+
+
+def staging_group_name(rel_path: str) -> str | None:
+    """
+    Name of the staging group a staged file belongs to, if any.
+
+    Args:
+        rel_path: Path of the file relative to the staging root, with forward slashes.
+
+    Returns:
+        `sound` for sounds, `models` for models and materials outside of skyboxes, None for everything else.
+    """
+
+    rel_path = rel_path.lower()
+    if rel_path.startswith('sound/'):
+        return 'sound'
+    if rel_path.startswith(('models/', 'materials/')) and not rel_path.startswith('materials/skybox/'):
+        return 'models'
+    return None
+
+
+class StagingGroup:
+    """
+    A subtree of the staged addon files that gets transformed as a whole and is kept between installs.
+
+    The group's manifest records every input's source path, size, mtime and content hash along with the
+    transform that was applied. The transform only runs again when the inputs or its parameters changed,
+    otherwise the previous output is linked into the staging folder as-is. Sources whose size or mtime
+    changed are hashed again, so touching a file without changing it does not trigger a rebuild.
+    """
+
+    def __init__(self, staging_dir: Path, name: str, transform: str):
+        self.name = name
+        self.transform = transform
+        self.root = staging_dir / name
+        self.files_dir = self.root / 'files'
+        self.manifest_file = self.root / 'manifest.json'
+        self.inputs: dict[str, tuple[Path, int]] = {}
+
+    def add(self, rel_path: str, source: Path, addon_index: int) -> None:
+        """
+        Add an input file.
+
+        Args:
+            rel_path: Path of the file relative to the staging root, with forward slashes.
+            source: The addon file.
+            addon_index: Load-order index of the addon the file comes from.
+        """
+
+        self.inputs[rel_path] = (source, addon_index)
+
+    def sync(self, target_dir: Path, build: Callable[[Path, dict[Path, int]], object], params: dict) -> bool:
+        """
+        Bring the group's output up to date and link it into the staging folder.
+
+        Args:
+            target_dir: The staging folder, e.g. `config.temp_to_be_vpk_dir`.
+            build: Transforms the group in place, called with the group's folder and a mapping of each of its
+                   files to the load-order index of the addon it came from.
+            params: Anything else the transform's output depends on, must be JSON serializable.
+
+        Returns:
+            True if the transform had to run, False if the previous output was reused.
+        """
+
+        if not self.inputs:
+            return False
+
+        manifest = self._load_manifest()
+        files = self._stat_inputs(manifest.get('files', {}))
+        digest = self._digest(files, params)
+
+        rebuild = manifest.get('digest') != digest or not self.files_dir.is_dir()
+        if rebuild:
+            log.info(f'Staging {len(files)} {self.name} files ({self.transform})')
+            self._rebuild(files, digest, params, build)
+        else:
+            log.info(f'Reusing {len(files)} staged {self.name} files, nothing changed since the last install')
+            # sources may have been touched without changing, keep their new mtimes so they aren't hashed again
+            self._write_manifest(files, digest, params)
+
+        # nothing modifies these in the staging folder, so they can all be links into the kept output
+        clone(self.files_dir, target_dir, hardlink=True)
+        return rebuild
+
+    def _load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_file, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        if manifest.get('format') != STAGING_FORMAT or manifest.get('transform') != self.transform:
+            return {}
+        return manifest
+
+    def _stat_inputs(self, previous: dict[str, dict]) -> dict[str, StagedFile]:
+        files = {}
+        for rel_path, (source, addon_index) in sorted(self.inputs.items()):
+            st = source.stat()
+            known = previous.get(rel_path)
+            if (known and known['source'] == str(source) and
+                known['size'] == st.st_size and
+                known['mtime_ns'] == st.st_mtime_ns):
+                file_hash = known['hash']
+            else:
+                file_hash = _hash_file(source)
+            files[rel_path] = StagedFile(str(source), st.st_size, st.st_mtime_ns, file_hash, addon_index)
+        return files
+
+    def _digest(self, files: dict[str, StagedFile], params: dict) -> str:
+        state = {
+            'version': VERSION,
+            'transform': self.transform,
+            'params': params,
+            'files': [(rel_path, file.hash, file.addon_index) for rel_path, file in files.items()],
+        }
+        return hashlib.blake2b(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+    def _rebuild(self, files: dict[str, StagedFile], digest: str, params: dict,
+                 build: Callable[[Path, dict[Path, int]], object]) -> None:
+        # the manifest goes last, an interrupted rebuild leaves no manifest and is redone next time
+        delete(self.root, not_exist_ok=True)
+        self.files_dir.mkdir(parents=True)
+
+        file_origin: dict[Path, int] = {}
+        for rel_path, file in files.items():
+            dest_path = self.files_dir / rel_path
+            clone(Path(file.source), dest_path, hardlink=dest_path.suffix.lower() in HARDLINK_SAFE_SUFFIXES)
+            file_origin[dest_path] = file.addon_index
+
+        build(self.files_dir, file_origin)
+        self._write_manifest(files, digest, params)
+
+    def _write_manifest(self, files: dict[str, StagedFile], digest: str, params: dict) -> None:
+        manifest = {
+            'format': STAGING_FORMAT,
+            'transform': self.transform,
+            'digest': digest,
+            'params': params,
+            'files': {rel_path: asdict(file) for rel_path, file in files.items()},
+        }
+        with open(self.manifest_file, 'w') as f:
+            json.dump(manifest, f, indent=2)
@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+from pathlib import Path
+
+log = logging.getLogger()
+
+
+class ArtifactCache:
+    """
+    Build outputs kept on disk between runs, one file per key.
+
+    Keys are expected to be content hashes of everything the output depends on, so entries never go stale and are
+    only ever added or dropped. Reading an entry refreshes its mtime, `prune()` drops the least recently used ones
+    once the cache grows past its size cap. Entries are written next to their destination and swapped in, so
+    processes sharing the cache never read a partial entry.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int, suffix: str = '.bin'):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}{self.suffix}'
+
+    def get(self, key: str) -> bytes | None:
+        """The stored output, None on a miss or if the entry can't be read."""
+
+        cache_file = self._path(key)
+        try:
+            data = cache_file.read_bytes()
+            # refreshed so pruning drops the least recently used entries
+            os.utime(cache_file)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError:
+            log.warning(f'Could not read cached artifact {cache_file}', exc_info=True)
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store an output, failing to do so only loses the cache entry."""
+
+        cache_file = self._path(key)
+        temp_file = cache_file.with_name(f'{cache_file.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            temp_file.write_bytes(data)
+            os.replace(temp_file, cache_file)
+        except OSError:
+            log.warning(f'Could not cache artifact {cache_file}', exc_info=True)
+            temp_file.unlink(missing_ok=True)
+
+    def prune(self) -> int:
+        """
+        Drop the least recently used entries until the cache fits its size cap.
+
+        Returns:
+            The number of entries dropped.
+        """
+
+        dropped = 0
+        try:
+            entries = []
+            for entry in self.cache_dir.glob(f'*{self.suffix}'):
+                st = entry.stat()
+                entries.append((st.st_mtime_ns, st.st_size, entry))
+            entries.sort()
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                entry.unlink(missing_ok=True)
+                total -= size
+                dropped += 1
+        except FileNotFoundError:
+            pass
+        except OSError:
+            log.debug(f'Could not prune {self.cache_dir}', exc_info=True)
+        return dropped
@@ -2,11 +2,17 @@ import logging
 import os
 import shutil
 import stat
+import sys
 from collections.abc import Callable, Sequence
 from pathlib import Path
 
 log = logging.getLogger()
 
+_FICLONE = 0x40049409 # from linux/fs.h
+# (src device, dst device) pairs a reflink or hardlink already failed on, so they aren't retried for every file
+_no_reflink: set[tuple[int, int]] = set()
+_no_hardlink: set[tuple[int, int]] = set()
+
 #
 # TODO: replace shutil with pathlib (except for rmtree) once we hit python 3.14 minimum version
 #
@@ -160,6 +166,106 @@ def move(
         raise Exception(f'Error moving\n{src} -> {dst}') from e
 
 
+def _reflink(src: Path, dst: Path) -> bool:
+    """
+    Clone a file's data without copying it, only supported by copy-on-write filesystems (e.g. btrfs and XFS) on Linux.
+
+    Args:
+        src: The source file.
+        dst: The destination file, must not exist.
+
+    Returns:
+        True if the clone was made, False if the filesystem does not support it.
+    """
+
+    if sys.platform != 'linux':
+        return False
+
+    import fcntl
+
+    with open(src, 'rb') as src_fd, open(dst, 'wb') as dst_fd:
+        try:
+            fcntl.ioctl(dst_fd.fileno(), _FICLONE, src_fd.fileno())
+            return True
+        except OSError:
+            pass
+
+    dst.unlink()
+    return False
+
+
+def _clone_file(src: Path, dst: Path, hardlink: bool) -> None:
+    # never write through an existing destination, it might be a link to some other file
+    dst.unlink(missing_ok=True)
+    devices = (src.stat().st_dev, dst.parent.stat().st_dev)
+
+    if devices not in _no_reflink:
+        if _reflink(src, dst):
+            shutil.copystat(src, dst)
+            return
+        _no_reflink.add(devices)
+
+    if hardlink and devices not in _no_hardlink:
+        try:
+            dst.hardlink_to(src)
+            return
+        except OSError:
+            _no_hardlink.add(devices)
+
+    shutil.copy2(src, dst)
+
+
+def clone(src: Path, dst: Path, hardlink: bool = False) -> Path:
+    """
+    Copy a file or directory, sharing the data with the source wherever the filesystem allows it.
+
+    Files are reflinked where supported, which is as safe as a copy since the filesystem copies data on write.
+    With `hardlink`, files are hard linked next, which makes the destination the same file as the source, so
+    it is only suitable for files that are never modified in place (or get `unshare()`d before they are).
+    Everything else is copied.
+
+    Args:
+        src: The source file.
+        dst: The destination file, overwritten if it exists.
+        hardlink: Fall back to hard links before copying.
+
+    Returns:
+        The destination path.
+    """
+
+    try:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if src.is_file():
+            _clone_file(src, dst, hardlink)
+        else:
+            shutil.copytree(src, dst, copy_function=lambda s, d: _clone_file(Path(s), Path(d), hardlink), dirs_exist_ok=True)
+
+        log.debug(f'Cloned {src} -> {dst}')
+        return dst
+    except Exception as e:
+        raise Exception(f'Error copying {src} -> {dst}') from e
+
+
+def unshare(file: Path) -> None:
+    """
+    Give a hard linked file its own copy of its data, so it can be modified without changing its other links.
+
+    Args:
+        file: The file to operate on.
+    """
+
+    try:
+        if file.stat().st_nlink <= 1:
+            return
+
+        temp_file = file.with_name(file.name + '.unshare')
+        shutil.copy2(file, temp_file)
+        os.replace(temp_file, file)
+        log.debug(f'Unshared {file}')
+    except Exception as e:
+        raise Exception(f'Error unsharing {file}') from e
+
+
 def _format_mode(mode: int) -> str:
     """
     Format a file permission mode into a human-readable representation (e.g. rwxrwxrwx).
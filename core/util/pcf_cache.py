@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from valve_parsers import PCFElement, PCFFile
+
+from core.config import config
+from core.util.pcf import decode_pcf
+
+log = logging.getLogger()
+
+# part of every cache key, bump it whenever `decode_pcf()` decodes anything differently
+PCF_CACHE_FORMAT = 2
+PCF_CACHE_MAX_BYTES = 512 * 1024 * 1024
+MEMORY_CACHE_SIZE = 8
+
+_memory: OrderedDict[str, PCFFile] = OrderedDict()
+_lock = threading.Lock()
+
+
+def pcf_digest(data: bytes) -> str:
+    """Hash of a PCF's contents and `PCF_CACHE_FORMAT`, identifies what decoding it produces."""
+
+    digest = hashlib.blake2b(data, digest_size=20)
+    digest.update(f'{PCF_CACHE_FORMAT}'.encode())
+    return digest.hexdigest()
+
+
+def copy_pcf(pcf: PCFFile, input_file: Path | None = None) -> PCFFile:
+    """
+    Copy a decoded PCF so it can be modified without affecting the original.
+
+    The element list, elements, attribute dicts and string dictionary are copied, attribute values are shared.
+    Nothing modifies those in place, they are always replaced as a whole `(type, value)` tuple.
+
+    Args:
+        pcf: The PCF to copy.
+        input_file: Input file of the copy, defaults to that of `pcf`.
+    """
+
+    result = PCFFile(input_file or pcf.input_file, version=pcf.version)
+    result.string_dictionary = pcf.string_dictionary.copy()
+    result.elements = [
+        PCFElement(
+            type_name_index=element.type_name_index,
+            element_name=element.element_name,
+            data_signature=element.data_signature,
+            attributes=element.attributes.copy()
+        )
+        for element in pcf.elements
+    ]
+    return result
+
+
+def load_vanilla_pcf(path: Path) -> PCFFile:
+    """
+    Decode a PCF through the decoded PCF cache.
+
+    Decoded PCFs are kept in memory (LRU) and on disk in `config.pcf_cache_dir` as pickles, keyed by a hash of the
+    file's contents and `PCF_CACHE_FORMAT`. The vanilla PCFs only change with a game update, so each one is only
+    decoded once per game version instead of on every install and import.
+
+    Args:
+        path: The PCF to decode.
+
+    Returns:
+        The cached PCF with `path` as its input file. Its elements and string dictionary are shared with every other
+        caller, `copy_pcf()` it before modifying anything.
+    """
+
+    data = path.read_bytes()
+    key = pcf_digest(data)
+
+    with _lock:
+        pcf = _memory.get(key)
+        if pcf is not None:
+            _memory.move_to_end(key)
+
+    if pcf is None:
+        pcf = _read_cache(key)
+        if pcf is None:
+            pcf = decode_pcf(path, data)
+            _write_cache(key, pcf)
+
+        with _lock:
+            _memory[key] = pcf
+            while len(_memory) > MEMORY_CACHE_SIZE:
+                _memory.popitem(last=False)
+
+    view = PCFFile(path, version=pcf.version)
+    view.string_dictionary = pcf.string_dictionary
+    view.elements = pcf.elements
+    return view
+
+
+def _read_cache(key: str) -> PCFFile | None:
+    cache_file = config.pcf_cache_dir / f'{key}.pickle'
+    try:
+        with open(cache_file, 'rb') as f:
+            pcf = pickle.load(f)
+        # refreshed so pruning drops the least recently used entries
+        os.utime(cache_file)
+        return pcf
+    except FileNotFoundError:
+        return None
+    except Exception:
+        log.warning(f'Could not read cached PCF {cache_file}, decoding it again', exc_info=True)
+        return None
+
+
+def _write_cache(key: str, pcf: PCFFile) -> None:
+    cache_dir = config.pcf_cache_dir
+    cache_file = cache_dir / f'{key}.pickle'
+    temp_file = cache_file.with_name(f'{cache_file.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(temp_file, 'wb') as f:
+            pickle.dump(pcf, f, protocol=5)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        log.warning(f'Could not cache decoded PCF {cache_file}', exc_info=True)
+        temp_file.unlink(missing_ok=True)
+        return
+
+    # entries from previous game versions are never read again, drop the oldest once the cache grows too large
+    try:
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry) for entry in cache_dir.glob('*.pickle'))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= PCF_CACHE_MAX_BYTES:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+    except OSError:
+        log.debug('Could not prune the PCF cache', exc_info=True)
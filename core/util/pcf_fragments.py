@@ -0,0 +1,316 @@
+import logging
+import marshal
+import os
+import struct
+import threading
+from collections import defaultdict
+from collections.abc import Iterable
+from functools import cache
+from pathlib import Path
+from typing import BinaryIO
+
+from valve_parsers import AttributeType, PCFElement, PCFFile
+
+from core.config import config
+from core.util.pcf import PCFIndex, element_references
+from core.util.pcf_cache import load_vanilla_pcf, pcf_digest
+
+log = logging.getLogger()
+
+FRAGMENT_FORMAT = 2
+_MAGIC = b'PCFFRAGS'
+# magic, format, offset and size of the table of contents
+_HEADER = struct.Struct('<8sIQQ')
+_ATTRIBUTE_TYPES = {int(attr_type): attr_type for attr_type in AttributeType}
+
+
+def _encode_element(element: PCFElement) -> tuple:
+    attributes = [(attr_name, int(attr_type), value) for attr_name, (attr_type, value) in element.attributes.items()]
+    return element.type_name_index, element.element_name, element.data_signature, attributes
+
+
+def _decode_element(encoded: tuple, new_index: dict[int, int]) -> PCFElement:
+    # like `extract_elements()`, references to anything that was not assembled are kept as-is
+    type_name_index, element_name, data_signature, encoded_attributes = encoded
+    attributes = {}
+    for attr_name, attr_type, value in encoded_attributes:
+        attr_type = _ATTRIBUTE_TYPES[attr_type]
+        if attr_type == AttributeType.ELEMENT:
+            value = new_index.get(value, value)
+        elif attr_type == AttributeType.ELEMENT_ARRAY:
+            value = [new_index.get(target, target) for target in value]
+        attributes[attr_name] = (attr_type, value)
+    return PCFElement(
+        type_name_index=type_name_index,
+        element_name=element_name,
+        data_signature=data_signature,
+        attributes=attributes
+    )
+
+
+def build_fragments(pcf: PCFFile) -> tuple[dict, list[bytes]]:
+    """
+    Split a PCF into the fragments each particle system is assembled from.
+
+    Every element below a system down to other systems belongs to it. Elements that belong to the same set of
+    systems are stored together in one fragment, so a system is its own fragment plus those it shares with
+    others, and no element is stored twice. Elements keep their index in the PCF and references stay as they
+    are. References to other systems (children) are recorded as links, so shared child systems are only
+    stored once as well.
+
+    Args:
+        pcf: The PCF to split.
+
+    Returns:
+        The table of contents entry of the PCF, with blob numbers in place of file offsets, and the blobs.
+    """
+
+    index = PCFIndex(pcf)
+    elements = pcf.elements
+    count = len(elements)
+    systems = index.of_type('DmeParticleSystemDefinition')
+    is_system = bytearray(count)
+    for system in systems:
+        is_system[system] = 1
+
+    owners: dict[int, list[int]] = defaultdict(list)
+    links = {}
+    for system in systems:
+        members = {system}
+        linked = set()
+        stack = [system]
+        while stack:
+            for child in element_references(elements[stack.pop()]):
+                # the root and dangling references are kept as they are
+                if child == 0 or child >= count or child in members:
+                    continue
+                if is_system[child]:
+                    linked.add(child)
+                    continue
+                members.add(child)
+                stack.append(child)
+        for idx in members:
+            owners[idx].append(system)
+        links[system] = tuple(sorted(linked))
+
+    fragments: dict[tuple[int, ...], list[int]] = defaultdict(list)
+    for idx in sorted(owners):
+        fragments[tuple(owners[idx])].append(idx)
+
+    blobs = [marshal.dumps(pcf.string_dictionary), marshal.dumps(_encode_element(elements[0]))]
+    system_fragments = defaultdict(list)
+    for number, (fragment_owners, members) in enumerate(fragments.items()):
+        for system in fragment_owners:
+            system_fragments[system].append(number)
+        blobs.append(marshal.dumps([(idx, _encode_element(elements[idx])) for idx in members]))
+
+    entry = {
+        'version': pcf.version,
+        'strings': 0,
+        'root': 1,
+        'fragments': list(range(2, len(blobs))),
+        'names': {},
+        'systems': {},
+    }
+    for system in systems:
+        # names only ever resolve to systems, even where a child reference of the same name comes first
+        entry['names'].setdefault(elements[system].element_name, system)
+        entry['systems'][system] = (tuple(system_fragments[system]), links[system])
+
+    return entry, blobs
+
+
+class FragmentLibrary:
+    """
+    Precomputed fragments of every vanilla particle system, for filling in the systems a mod does not replace.
+
+    Filling in used to decode the whole vanilla PCF and walk its element graph for every target. The library
+    splits each vanilla PCF into fragments once (see `build_fragments()`) and keeps them in a single container
+    file: a header, the encoded fragments back to back and a table of contents with the offset of each.
+    Assembling a set of systems only follows the links between systems in the table of contents, reads their
+    fragments and renumbers the elements in them.
+
+    Each PCF's entry is keyed by `pcf_digest()` of the vanilla file and rebuilt when it no longer matches, e.g.
+    after a game update. Rebuilding rewrites the container next to the old one and swaps it in.
+    """
+
+    def __init__(self, library_file: Path):
+        self.library_file = library_file
+        self._lock = threading.RLock()
+        self._toc: dict[str, dict] = {}
+        self._toc_state: tuple[int, int] | None = None
+        self._digests: dict[Path, tuple[int, int, str]] = {}
+
+    def update(self, pcf_paths: Iterable[Path]) -> int:
+        """
+        Rebuild the entries of the given vanilla PCFs that are missing or out of date.
+
+        Args:
+            pcf_paths: The vanilla PCFs, entries are keyed by file name.
+
+        Returns:
+            The number of entries rebuilt.
+        """
+
+        with self._lock:
+            self._refresh_toc()
+            stale = {}
+            for path in pcf_paths:
+                digest = self._digest(path)
+                entry = self._toc.get(path.name)
+                if entry is None or entry['digest'] != digest:
+                    stale[path.name] = (path, digest)
+
+            if not stale:
+                return 0
+
+            built = {}
+            for name, (path, digest) in stale.items():
+                log.debug(f'Building particle system fragments of {path}')
+                entry, blobs = build_fragments(load_vanilla_pcf(path))
+                entry['digest'] = digest
+                built[name] = (entry, blobs)
+
+            self._write(built)
+            log.info(f'Built particle system fragments of {len(built)} vanilla PCFs')
+            return len(built)
+
+    def assemble(self, pcf_path: Path, system_names: Iterable[str]) -> PCFFile:
+        """
+        Assemble particle systems of a vanilla PCF from their fragments.
+
+        The same elements in the same order as `extract_elements()` on the vanilla PCF, as long as each name's
+        first element is the system. Names are only looked up among systems, `extract_elements()` follows
+        whatever element comes first, e.g. a child reference of the same name that points at another system.
+
+        Args:
+            pcf_path: The vanilla PCF, its entry is rebuilt first if it is out of date.
+            system_names: Names of the particle systems, their child systems are included as well. Names without
+                          a system are skipped.
+
+        Returns:
+            A PCF with the root element and the requested systems, sharing nothing with the library.
+        """
+
+        with self._lock:
+            self.update([pcf_path])
+            entry = self._toc[pcf_path.name]
+            systems = entry['systems']
+
+            names = entry['names']
+            stack = [names[name] for name in (name.encode('ascii') for name in system_names) if name in names]
+            needed = set()
+            while stack:
+                system = stack.pop()
+                if system not in needed:
+                    needed.add(system)
+                    stack.extend(systems[system][1])
+
+            numbers = sorted({number for system in needed for number in systems[system][0]})
+            with open(self.library_file, 'rb') as f:
+                string_dictionary = marshal.loads(self._read_blob(f, entry['strings']))
+                root = marshal.loads(self._read_blob(f, entry['root']))
+                fragments = [marshal.loads(self._read_blob(f, entry['fragments'][number])) for number in numbers]
+
+        # the root keeps index 0, everything else keeps its order in the vanilla PCF
+        encoded = sorted((element for fragment in fragments for element in fragment), key=lambda element: element[0])
+        new_index = {idx: new_idx for new_idx, (idx, _) in enumerate(encoded, 1)}
+        elements = [_decode_element(root, new_index)]
+        elements.extend(_decode_element(element, new_index) for _, element in encoded)
+
+        root_attributes = elements[0].attributes
+        attr_type, _ = root_attributes[b'particleSystemDefinitions']
+        root_attributes[b'particleSystemDefinitions'] = (attr_type, [new_index[system] for system in sorted(needed)])
+
+        pcf = PCFFile(pcf_path, version=entry['version'])
+        pcf.string_dictionary = string_dictionary
+        pcf.elements = elements
+        return pcf
+
+    def _digest(self, path: Path) -> str:
+        # hashing item_fx.pcf on every lookup adds up, only files whose size or mtime changed are hashed again
+        st = path.stat()
+        known = self._digests.get(path)
+        if known and known[:2] == (st.st_size, st.st_mtime_ns):
+            return known[2]
+        digest = pcf_digest(path.read_bytes())
+        self._digests[path] = (st.st_size, st.st_mtime_ns, digest)
+        return digest
+
+    def _read_blob(self, f: BinaryIO, location: tuple[int, int]) -> bytes:
+        offset, size = location
+        f.seek(offset)
+        return f.read(size)
+
+    def _refresh_toc(self) -> None:
+        # another process may have rebuilt the container since it was last read
+        try:
+            st = self.library_file.stat()
+        except FileNotFoundError:
+            self._toc, self._toc_state = {}, None
+            return
+
+        if self._toc_state == (st.st_size, st.st_mtime_ns):
+            return
+
+        try:
+            with open(self.library_file, 'rb') as f:
+                magic, fragment_format, toc_offset, toc_size = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != _MAGIC or fragment_format != FRAGMENT_FORMAT:
+                    raise ValueError(f'Unsupported fragment library format {fragment_format}')
+                self._toc = marshal.loads(self._read_blob(f, (toc_offset, toc_size)))
+        except Exception:
+            log.warning(f'Could not read {self.library_file}, rebuilding it', exc_info=True)
+            self._toc = {}
+        self._toc_state = (st.st_size, st.st_mtime_ns)
+
+    def _write(self, built: dict[str, tuple[dict, list[bytes]]]) -> None:
+        self.library_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = self.library_file.with_name(f'{self.library_file.name}.{os.getpid()}.tmp')
+        toc = {}
+        try:
+            with open(temp_file, 'wb') as out:
+                out.write(b'\0' * _HEADER.size)
+
+                def write(blob: bytes) -> tuple[int, int]:
+                    offset = out.tell()
+                    out.write(blob)
+                    return offset, len(blob)
+
+                # unchanged entries are copied over from the current container
+                kept = {name: entry for name, entry in self._toc.items() if name not in built}
+                if kept:
+                    with open(self.library_file, 'rb') as f:
+                        for name, entry in kept.items():
+                            toc[name] = _relocate(entry, lambda location, f=f: write(self._read_blob(f, location)))
+
+                for name, (entry, blobs) in built.items():
+                    toc[name] = _relocate(entry, lambda blob_number, blobs=blobs: write(blobs[blob_number]))
+
+                toc_offset, toc_size = write(marshal.dumps(toc))
+                out.seek(0)
+                out.write(_HEADER.pack(_MAGIC, FRAGMENT_FORMAT, toc_offset, toc_size))
+            os.replace(temp_file, self.library_file)
+        except Exception as e:
+            temp_file.unlink(missing_ok=True)
+            raise Exception(f'Error writing {self.library_file}') from e
+
+        st = self.library_file.stat()
+        self._toc = toc
+        self._toc_state = (st.st_size, st.st_mtime_ns)
+
+
+def _relocate(entry: dict, place) -> dict:
+    # entry with each blob reference (a number or an old location) replaced by its location in the new container
+    return dict(
+        entry,
+        strings=place(entry['strings']),
+        root=place(entry['root']),
+        fragments=[place(blob) for blob in entry['fragments']],
+    )
+
+
+@cache
+def fragment_library() -> FragmentLibrary:
+    """The fragment library in `config.fragment_library_file`, shared by everything in this process."""
+    return FragmentLibrary(config.fragment_library_file)
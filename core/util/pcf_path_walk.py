@@ -1,17 +1,17 @@
 import logging
 from pathlib import Path
 
-from valve_parsers import PCFFile
-
 from core.config import config
 from core.constants import PARTICLE_SPLITS
-from core.operations.pcf_merge import merge_pcf_files
+from core.operations.pcf_merge import merge_many, merge_pcf_files
 from core.operations.pcf_rebuild import (
-    extract_elements,
     get_pcf_element_names,
     load_particle_system_map,
 )
 from core.util.file import copy
+from core.util.pcf import decode_pcf
+from core.util.pcf_fragments import fragment_library
+from core.util.pcf_toc import load_toc
 
 log = logging.getLogger()
 
@@ -152,20 +152,15 @@ def apply_particle_selections(selections: dict) -> bool:
                     if source_file.exists():
                         # copy particle file to to_be_patched
                         copy(source_file, config.temp_to_be_patched_dir / f"{particle_file}.pcf")
-                        # get particle file mats from attrib
-                        pcf = PCFFile(source_file).decode()
-                        system_defs = pcf.get_elements_by_type('DmeParticleSystemDefinition')
-                        for element in system_defs:
-                            material_value = pcf.get_attribute_value(element, 'material')
-                            if material_value and isinstance(material_value, bytes):
-                                material_path = material_value.decode('ascii')
-                                # ignore vgui/white
-                                if material_path == 'vgui/white':
-                                    continue
-                                if material_path.endswith('.vmt'):
-                                    required_materials.add(material_path)
-                                else:
-                                    required_materials.add(material_path + ".vmt")
+                        # get particle file mats from its table of contents
+                        for material_path in load_toc(source_file).materials:
+                            # ignore vgui/white
+                            if material_path == 'vgui/white':
+                                continue
+                            if material_path.endswith('.vmt'):
+                                required_materials.add(material_path)
+                            else:
+                                required_materials.add(material_path + ".vmt")
 
     for mod_name in used_mods:
         mod_dir = config.particles_dir / mod_name
@@ -195,14 +190,8 @@ def apply_particle_selections(selections: dict) -> bool:
 
         # if we have splits for this original file, merge them
         if split_files_in_temp:
-            pcf_parts = [PCFFile(split_file).decode() for split_file in split_files_in_temp]
-
-            if len(pcf_parts) > 1:
-                merged = pcf_parts[0]
-                for pcf in pcf_parts[1:]:
-                    merged = merge_pcf_files(merged, pcf)
-            else:
-                merged = pcf_parts[0]
+            pcf_parts = [decode_pcf(split_file) for split_file in split_files_in_temp]
+            merged = merge_many(pcf_parts)
 
             output_path = config.temp_to_be_patched_dir / original_file
             merged.encode(output_path)
@@ -217,7 +206,7 @@ def apply_particle_selections(selections: dict) -> bool:
         merged_file = config.temp_to_be_patched_dir / original_file
 
         if merged_file.exists():
-            merged_pcf = PCFFile(merged_file).decode()
+            merged_pcf = decode_pcf(merged_file)
             elements_we_have = get_pcf_element_names(merged_pcf)
 
             elements_we_still_need = set()
@@ -228,8 +217,7 @@ def apply_particle_selections(selections: dict) -> bool:
             if elements_we_still_need:
                 vanilla_file = config.temp_to_be_referenced_dir / original_file
                 if vanilla_file.exists():
-                    vanilla_pcf = PCFFile(vanilla_file).decode()
-                    vanilla_elements = extract_elements(vanilla_pcf, elements_we_still_need)
+                    vanilla_elements = fragment_library().assemble(vanilla_file, elements_we_still_need)
                     complete_pcf = merge_pcf_files(merged_pcf, vanilla_elements)
                     complete_pcf.encode(merged_file)
 
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from valve_parsers import AttributeType, PCFFile
+
+from core.util.pcf import PCFIndex, decode_pcf, encode_pcf
+
+log = logging.getLogger()
+
+PCF_TOC_FORMAT = 1
+
+
+@dataclass
+class PCFToc:
+    """What the rest of the program needs to know about a processed PCF, without decoding it."""
+
+    size: int
+    mtime_ns: int
+    hash: str
+    element_count: int
+    systems: list[str] = field(default_factory=list)
+    """Names of the particle system definitions, in element order"""
+    children: dict[str, list[str]] = field(default_factory=dict)
+    """Child systems of each system that has any"""
+    materials: list[str] = field(default_factory=list)
+    """Distinct `material` values of the particle system definitions"""
+
+
+def toc_path(pcf_path: Path) -> Path:
+    """The sidecar of a PCF, e.g. `item_fx.pcf.toc.json` next to `item_fx.pcf`."""
+    return pcf_path.with_name(f'{pcf_path.name}.toc.json')
+
+
+def build_toc(pcf: PCFFile, pcf_path: Path, data: bytes) -> PCFToc:
+    """
+    Collect the table of contents of a decoded PCF.
+
+    Args:
+        pcf: The decoded PCF.
+        pcf_path: Where it is stored, for its size and mtime.
+        data: Its contents as stored in `pcf_path`.
+    """
+
+    index = PCFIndex(pcf)
+    elements = pcf.elements
+    st = pcf_path.stat()
+    toc = PCFToc(st.st_size, st.st_mtime_ns, hashlib.blake2b(data).hexdigest(), len(elements))
+
+    for idx in index.of_type('DmeParticleSystemDefinition'):
+        element = elements[idx]
+        name = element.element_name.decode('ascii', errors='replace')
+        toc.systems.append(name)
+
+        material = element.attributes.get(b'material')
+        if material and isinstance(material[1], bytes):
+            material_path = material[1].decode('ascii', errors='replace')
+            if material_path not in toc.materials:
+                toc.materials.append(material_path)
+
+        attr_type, child_indices = element.attributes.get(b'children', (None, []))
+        if attr_type != AttributeType.ELEMENT_ARRAY:
+            continue
+        children = []
+        for child_idx in child_indices:
+            if child_idx >= len(elements):
+                continue
+            attr_type, system_idx = elements[child_idx].attributes.get(b'child', (None, None))
+            if attr_type == AttributeType.ELEMENT and system_idx < len(elements):
+                children.append(elements[system_idx].element_name.decode('ascii', errors='replace'))
+        if children:
+            toc.children[name] = children
+
+    return toc
+
+
+def write_pcf(pcf: PCFFile, pcf_path: Path) -> PCFToc:
+    """
+    Encode a PCF to a file and write its sidecar next to it.
+
+    Both are written next to their destination and swapped in, so readers never see a partially written file.
+
+    Args:
+        pcf: The PCF to encode.
+        pcf_path: Where to write it.
+
+    Returns:
+        The table of contents that was written.
+    """
+
+    data = encode_pcf(pcf)
+    _write_atomic(pcf_path, data)
+    toc = build_toc(pcf, pcf_path, data)
+    _write_sidecar(pcf_path, toc)
+    return toc
+
+
+def load_toc(pcf_path: Path) -> PCFToc:
+    """
+    Read the table of contents of a PCF from its sidecar.
+
+    The sidecar is trusted as long as the PCF's size and mtime match. Otherwise the PCF is hashed, and only decoded
+    to regenerate the sidecar if its contents changed too, or if there is no usable sidecar (e.g. for mods imported
+    before sidecars existed).
+
+    Args:
+        pcf_path: The PCF.
+    """
+
+    toc = _read_sidecar(pcf_path)
+    st = pcf_path.stat()
+    if toc is not None and (toc.size, toc.mtime_ns) == (st.st_size, st.st_mtime_ns):
+        return toc
+
+    data = pcf_path.read_bytes()
+    if toc is not None and toc.hash == hashlib.blake2b(data).hexdigest():
+        toc.size, toc.mtime_ns = st.st_size, st.st_mtime_ns
+    else:
+        log.debug(f'Regenerating the table of contents of {pcf_path}')
+        toc = build_toc(decode_pcf(pcf_path, data), pcf_path, data)
+
+    _write_sidecar(pcf_path, toc)
+    return toc
+
+
+def _read_sidecar(pcf_path: Path) -> PCFToc | None:
+    try:
+        with open(toc_path(pcf_path), 'r', encoding='utf-8') as f:
+            sidecar = json.load(f)
+        if sidecar.pop('format', None) != PCF_TOC_FORMAT:
+            return None
+        return PCFToc(**sidecar)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError):
+        log.warning(f'Could not read {toc_path(pcf_path)}, regenerating it', exc_info=True)
+        return None
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    temp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+
+def _write_sidecar(pcf_path: Path, toc: PCFToc) -> None:
+    try:
+        _write_atomic(toc_path(pcf_path), json.dumps({'format': PCF_TOC_FORMAT, **asdict(toc)}).encode('utf-8'))
+    except OSError:
+        log.warning(f'Could not write {toc_path(pcf_path)}', exc_info=True)
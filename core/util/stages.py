@@ -0,0 +1,158 @@
+import logging
+import multiprocessing
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, field
+
+from core.util.trace import span
+
+log = logging.getLogger()
+
+
+def process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """A process pool that is safe to start while other threads are running, which plain fork() is not."""
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(
+        'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'))
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[], object]
+    reads: frozenset[str]
+    writes: frozenset[str]
+    after: list[str] = field(default_factory=list)
+    """Names of the stages that have to finish first"""
+    duration: float = 0.0
+
+
+class StageGraph:
+    """
+    Run a pipeline of stages, concurrently wherever their declared inputs and outputs allow it.
+
+    Stages are added in the order they would run one after another. Each one declares the resources it reads
+    and writes, and depends on every earlier stage that writes something it touches or reads something it
+    writes. Stages that share data keep their declared order, everything else overlaps on a thread pool.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._stages: dict[str, Stage] = {}
+
+    def add(self, name: str, func: Callable[[], object], *, reads: Iterable[str] = (), writes: Iterable[str] = ()) -> None:
+        """
+        Declare a stage.
+
+        Args:
+            name: Unique name of the stage, also used for its trace span.
+            func: Runs the stage, takes no arguments.
+            reads: Resources the stage only reads.
+            writes: Resources the stage modifies.
+        """
+
+        if name in self._stages:
+            raise ValueError(f'Duplicate stage {name}')
+
+        stage = Stage(name, func, frozenset(reads), frozenset(writes))
+        touched = stage.reads | stage.writes
+        for earlier in self._stages.values():
+            if earlier.writes & touched or earlier.reads & stage.writes:
+                stage.after.append(earlier.name)
+        self._stages[name] = stage
+
+    def run(self, max_workers: int | None = None) -> list[Stage]:
+        """
+        Run every stage once its dependencies have finished.
+
+        If a stage raises, no further stages are started, the running ones are waited for and the first
+        exception is re-raised.
+
+        Args:
+            max_workers: Maximum number of stages running at once, defaults to one thread per stage.
+
+        Returns:
+            The critical path, see `critical_path()`.
+        """
+
+        stages = self._stages
+        if not stages:
+            return []
+
+        waiting_on = {name: len(stage.after) for name, stage in stages.items()}
+        dependents: dict[str, list[str]] = {name: [] for name in stages}
+        for stage in stages.values():
+            for dependency in stage.after:
+                dependents[dependency].append(stage.name)
+
+        error: BaseException | None = None
+        with ThreadPoolExecutor(max_workers=max_workers or len(stages), thread_name_prefix=self.name) as executor:
+            running: dict[Future, Stage] = {}
+
+            def submit(stage: Stage) -> None:
+                running[executor.submit(self._run_stage, stage)] = stage
+
+            for name, count in waiting_on.items():
+                if count == 0:
+                    submit(stages[name])
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    exception = future.exception()
+                    if exception is not None:
+                        error = error or exception
+                        continue
+
+                    if error is not None:
+                        continue
+
+                    # dependents are released in declaration order since `dependents` was built that way
+                    for name in dependents[stage.name]:
+                        waiting_on[name] -= 1
+                        if waiting_on[name] == 0:
+                            submit(stages[name])
+
+        if error is not None:
+            raise error
+
+        path = self.critical_path()
+        total = sum(stage.duration for stage in path)
+        log.info(f'{self.name} critical path ({total:.2f}s): ' + ' -> '.join(f'{stage.name} {stage.duration:.2f}s' for stage in path))
+        return path
+
+    def critical_path(self) -> list[Stage]:
+        """The chain of dependent stages with the longest combined duration of the last run."""
+
+        # stages are stored in declaration order, which is already a topological order
+        finish: dict[str, float] = {}
+        previous: dict[str, str | None] = {}
+        for stage in self._stages.values():
+            before = max(stage.after, key=lambda name: finish[name], default=None)
+            finish[stage.name] = stage.duration + (finish[before] if before is not None else 0.0)
+            previous[stage.name] = before
+
+        if not finish:
+            return []
+
+        path = []
+        name: str | None = max(finish, key=lambda name: finish[name])
+        while name is not None:
+            path.append(self._stages[name])
+            name = previous[name]
+        return path[::-1]
+
+    def _run_stage(self, stage: Stage) -> None:
+        start = time.perf_counter()
+        try:
+            with span(f'{self.name}.{stage.name}'):
+                stage.func()
+        finally:
+            stage.duration = time.perf_counter() - start
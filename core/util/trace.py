@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+log = logging.getLogger()
+
+_trace_file: Path | None = None
+_events: list[dict] = []
+# spans open on any thread, a span starting while none are open begins a new run
+_active = 0
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+_local = threading.local()
+
+
+class Span:
+    """A running span, carries the number of items processed within it."""
+
+    __slots__ = ('items', 'name')
+
+    def __init__(self, name: str, items: int = 0):
+        self.name = name
+        self.items = items
+
+    def add(self, count: int = 1) -> None:
+        self.items += count
+
+
+def enable_tracing(trace_file: Path) -> None:
+    """
+    Start recording spans.
+
+    Args:
+        trace_file: Where the Chrome/Perfetto trace of the latest run gets written, rewritten whenever a top-level
+                    span ends.
+    """
+
+    global _trace_file
+    _trace_file = trace_file
+    log.info(f'Tracing enabled, writing to {trace_file}')
+
+
+def tracing_enabled() -> bool:
+    return _trace_file is not None
+
+
+@contextmanager
+def span(name: str, items: int = 0) -> Iterator[Span]:
+    """
+    Record the wall time, CPU time and item count of a block.
+
+    CPU time is that of the calling thread only (`thread_time_ns()`), so work done in other threads or worker
+    processes while the block runs is not counted. Does nothing but hand out a `Span` when tracing is disabled.
+
+    Args:
+        name: Name of the span, dotted by convention, e.g. `install.particles`.
+        items: Initial item count, can be raised later through the yielded `Span`.
+    """
+
+    current = Span(name, items)
+    if _trace_file is None:
+        yield current
+        return
+
+    global _active
+    with _lock:
+        # the trace covers the latest run, e.g. one install, not every span since startup
+        if not _active:
+            _events.clear()
+        _active += 1
+
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    start_wall = time.perf_counter_ns()
+    start_cpu = time.thread_time_ns()
+    try:
+        yield current
+    finally:
+        wall = time.perf_counter_ns() - start_wall
+        cpu = time.thread_time_ns() - start_cpu
+        _local.depth = depth
+
+        event = {
+            'name': name,
+            'cat': name.split('.', 1)[0],
+            'ph': 'X',
+            'ts': start_wall / 1000,
+            'dur': wall / 1000,
+            'pid': os.getpid(),
+            'tid': threading.get_native_id(),
+            'args': {'thread_cpu_ms': round(cpu / 1e6, 3), 'items': current.items},
+        }
+        with _lock:
+            _events.append(event)
+            _active -= 1
+
+        # only top-level spans flush, so a crash or a killed process still leaves every finished stage behind
+        if depth == 0:
+            write_trace()
+
+
+def traced[**P, R](name: str | None = None) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """Decorator form of `span()`, named after the function's qualified name by default."""
+
+    def decorator(func: Callable[P, R]) -> Callable[P, R]:
+        span_name = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def write_trace() -> None:
+    """Write every recorded span to the trace file in Chrome trace event format."""
+
+    if _trace_file is None:
+        return
+
+    # top-level spans of concurrent stages end together, writes are serialized and each one is swapped in whole
+    with _write_lock:
+        with _lock:
+            events = list(_events)
+
+        temp_file = _trace_file.with_name(f'{_trace_file.name}.{os.getpid()}.tmp')
+        try:
+            _trace_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+            os.replace(temp_file, _trace_file)
+        except OSError:
+            log.warning(f'Could not write trace to {_trace_file}', exc_info=True)
+            temp_file.unlink(missing_ok=True)
@@ -1,6 +1,333 @@
+import logging
+import os
+import zlib
+from collections import defaultdict
 from pathlib import Path
 
+from valve_parsers import VPKFile
+from valve_parsers.vpk import _parse_vpk_path
+
+from core.util.trace import span
+
+log = logging.getLogger()
+
 
 def get_vpk_name(game_path: Path | str) -> str:
     """Find the main tf2_misc_dir.vpk file."""
     return "tf2_misc_dir.vpk"
+
+
+def normalize_entry_path(entry_path: str) -> str:
+    """Normalize an entry path the way VPK directories store them (forward slashes, lowercase)."""
+    return entry_path.replace('\\', '/').lower()
+
+
+class VPKPatchBatch:
+    """
+    Queue same-size entry patches for a VPK and write them all at once.
+
+    `VPKFile.patch_file()` opens, seeks and closes the archive for every entry, which turns an install
+    into hundreds of small random writes. A batch instead groups queued writes by archive, sorts them by
+    offset, writes each archive front to back through a single handle and syncs it to disk once.
+
+    Queuing the same entry twice keeps the last data, so callers can layer patches on top of each other
+    and the batch ends up holding the desired final state of every touched entry. On commit, entries whose
+    bytes on disk already match that state are skipped, so re-applying an unchanged install writes nothing.
+    """
+
+    def __init__(self, vpk: VPKFile | Path | str):
+        self.vpk = vpk if isinstance(vpk, VPKFile) else VPKFile(vpk)
+        self._pending: dict[str, tuple[dict, bytes]] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __contains__(self, entry_path: str) -> bool:
+        return normalize_entry_path(entry_path) in self._pending
+
+    def queue(self, entry_path: str, data: bytes) -> bool:
+        """
+        Queue new data for an existing entry.
+
+        Args:
+            entry_path: Path of the entry within the VPK.
+            data: The new contents, must be exactly the size of the original entry.
+
+        Returns:
+            True if the patch was queued, False if the entry is missing or the size does not match.
+        """
+
+        file_info = self.vpk.get_file_info(entry_path)
+        if not file_info:
+            log.warning(f"Could not find {entry_path} in {self.vpk.vpk_path}")
+            return False
+
+        if len(data) != file_info['size']:
+            log.warning(f"Modified file {entry_path} does not match original ({len(data)} != {file_info['size']} bytes)")
+            return False
+
+        self._pending[normalize_entry_path(entry_path)] = (file_info, bytes(data))
+        return True
+
+    def read(self, entry_path: str) -> bytes | None:
+        """
+        Read an entry as it will be after committing.
+
+        Args:
+            entry_path: Path of the entry within the VPK.
+
+        Returns:
+            The queued data if the entry has a pending patch, otherwise its current contents in the VPK.
+        """
+
+        pending = self._pending.get(normalize_entry_path(entry_path))
+        if pending is not None:
+            return pending[1]
+        return self.vpk.get_file_data(entry_path)
+
+    def discard(self) -> None:
+        """Drop all queued patches without writing them."""
+        self._pending.clear()
+
+    def commit(self) -> int:
+        """
+        Write all queued patches that differ from what is currently on disk.
+
+        The VPK directory keeps the vanilla CRCs when entries are patched, so the current contents are
+        read back from the archive and compared instead.
+
+        Returns:
+            The number of entries written.
+        """
+
+        if not self._pending:
+            return 0
+
+        writes: dict[str, list[tuple[int, bytes]]] = defaultdict(list)
+        for file_info, data in self._pending.values():
+            archive_path = self.vpk._get_archive_path(file_info['archive_index'])
+            writes[archive_path].append((file_info['offset'], data))
+
+        written = 0
+        for archive_path, archive_writes in writes.items():
+            archive_writes.sort(key=lambda write: write[0])
+            archive_written = 0
+            try:
+                with open(archive_path, 'rb+') as f:
+                    for offset, data in archive_writes:
+                        f.seek(offset)
+                        if f.read(len(data)) == data:
+                            continue
+                        f.seek(offset)
+                        f.write(data)
+                        archive_written += 1
+                    if archive_written:
+                        f.flush()
+                        os.fsync(f.fileno())
+            except Exception as e:
+                raise Exception(f'Error patching {archive_path}') from e
+
+            written += archive_written
+            log.debug(f'Patched {archive_written} of {len(archive_writes)} entries in {archive_path}')
+
+        self._pending.clear()
+        return written
+
+
+def _entry_path(extension: str, directory: str, filename: str) -> str:
+    # VPK directories store a single space for an empty extension or directory
+    name = filename if extension == ' ' else f'{filename}.{extension}'
+    return name if directory == ' ' else f'{directory}/{name}'
+
+
+def _crc_file(file: Path) -> int:
+    with open(file, 'rb') as f:
+        return zlib.crc32(f.read()) & 0xFFFFFFFF
+
+
+def _archive_files(base_path: Path) -> list[Path]:
+    """The directory file and numbered archives of a multi-file VPK."""
+    prefix = f'{base_path.name}_'
+    return [file for file in base_path.parent.glob(f'{prefix}*.vpk')
+            if (suffix := file.stem[len(prefix):]) == 'dir' or (len(suffix) == 3 and suffix.isdigit())]
+
+
+def _write_vpk_directory(dir_path: Path, entries: dict[str, dict]) -> None:
+    structure: dict[str, dict[str, dict[str, dict]]] = {}
+    for entry_path, entry in entries.items():
+        extension, directory, filename = _parse_vpk_path(entry_path)
+        structure.setdefault(extension, {}).setdefault(directory, {})[filename] = entry
+
+    # written next to the old directory and swapped in, so an interrupted update never leaves a torn directory
+    temp_path = dir_path.with_name(dir_path.name + '.tmp')
+    with open(temp_path, 'w+b') as f:
+        tree_size_pos, _ = VPKFile._write_vpk_header(f)
+        dir_start = f.tell()
+        VPKFile._write_directory_tree(f, None, structure)
+        dir_size = f.tell() - dir_start
+        VPKFile._write_checksums(f, dir_start, dir_size)
+        f.seek(tree_size_pos)
+        f.write(dir_size.to_bytes(4, 'little'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, dir_path)
+
+
+def _read_vpk_entries(base_path: Path) -> tuple[dict[str, dict], dict[int, int]] | None:
+    """
+    Entries and archive sizes of an existing multi-file VPK, if it can be updated in place.
+
+    Returns:
+        None if there is no VPK or it has entries stored in the directory file, as preload data or beyond
+        the end of their archive, none of which `VPKFile.create()` produces.
+    """
+
+    dir_path = Path(f'{base_path}_dir.vpk')
+    if not dir_path.exists():
+        return None
+
+    try:
+        vpk = VPKFile(dir_path)
+    except Exception:
+        log.warning(f'Could not read {dir_path}, rebuilding it', exc_info=True)
+        return None
+
+    entries: dict[str, dict] = {}
+    archive_sizes: dict[int, int] = {}
+    for extension, directories in vpk.directory.items():
+        for directory, filenames in directories.items():
+            for filename, entry in filenames.items():
+                if entry.preload_bytes or entry.archive_index == 0x7FFF:
+                    return None
+
+                if entry.archive_index not in archive_sizes:
+                    archive_path = Path(vpk._get_archive_path(entry.archive_index))
+                    if not archive_path.exists():
+                        return None
+                    archive_sizes[entry.archive_index] = archive_path.stat().st_size
+
+                if entry.entry_offset + entry.entry_length > archive_sizes[entry.archive_index]:
+                    return None
+
+                entries[_entry_path(extension, directory, filename)] = {
+                    'crc': entry.crc,
+                    'archive_idx': entry.archive_index,
+                    'offset': entry.entry_offset,
+                    'size': entry.entry_length,
+                }
+    return entries, archive_sizes
+
+
+def update_vpk(source_dir: Path, base_path: Path, split_size: int, max_dead_ratio: float = 0.25) -> bool:
+    """
+    Bring a multi-file VPK in line with a folder, rewriting as little of its archives as possible.
+
+    Entries are matched with the folder by path and CRC. Unchanged entries keep their place in the archives,
+    changed entries of the same size are overwritten in place and everything else is appended to the last
+    archive, after which the directory file is regenerated. Removed and resized entries leave dead space
+    behind, once it would pass `max_dead_ratio` of the archives the VPK is rebuilt from scratch instead.
+
+    Args:
+        source_dir: Folder with the files the VPK should contain.
+        base_path: Path of the VPK without the `_dir.vpk` suffix.
+        split_size: Maximum size of a single archive in bytes.
+        max_dead_ratio: Fraction of unused archive space at which the VPK gets compacted.
+
+    Returns:
+        True if the VPK was updated in place, False if it was (re)built from scratch.
+    """
+
+    files: dict[str, Path] = {}
+    for root, _, filenames in os.walk(source_dir):
+        for filename in filenames:
+            file = Path(root, filename)
+            files[normalize_entry_path(str(file.relative_to(source_dir)))] = file
+
+    if not files:
+        raise Exception(f'Error creating {base_path}_dir.vpk, {source_dir} is empty')
+
+    existing = _read_vpk_entries(base_path)
+    if existing is None:
+        _create_vpk(source_dir, base_path, split_size)
+        return False
+    old_entries, archive_sizes = existing
+
+    with span('vpk.compare', items=len(files)):
+        kept: dict[str, dict] = {}
+        in_place: dict[str, int] = {}
+        appended: dict[str, int] = {}
+        for entry_path, file in files.items():
+            old = old_entries.get(entry_path)
+            size = file.stat().st_size
+            if old is None or old['size'] != size:
+                appended[entry_path] = size
+                continue
+
+            crc = _crc_file(file)
+            if crc == old['crc']:
+                kept[entry_path] = old
+            else:
+                in_place[entry_path] = crc
+
+    live_size = sum(old_entries[entry_path]['size'] for entry_path in (*kept, *in_place))
+    archive_size = sum(archive_sizes.values())
+    append_size = sum(appended.values())
+    dead_size = archive_size - live_size
+    if dead_size > max_dead_ratio * (archive_size + append_size):
+        log.info(f'Compacting {base_path}_dir.vpk ({dead_size} of {archive_size + append_size} bytes unused)')
+        _create_vpk(source_dir, base_path, split_size)
+        return False
+
+    removed = len(old_entries.keys() - files.keys())
+    if not in_place and not appended and not removed:
+        log.info(f'{base_path}_dir.vpk is up to date ({len(kept)} entries)')
+        return True
+
+    entries = dict(kept)
+    writes: dict[int, list[tuple[int, str]]] = defaultdict(list)
+    for entry_path, crc in in_place.items():
+        entry = dict(old_entries[entry_path], crc=crc)
+        writes[entry['archive_idx']].append((entry['offset'], entry_path))
+        entries[entry_path] = entry
+
+    archive_index = max(archive_sizes, default=0)
+    archive_pos = archive_sizes.get(archive_index, 0)
+    for entry_path, size in sorted(appended.items()):
+        if archive_pos + size > split_size and archive_pos > 0:
+            archive_index += 1
+            archive_pos = 0
+        writes[archive_index].append((archive_pos, entry_path))
+        entries[entry_path] = {'archive_idx': archive_index, 'offset': archive_pos, 'size': size}
+        archive_pos += size
+
+    with span('vpk.write', items=len(in_place) + len(appended)):
+        for index, archive_writes in writes.items():
+            archive_path = Path(f'{base_path}_{index:03d}.vpk')
+            try:
+                with open(archive_path, 'r+b' if archive_path.exists() else 'w+b') as f:
+                    for offset, entry_path in sorted(archive_writes):
+                        data = files[entry_path].read_bytes()
+                        if len(data) != entries[entry_path]['size']:
+                            raise Exception(f'{files[entry_path]} changed while updating the VPK')
+                        f.seek(offset)
+                        f.write(data)
+                        entries[entry_path]['crc'] = zlib.crc32(data) & 0xFFFFFFFF
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception as e:
+                raise Exception(f'Error writing {archive_path}') from e
+
+        _write_vpk_directory(Path(f'{base_path}_dir.vpk'), entries)
+
+    log.info(f'Updated {base_path}_dir.vpk: {len(kept)} unchanged, {len(in_place)} rewritten in place, '
+             f'{len(appended)} appended, {removed} removed')
+    return True
+
+
+def _create_vpk(source_dir: Path, base_path: Path, split_size: int) -> None:
+    for file in _archive_files(base_path):
+        file.unlink()
+
+    with span('vpk.create'):
+        if not VPKFile.create(str(source_dir), str(base_path), split_size):
+            raise Exception(f'Error creating {base_path}_dir.vpk')
@@ -98,6 +98,11 @@ def main():
     logger.addHandler(logging.FileHandler(config.log_file, mode='a', encoding='utf-8'))
     logger.setLevel(config.verbose and logging.DEBUG or logging.INFO),
 
+    if config.trace:
+        from core.util.trace import enable_tracing
+
+        enable_tracing(config.log_file.with_name('trace.json'))
+
     raise SystemExit(subcommand(config))
 
 if __name__ == '__main__':
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from core.services import install
+from core.services.install import InstallService
+
+
+@pytest.fixture
+def addons_config(mock_config, monkeypatch):
+    monkeypatch.setattr(install, "config", mock_config)
+    return mock_config
+
+
+def write_addon(addons_dir, name: str, files: dict[str, bytes], mod_type: str = "custom"):
+    addon_dir = addons_dir / name
+    for rel_path, data in files.items():
+        (addon_dir / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (addon_dir / rel_path).write_bytes(data)
+    (addon_dir / "mod.json").write_text(json.dumps({"type": mod_type}))
+    return addon_dir
+
+
+class TestCollectAddonFiles:
+    def test_load_order_winner(self, addons_config):
+        first = write_addon(addons_config.addons_dir, "first", {
+            "materials/shared.vmt": b"first",
+            "particles/shared.pcf": b"first",
+            "models/first.mdl": b"first",
+        })
+        second = write_addon(addons_config.addons_dir, "second", {
+            "materials/shared.vmt": b"second",
+            "particles/shared.pcf": b"second",
+        })
+
+        files_to_copy, hud_addons = InstallService.collect_addon_files(["first", "second"])
+
+        assert files_to_copy == {
+            addons_config.temp_to_be_vpk_dir / "materials" / "shared.vmt": (second / "materials" / "shared.vmt", 1),
+            addons_config.temp_to_be_patched_dir / "particles" / "shared.pcf": (second / "particles" / "shared.pcf", 1),
+            addons_config.temp_to_be_vpk_dir / "models" / "first.mdl": (first / "models" / "first.mdl", 0),
+        }, "Only the addon latest in the load order may be staged for a shared path"
+        assert hud_addons == {}
+
+        files_to_copy, _ = InstallService.collect_addon_files(["second", "first"])
+        assert files_to_copy[addons_config.temp_to_be_vpk_dir / "materials" / "shared.vmt"] == \
+            (first / "materials" / "shared.vmt", 1)
+
+    def test_skipped_files(self, addons_config):
+        write_addon(addons_config.addons_dir, "sounds", {
+            "scripts/game_sounds_weapons.txt": b"sounds",
+            "scripts/items/items_game.txt": b"items",
+            "sound.cache": b"cache",
+        })
+
+        files_to_copy, _ = InstallService.collect_addon_files(["sounds", "missing"])
+
+        assert list(files_to_copy) == [addons_config.temp_to_be_vpk_dir / "scripts" / "items" / "items_game.txt"]
+
+    def test_hud_addons(self, addons_config):
+        hud = write_addon(addons_config.addons_dir, "MyHud", {"resource/ui/hudplayerhealth.res": b"hud"}, "hud")
+
+        files_to_copy, hud_addons = InstallService.collect_addon_files(["MyHud"])
+
+        assert files_to_copy == {}, "HUD files are installed as a folder, not staged"
+        assert hud_addons == {"myhud": hud}
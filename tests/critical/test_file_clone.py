@@ -0,0 +1,128 @@
+import struct
+from pathlib import Path
+
+import pytest
+from valve_parsers import MDLFile
+
+from core.operations.mdl_relocate import relocate_mdl_paths
+from core.util import file
+from core.util.file import clone, unshare
+
+VMT = b'"VertexLitGeneric"\n{\n\t"$basetexture" "models/test/skin"\n}\n'
+
+
+@pytest.fixture(autouse=True)
+def no_reflinks(monkeypatch):
+    # reflinks would make the hardlink fallback unreachable on copy-on-write filesystems
+    monkeypatch.setattr(file, "_reflink", lambda src, dst: False)
+    monkeypatch.setattr(file, "_no_reflink", set())
+    monkeypatch.setattr(file, "_no_hardlink", set())
+
+
+def write_mdl(path: Path, material: str, material_dir: str):
+    # just the header fields and tables `MDLFile` reads, see valve_parsers.mdl
+    header = bytearray(220)
+    material_entry = bytearray(64)
+    struct.pack_into("<i", material_entry, 0, 64)
+    material_offset = len(header)
+    material_dir_string = material_offset + 64 + len(material) + 1
+    material_dir_offset = material_dir_string + len(material_dir) + 1
+
+    header[0:4] = b"IDST"
+    struct.pack_into("<i", header, 4, 48)
+    struct.pack_into("<ii", header, 204, 1, material_offset)
+    struct.pack_into("<ii", header, 212, 1, material_dir_offset)
+    data = (header + material_entry + material.encode() + b"\x00" + material_dir.encode() + b"\x00" +
+            struct.pack("<i", material_dir_string))
+    struct.pack_into("<i", data, 76, len(data))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+class TestClone:
+    def test_hardlink(self, tmp_path):
+        src = tmp_path / "addon" / "skin.vtf"
+        src.parent.mkdir()
+        src.write_bytes(b"vtf")
+
+        dst = clone(src, tmp_path / "staging" / "skin.vtf", hardlink=True)
+        assert dst.samefile(src)
+
+        assert not clone(src, tmp_path / "copied" / "skin.vtf").samefile(src), "Only hardlink may link files"
+
+    def test_falls_back_to_copy(self, tmp_path, monkeypatch):
+        attempts = []
+
+        def hardlink_to(self, target):
+            attempts.append(self)
+            raise OSError(18, "Invalid cross-device link")
+
+        monkeypatch.setattr(Path, "hardlink_to", hardlink_to)
+        addon_dir = tmp_path / "addon"
+        (addon_dir / "sound").mkdir(parents=True)
+        (addon_dir / "sound" / "a.wav").write_bytes(b"a")
+        (addon_dir / "sound" / "b.wav").write_bytes(b"b")
+
+        staging_dir = clone(addon_dir, tmp_path / "staging", hardlink=True)
+
+        for name in ("a.wav", "b.wav"):
+            staged = staging_dir / "sound" / name
+            assert staged.read_bytes() == (addon_dir / "sound" / name).read_bytes()
+            assert not staged.samefile(addon_dir / "sound" / name)
+        assert len(attempts) == 1, "A failed hardlink must not be retried between the same devices"
+
+    def test_replaces_link_at_destination(self, tmp_path):
+        src = tmp_path / "new.vtf"
+        src.write_bytes(b"new")
+        linked = tmp_path / "addon.vtf"
+        linked.write_bytes(b"addon")
+        dst = clone(linked, tmp_path / "staging.vtf", hardlink=True)
+
+        clone(src, dst)
+
+        assert dst.read_bytes() == b"new"
+        assert linked.read_bytes() == b"addon", "Cloning over a link must not write through it"
+
+
+class TestUnshare:
+    def test_breaks_hardlink(self, tmp_path):
+        src = tmp_path / "addon.vmt"
+        src.write_bytes(VMT)
+        dst = clone(src, tmp_path / "staged.vmt", hardlink=True)
+
+        unshare(dst)
+        assert not dst.samefile(src)
+        assert dst.read_bytes() == VMT
+
+        dst.write_bytes(b"changed")
+        assert src.read_bytes() == VMT
+
+    def test_single_link_untouched(self, tmp_path):
+        src = tmp_path / "staged.vmt"
+        src.write_bytes(VMT)
+        inode = src.stat().st_ino
+
+        unshare(src)
+        assert src.stat().st_ino == inode
+
+    def test_before_mdl_relocation(self, tmp_path):
+        addon_dir = tmp_path / "addon"
+        write_mdl(addon_dir / "models" / "test" / "model.mdl", "skin", "models/test/")
+        (addon_dir / "materials" / "models" / "test").mkdir(parents=True)
+        (addon_dir / "materials" / "models" / "test" / "skin.vmt").write_bytes(VMT)
+        (addon_dir / "materials" / "models" / "test" / "skin.vtf").write_bytes(b"vtf")
+        addon_files = {path: path.read_bytes() for path in addon_dir.rglob("*") if path.is_file()}
+
+        # every staged file is a link to the addon's
+        working_root = clone(addon_dir, tmp_path / "staging", hardlink=True)
+        assert (working_root / "models" / "test" / "model.mdl").samefile(addon_dir / "models" / "test" / "model.mdl")
+
+        assert relocate_mdl_paths(working_root) == 1
+
+        mdl = MDLFile(working_root / "models" / "test" / "model.mdl")
+        assert mdl.material_dirs == ["console/models/test/", "models/test/"]
+        vmt = working_root / "materials" / "console" / "models" / "test" / "skin.vmt"
+        assert b"console/models/test/skin" in vmt.read_bytes()
+        assert {path: path.read_bytes() for path in addon_files} == addon_files, \
+            "Relocating must not change the addon's files through links"
@@ -0,0 +1,91 @@
+import json
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from valve_parsers import AttributeType, PCFFile
+
+import core.operations.advanced_particle_merger as advanced_particle_merger
+import core.util.pcf_cache as pcf_cache
+import core.util.pcf_fragments as pcf_fragments
+from core.operations.advanced_particle_merger import AdvancedParticleMerger
+from core.util.pcf import encode_pcf
+
+ROOT_DIR = Path(__file__).parents[2]
+PARTICLES_DIR = ROOT_DIR / "backup" / "particles"
+MOD_FILES = ["disguise.pcf", "medicgun_beam.pcf", "rockettrail.pcf"]
+PROCESS_VPK_GROUP = AdvancedParticleMerger.process_vpk_group
+
+
+@pytest.fixture
+def import_config(tmp_path, monkeypatch):
+    config = SimpleNamespace(
+        data_dir=ROOT_DIR / "data",
+        jobs=None,
+        particles_dir=tmp_path / "particles",
+        temp_to_be_processed_dir=tmp_path / "to_be_processed",
+        # only ever read during an import
+        temp_to_be_referenced_dir=PARTICLES_DIR,
+        fragment_library_file=tmp_path / "fragments.bin",
+        pcf_cache_dir=tmp_path / "pcf_cache",
+    )
+    for module in (advanced_particle_merger, pcf_cache, pcf_fragments):
+        monkeypatch.setattr(module, "config", config)
+    monkeypatch.setattr(pcf_cache, "_memory", OrderedDict())
+    pcf_fragments.fragment_library.cache_clear()
+    yield config
+    pcf_fragments.fragment_library.cache_clear()
+
+
+def write_mod(mod_dir: Path):
+    (mod_dir / "particles").mkdir(parents=True)
+    for i, file_name in enumerate(MOD_FILES):
+        pcf = PCFFile(PARTICLES_DIR / file_name).decode()
+        systems = [element for element in pcf.elements
+                   if pcf.string_dictionary[element.type_name_index] == b"DmeParticleSystemDefinition"]
+        # every other system is changed, the rest gets filled in from vanilla
+        for element in systems[::2]:
+            element.attributes[b"material"] = (AttributeType.STRING, f"effects/mod_{i}.vmt".encode())
+        (mod_dir / "particles" / f"mod_{file_name}").write_bytes(encode_pcf(pcf))
+    # overlaps with mod_disguise.pcf
+    shutil.copyfile(mod_dir / "particles" / "mod_disguise.pcf", mod_dir / "particles" / "zz_disguise.pcf")
+
+
+def import_mod(config, monkeypatch, name: str, memory_budget: int) -> tuple[dict[str, bytes], set[type]]:
+    mod_dir = config.particles_dir / name
+    write_mod(mod_dir)
+
+    kinds = set()
+
+    def recording_process_vpk_group(self, vpk_name, out_dir):
+        kinds.update(type(particle) for group in self.vpk_groups[vpk_name].values() for particle, _, _ in group)
+        PROCESS_VPK_GROUP(self, vpk_name, out_dir)
+
+    monkeypatch.setattr(AdvancedParticleMerger, "process_vpk_group", recording_process_vpk_group)
+    merger = AdvancedParticleMerger(memory_budget=memory_budget, workers=1)
+    merger.preprocess_vpk(mod_dir)
+    assert merger.memory_used == 0, "Every processed group must release its share of the budget"
+
+    outputs = {}
+    for path in sorted((mod_dir / "actual_particles").iterdir()):
+        data = path.read_bytes()
+        if path.name.endswith(".toc.json"):
+            # the sidecar records the PCF's mtime, the only thing that differs between two imports
+            toc = json.loads(data)
+            del toc["mtime_ns"]
+            data = json.dumps(toc).encode()
+        outputs[path.name] = data
+    return outputs, kinds
+
+
+def test_spilled_and_in_memory_imports_match(import_config, monkeypatch):
+    spilled, spilled_kinds = import_mod(import_config, monkeypatch, "spilled", memory_budget=0)
+    in_memory, in_memory_kinds = import_mod(import_config, monkeypatch, "in_memory", memory_budget=2**40)
+
+    assert spilled_kinds == {type(PARTICLES_DIR)}, "A budget of 0 must spill every extracted PCF"
+    assert in_memory_kinds == {PCFFile}, "A large budget must keep every extracted PCF in memory"
+    assert any(name.endswith(".toc.json") for name in spilled), "Every PCF must get a TOC sidecar"
+    assert spilled == in_memory
+    assert not any(import_config.temp_to_be_processed_dir.iterdir()), "Spilled PCFs must be cleaned up"
@@ -0,0 +1,83 @@
+import shutil
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from valve_parsers import AttributeType, PCFFile
+
+import core.util.pcf_cache as pcf_cache
+from core.util.pcf_cache import copy_pcf, load_vanilla_pcf, pcf_digest
+
+PARTICLES_DIR = Path(__file__).parents[2] / "backup" / "particles"
+PCF_FILE = PARTICLES_DIR / "disguise.pcf"
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "pcf_cache"
+    monkeypatch.setattr(pcf_cache, "config", SimpleNamespace(pcf_cache_dir=cache_dir))
+    monkeypatch.setattr(pcf_cache, "_memory", OrderedDict())
+    return cache_dir
+
+
+class TestLoadVanillaPCF:
+    def test_disk_round_trip(self, cache_dir, monkeypatch):
+        expected = PCFFile(PCF_FILE).decode()
+        load_vanilla_pcf(PCF_FILE)
+        assert (cache_dir / f"{pcf_digest(PCF_FILE.read_bytes())}.pickle").exists()
+
+        # a new process only has the disk cache
+        monkeypatch.setattr(pcf_cache, "_memory", OrderedDict())
+
+        def decode_pcf(*args):
+            raise AssertionError("Cached PCFs must not be decoded again")
+
+        monkeypatch.setattr(pcf_cache, "decode_pcf", decode_pcf)
+        pcf = load_vanilla_pcf(PCF_FILE)
+
+        assert pcf.version == expected.version
+        assert pcf.string_dictionary == expected.string_dictionary
+        assert pcf.elements == expected.elements
+
+    def test_input_file_of_each_path(self, cache_dir, tmp_path):
+        other_path = tmp_path / "other" / PCF_FILE.name
+        other_path.parent.mkdir()
+        shutil.copyfile(PCF_FILE, other_path)
+
+        assert load_vanilla_pcf(PCF_FILE).input_file == PCF_FILE
+        assert load_vanilla_pcf(other_path).input_file == other_path
+
+    def test_copy_isolation(self, cache_dir):
+        expected = PCFFile(PCF_FILE).decode()
+        pcf = copy_pcf(load_vanilla_pcf(PCF_FILE))
+
+        pcf.string_dictionary.append(b"added")
+        pcf.elements[1].attributes[b"material"] = (AttributeType.STRING, b"effects/changed.vmt")
+        pcf.elements[1].element_name = b"changed"
+        del pcf.elements[-1]
+
+        shared = load_vanilla_pcf(PCF_FILE)
+        assert shared.string_dictionary == expected.string_dictionary
+        assert shared.elements == expected.elements, "Changing a copy must not change the cached PCF"
+
+    def test_shared_between_threads(self, cache_dir):
+        expected = PCFFile(PARTICLES_DIR / "halloween2022_unusuals.pcf").decode()
+
+        # every thread decodes the same lazily decoded elements of the shared PCF
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(
+                lambda _: [element.attributes for element in load_vanilla_pcf(expected.input_file).elements],
+                range(8)
+            ))
+
+        assert all(attributes == [element.attributes for element in expected.elements] for attributes in results)
+
+
+def test_digest_depends_on_cache_format(monkeypatch):
+    data = PCF_FILE.read_bytes()
+    digest = pcf_digest(data)
+
+    monkeypatch.setattr(pcf_cache, "PCF_CACHE_FORMAT", pcf_cache.PCF_CACHE_FORMAT + 1)
+    assert pcf_digest(data) != digest, "Bumping the cache format must invalidate cached PCFs"
@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import pytest
+from valve_parsers import AttributeType, PCFFile
+
+from core.operations.pcf_compress import (
+    combined_cleanup_pass,
+    remove_duplicate_elements,
+)
+from core.util.pcf import NULL_ELEMENT, encode_pcf
+
+PARTICLES_DIR = Path(__file__).parents[2] / "backup" / "particles"
+
+# encoded size after the previous compressor, which only merged array members by `hash()` of their attributes.
+# none of these had a hash collision, so everything it merged was a real duplicate
+PREVIOUS_SIZES = {
+    "disguise.pcf": 7582,
+    "flamethrower.pcf": 98570,
+    "halloween2022_unusuals.pcf": 145809,
+    "impact_fx.pcf": 28240,
+    "teleported_fx.pcf": 32570,
+}
+
+
+def expand(pcf: PCFFile, idx: int, nested: bool = False):
+    # an element with everything it references inlined, systems below the top one are left as their name
+    element = pcf.elements[idx]
+    type_name = pcf.string_dictionary[element.type_name_index]
+    if nested and type_name == b"DmeParticleSystemDefinition":
+        return type_name, element.element_name
+
+    def reference(target: int):
+        if target == NULL_ELEMENT or target >= len(pcf.elements):
+            return target
+        return expand(pcf, target, nested=True)
+
+    attributes = {}
+    for attr_name, (attr_type, value) in element.attributes.items():
+        if attr_type == AttributeType.ELEMENT:
+            value = reference(value)
+        elif attr_type == AttributeType.ELEMENT_ARRAY:
+            value = [reference(target) for target in value]
+        attributes[attr_name] = (attr_type, value)
+
+    # merged child references keep the name of the first one, the engine follows `child`
+    element_name = None if type_name == b"DmeParticleChild" else element.element_name
+    return type_name, element_name, attributes
+
+
+def expand_systems(pcf: PCFFile) -> dict:
+    return {
+        element.element_name: expand(pcf, idx)
+        for idx, element in enumerate(pcf.elements)
+        if pcf.string_dictionary[element.type_name_index] == b"DmeParticleSystemDefinition"
+    }
+
+
+@pytest.mark.parametrize("file_name", sorted(PREVIOUS_SIZES))
+class TestPCFCompress:
+    def test_not_larger_than_previous_compressor(self, file_name):
+        compressed = remove_duplicate_elements(PCFFile(PARTICLES_DIR / file_name).decode())
+        assert len(encode_pcf(compressed)) <= PREVIOUS_SIZES[file_name]
+
+    def test_systems_unchanged(self, file_name):
+        original = PCFFile(PARTICLES_DIR / file_name).decode()
+        combined_cleanup_pass(original)
+        compressed = remove_duplicate_elements(PCFFile(PARTICLES_DIR / file_name).decode())
+
+        assert expand_systems(compressed) == expand_systems(original), "Merging must not change any system"
+
+
+def test_signed_zero_is_merged():
+    pcf = PCFFile(PARTICLES_DIR / "halloween2022_unusuals.pcf").decode()
+    operators = [idx for idx, element in enumerate(pcf.elements)
+                 if pcf.string_dictionary[element.type_name_index] == b"DmeParticleOperator"]
+    compressed_size = len(encode_pcf(remove_duplicate_elements(PCFFile(pcf.input_file).decode())))
+
+    # flipping the sign of zero components in every other operator must not keep any of them from being merged
+    flipped = 0
+    for idx in operators[::2]:
+        attributes = pcf.elements[idx].attributes
+        for attr_name, (attr_type, value) in attributes.items():
+            if attr_type == AttributeType.VECTOR3 and 0.0 in value:
+                attributes[attr_name] = (attr_type, tuple(-0.0 if component == 0.0 else component
+                                                          for component in value))
+                flipped += 1
+    assert flipped
+
+    assert len(encode_pcf(remove_duplicate_elements(pcf))) == compressed_size
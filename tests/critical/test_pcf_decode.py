@@ -0,0 +1,67 @@
+import pickle
+import random
+from pathlib import Path
+
+import pytest
+from valve_parsers import PCFElement, PCFFile
+
+from core.util.pcf import LazyPCFElement, decode_pcf
+
+PARTICLES_DIR = Path(__file__).parents[2] / "backup" / "particles"
+# every seventh vanilla PCF, large and small ones alike
+SAMPLE_FILES = sorted(PARTICLES_DIR.glob("*.pcf"))[::7]
+
+
+def value_types(element: PCFElement) -> list[type]:
+    return [type(value) for _, value in element.attributes.values()]
+
+
+@pytest.mark.parametrize("pcf_path", SAMPLE_FILES, ids=lambda path: path.name)
+class TestDecodePCF:
+    def test_matches_library_decoder(self, pcf_path):
+        expected = PCFFile(pcf_path).decode()
+        decoded = decode_pcf(pcf_path)
+
+        assert decoded.version == expected.version
+        assert decoded.input_file == expected.input_file
+        assert decoded.string_dictionary == expected.string_dictionary
+        assert len(decoded.elements) == len(expected.elements)
+
+        # out of order, so elements get decoded past ones that were not decoded yet
+        order = list(range(len(decoded.elements)))
+        random.Random(pcf_path.name).shuffle(order)
+        for idx in order:
+            assert decoded.elements[idx] == expected.elements[idx]
+            assert expected.elements[idx] == decoded.elements[idx]
+            assert value_types(decoded.elements[idx]) == value_types(expected.elements[idx]), "Lists must stay lists"
+
+    def test_pickle_partly_decoded(self, pcf_path):
+        expected = PCFFile(pcf_path).decode()
+        decoded = decode_pcf(pcf_path)
+        for element in decoded.elements[::3]:
+            assert element.attributes is not None
+
+        restored = pickle.loads(pickle.dumps(decoded))
+
+        assert all(type(element) is PCFElement for element in restored.elements), "Pickles hold plain elements"
+        assert restored.elements == expected.elements
+        assert restored.string_dictionary == expected.string_dictionary
+
+
+def test_attributes_are_plain_after_first_access():
+    decoded = decode_pcf(SAMPLE_FILES[0])
+    element = decoded.elements[-1]
+    assert isinstance(element, LazyPCFElement)
+
+    attributes = element.attributes
+    assert element.attributes is attributes, "Decoded attributes must be kept, not decoded again"
+    element.attributes = {}
+    assert element.attributes == {}
+
+
+def test_unsupported_version(tmp_path):
+    pcf_path = tmp_path / "broken.pcf"
+    pcf_path.write_bytes(b"<!-- dmx encoding binary 9 format pcf 1 -->\n\x00" + bytes(6))
+
+    with pytest.raises(ValueError):
+        decode_pcf(pcf_path)
@@ -0,0 +1,97 @@
+import marshal
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from valve_parsers import PCFFile
+
+import core.util.pcf_cache as pcf_cache
+from core.operations.pcf_compress import remove_duplicate_elements
+from core.operations.pcf_rebuild import extract_element_groups
+from core.util.pcf import PCFIndex, element_references, encode_pcf
+from core.util.pcf_fragments import FragmentLibrary, build_fragments
+
+PARTICLES_DIR = Path(__file__).parents[2] / "backup" / "particles"
+# every seventh vanilla PCF, and the ones with child references named after other systems
+SAMPLE_FILES = sorted(set(sorted(PARTICLES_DIR.glob("*.pcf"))[::7]) | {
+    PARTICLES_DIR / "halloween2023_unusuals.pcf",
+    PARTICLES_DIR / "summer2025_unusuals.pcf",
+})
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    monkeypatch.setattr(pcf_cache, "config", SimpleNamespace(pcf_cache_dir=tmp_path / "pcf_cache"))
+    monkeypatch.setattr(pcf_cache, "_memory", OrderedDict())
+    return FragmentLibrary(tmp_path / "fragments.bin")
+
+
+def system_names(pcf: PCFFile) -> list[str]:
+    # a third of the systems, leaving out those `extract_elements()` finds a child reference of the same name for
+    index = PCFIndex(pcf)
+    systems = index.of_type("DmeParticleSystemDefinition")
+    names = sorted({pcf.elements[idx].element_name.decode("ascii") for idx in systems})
+    return [name for name in names[::3] if index.index_of(name) in systems]
+
+
+def assembled_systems(pcf: PCFFile) -> list[bytes]:
+    return [pcf.elements[idx].element_name for idx in PCFIndex(pcf).of_type("DmeParticleSystemDefinition")]
+
+
+def assert_matches_extract(library: FragmentLibrary, pcf_path: Path, names: list[str]):
+    expected = extract_element_groups(PCFFile(pcf_path).decode(), {None: names})[None]
+    assembled = library.assemble(pcf_path, names)
+
+    assert assembled_systems(assembled) == assembled_systems(expected)
+    for element in assembled.elements:
+        assert all(target < len(assembled.elements) for target in element_references(element)), \
+            "References must point into the assembled PCF"
+    assert encode_pcf(assembled) == encode_pcf(expected)
+
+
+class TestFragmentLibrary:
+    @pytest.mark.parametrize("pcf_path", SAMPLE_FILES, ids=lambda path: path.name)
+    def test_matches_extract_element_groups(self, library, pcf_path):
+        assert_matches_extract(library, pcf_path, system_names(PCFFile(pcf_path).decode()))
+
+    def test_shared_elements_stored_once(self, library, tmp_path):
+        # merging duplicates shares operators between systems, each is stored in a single fragment
+        pcf_path = tmp_path / "halloween2022_unusuals.pcf"
+        compressed = remove_duplicate_elements(PCFFile(PARTICLES_DIR / pcf_path.name).decode())
+        pcf_path.write_bytes(encode_pcf(compressed))
+
+        entry, blobs = build_fragments(PCFFile(pcf_path).decode())
+        assert len(entry["fragments"]) > len(entry["systems"]), "Some fragments must be shared"
+        stored = [idx for number in entry["fragments"] for idx, _ in marshal.loads(blobs[number])]
+        assert len(stored) == len(set(stored)), "No element may be stored twice"
+
+        assert_matches_extract(library, pcf_path, system_names(PCFFile(pcf_path).decode()))
+
+    def test_rebuild_when_digest_changes(self, library, tmp_path):
+        vanilla_dir = tmp_path / "vanilla"
+        vanilla_dir.mkdir()
+        changed = vanilla_dir / "disguise.pcf"
+        kept = vanilla_dir / "stormfront.pcf"
+        shutil.copyfile(PARTICLES_DIR / changed.name, changed)
+        shutil.copyfile(PARTICLES_DIR / kept.name, kept)
+
+        assert library.update([changed, kept]) == 2
+        assert library.update([changed, kept]) == 0
+
+        # e.g. a game update, only the changed file is rebuilt and the other entry is carried over
+        shutil.copyfile(PARTICLES_DIR / "rocketbackblast.pcf", changed)
+        assert library.update([changed, kept]) == 1
+
+        assert_matches_extract(library, changed, system_names(PCFFile(changed).decode()))
+        assert_matches_extract(library, kept, system_names(PCFFile(kept).decode()))
+        assert_matches_extract(FragmentLibrary(library.library_file), kept, system_names(PCFFile(kept).decode()))
+
+    def test_names_resolve_to_systems(self, library):
+        # a child reference of this name comes first and points at unusual_sixthsense_pink_wiggly1
+        pcf_path = PARTICLES_DIR / "halloween2023_unusuals.pcf"
+        assembled = library.assemble(pcf_path, ["unusual_sixthsense_red_wiggly1", "not_a_system"])
+
+        assert b"unusual_sixthsense_red_wiggly1" in assembled_systems(assembled)
+        assert b"unusual_sixthsense_pink_wiggly1" not in assembled_systems(assembled)
@@ -0,0 +1,142 @@
+from pathlib import Path
+
+from valve_parsers import AttributeType, PCFFile
+
+from core.handlers.pcf_handler import patch_materials, update_materials
+from core.operations.pcf_compress import remove_duplicate_elements
+from core.util.pcf import PCFIndex, PCFLayout, encode_pcf
+from core.util.pcf_cache import copy_pcf
+
+PARTICLES_DIR = Path(__file__).parents[2] / "backup" / "particles"
+# every system has a material of its own, some have child references
+BASE_FILE = PARTICLES_DIR / "disguise.pcf"
+
+
+def load_base() -> PCFFile:
+    return PCFFile(BASE_FILE).decode()
+
+
+def of_type(pcf: PCFFile, type_name: bytes) -> list:
+    return [element for element in pcf.elements if pcf.string_dictionary[element.type_name_index] == type_name]
+
+
+def patched(base: PCFFile, mod: PCFFile) -> bytes | None:
+    base_layout = PCFLayout(encode_pcf(remove_duplicate_elements(copy_pcf(base))))
+    return patch_materials(PCFIndex(base), base_layout, PCFLayout(encode_pcf(mod)))
+
+
+def expected(base: PCFFile, mod: PCFFile) -> bytes:
+    return encode_pcf(remove_duplicate_elements(update_materials(base, mod)))
+
+
+def set_material(element, material: bytes, attr_type: AttributeType = AttributeType.STRING):
+    element.attributes[b"material"] = (attr_type, material)
+
+
+def rename_children(pcf: PCFFile) -> list:
+    # children share the name of their system, whose material wins since it comes later
+    children = of_type(pcf, b"DmeParticleChild")
+    for element in children:
+        element.element_name += b"_child"
+    return children
+
+
+class TestPatchMaterials:
+    def test_unchanged_materials(self):
+        base = load_base()
+        mod = load_base()
+
+        assert patched(base, mod) == expected(base, mod)
+
+    def test_system_materials(self):
+        base = load_base()
+        mod = load_base()
+        systems = of_type(mod, b"DmeParticleSystemDefinition")
+        for i, element in enumerate(systems):
+            set_material(element, f"effects/patched_{i}.vmt".encode())
+
+        result = patched(base, mod)
+        assert result is not None, "System materials must be patched"
+        assert result == expected(base, mod)
+
+    def test_child_materials(self):
+        base = load_base()
+        rename_children(base)
+        mod = load_base()
+        children = rename_children(mod)
+        for i, element in enumerate(children):
+            set_material(element, f"effects/child_{i}.vmt".encode())
+
+        result = patched(base, mod)
+        assert result is not None, "Child materials must be patched"
+        assert result == expected(base, mod)
+
+    def test_unknown_elements_are_ignored(self):
+        base = load_base()
+        mod = load_base()
+        mod.elements[0].element_name = b"not_in_base"
+        set_material(mod.elements[0], b"effects/unknown.vmt")
+
+        assert patched(base, mod) == expected(base, mod)
+
+
+class TestPatchMaterialsFallback:
+    def test_non_string_material(self):
+        base = load_base()
+        mod = load_base()
+        # no null bytes, so nothing but its type keeps it from being written as a string
+        set_material(of_type(mod, b"DmeParticleSystemDefinition")[0], 0x01010101, AttributeType.INTEGER)
+
+        assert patched(base, mod) is None
+
+    def test_default_material(self):
+        base = load_base()
+        mod = load_base()
+        set_material(of_type(mod, b"DmeParticleSystemDefinition")[0], b"vgui/white")
+
+        assert patched(base, mod) is None
+
+    def test_system_without_material(self):
+        base = load_base()
+        del of_type(base, b"DmeParticleSystemDefinition")[0].attributes[b"material"]
+        mod = load_base()
+        set_material(of_type(mod, b"DmeParticleSystemDefinition")[0], b"effects/patched.vmt")
+
+        assert patched(base, mod) is None
+
+    def test_not_a_system_or_child(self):
+        base = load_base()
+        mod = load_base()
+        set_material(of_type(mod, b"DmeParticleOperator")[0], b"effects/patched.vmt")
+
+        assert patched(base, mod) is None
+
+    def test_child_with_material(self):
+        base = load_base()
+        set_material(rename_children(base)[0], b"effects/child.vmt")
+        mod = load_base()
+        set_material(rename_children(mod)[0], b"effects/patched.vmt")
+
+        assert patched(base, mod) is None
+
+    def test_shared_child_system(self):
+        base = load_base()
+        first, second = rename_children(base)[:2]
+        second.attributes[b"child"] = first.attributes[b"child"]
+        mod = load_base()
+        set_material(rename_children(mod)[0], b"effects/patched.vmt")
+
+        assert patched(base, mod) is None
+
+    def test_material_not_in_dictionary(self):
+        base = load_base()
+        mod = load_base()
+        # no element has a material left, so the attribute name can't be encoded
+        for pcf in (base, mod):
+            rename_children(pcf)
+            for element in pcf.elements:
+                element.attributes.pop(b"material", None)
+        base.string_dictionary[base.string_dictionary.index(b"material")] = b"unused"
+        set_material(of_type(mod, b"DmeParticleChild")[0], b"effects/patched.vmt")
+
+        assert patched(base, mod) is None
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+from core.util.stages import StageGraph
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def stage(self, name: str):
+        def run():
+            with self._lock:
+                self.events.append(("start", name))
+                self.events.append(("end", name))
+        return run
+
+    def position(self, event: str, name: str) -> int:
+        return self.events.index((event, name))
+
+
+def install_graph(recorder: Recorder) -> StageGraph:
+    graph = StageGraph("test")
+    graph.add("decode", recorder.stage("decode"), writes=["pcf"])
+    graph.add("sound", recorder.stage("sound"), writes=["sound"])
+    graph.add("patch", recorder.stage("patch"), reads=["pcf"], writes=["vpk"])
+    graph.add("scan", recorder.stage("scan"), reads=["pcf"])
+    graph.add("rewrite", recorder.stage("rewrite"), writes=["pcf"])
+    graph.add("pack", recorder.stage("pack"), reads=["vpk", "sound"])
+    return graph
+
+
+class TestStageGraph:
+    def test_dependencies(self):
+        graph = install_graph(Recorder())
+        after = {stage.name: stage.after for stage in graph._stages.values()}
+
+        assert after["sound"] == [], "Stages touching nothing in common must not depend on each other"
+        assert after["patch"] == ["decode"], "Reading a resource must wait for its writer"
+        assert after["scan"] == ["decode"], "Two readers of a resource must not depend on each other"
+        assert after["rewrite"] == ["decode", "patch", "scan"], "Writing a resource must wait for its readers"
+        assert after["pack"] == ["sound", "patch"]
+
+    def test_dependencies_run_first(self):
+        recorder = Recorder()
+        graph = install_graph(recorder)
+        graph.run()
+
+        assert len(recorder.events) == 2 * len(graph._stages), "Every stage must run once"
+        for stage in graph._stages.values():
+            for dependency in stage.after:
+                assert recorder.position("end", dependency) < recorder.position("start", stage.name), \
+                    f"{stage.name} must start after {dependency} finished"
+
+    def test_independent_stages_overlap(self):
+        # neither stage gets past the barrier unless both run at once
+        barrier = threading.Barrier(2, timeout=5)
+        graph = StageGraph("test")
+        graph.add("sound", barrier.wait, writes=["sound"])
+        graph.add("models", barrier.wait, writes=["models"])
+
+        graph.run()
+
+    def test_duplicate_stage(self):
+        graph = StageGraph("test")
+        graph.add("decode", lambda: None)
+
+        with pytest.raises(ValueError):
+            graph.add("decode", lambda: None)
+
+    def test_reraises_first_error(self):
+        recorder = Recorder()
+        failed = threading.Event()
+
+        def fail():
+            failed.set()
+            raise ValueError("first")
+
+        def fail_later():
+            failed.wait(5)
+            # give the first error time to be collected
+            time.sleep(0.1)
+            recorder.stage("running")()
+            raise RuntimeError("second")
+
+        graph = StageGraph("test")
+        graph.add("decode", fail, writes=["pcf"])
+        graph.add("running", fail_later, writes=["sound"])
+        graph.add("patch", recorder.stage("patch"), reads=["pcf"])
+
+        with pytest.raises(ValueError, match="first"):
+            graph.run()
+        assert ("end", "running") in recorder.events, "Running stages must be waited for"
+        assert ("start", "patch") not in recorder.events, "No stage may start after an error"
+
+    def test_critical_path(self):
+        graph = install_graph(Recorder())
+        assert [stage.name for stage in graph.run()] == [stage.name for stage in graph.critical_path()]
+
+        durations = {"decode": 1.0, "sound": 3.0, "patch": 1.0, "scan": 0.5, "rewrite": 0.5, "pack": 1.0}
+        for stage in graph._stages.values():
+            stage.duration = durations[stage.name]
+        assert [stage.name for stage in graph.critical_path()] == ["sound", "pack"]
+
+        graph._stages["patch"].duration = 2.5
+        assert [stage.name for stage in graph.critical_path()] == ["decode", "patch", "pack"]
+
+    def test_empty(self):
+        graph = StageGraph("test")
+
+        assert graph.run() == []
+        assert graph.critical_path() == []
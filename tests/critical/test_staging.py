@@ -0,0 +1,127 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from core import staging
+from core.staging import StagingGroup, file_states
+
+
+class Builder:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, files_dir: Path, file_origin: dict[Path, int]):
+        # transforms in place, like the sound and model transforms do
+        self.calls += 1
+        for file, addon_index in file_origin.items():
+            file.write_bytes(file.read_bytes() + f" built by addon {addon_index}".encode())
+
+
+@pytest.fixture
+def sources(tmp_path):
+    addon_dir = tmp_path / "addon"
+    (addon_dir / "sound" / "weapons").mkdir(parents=True)
+    (addon_dir / "sound" / "weapons" / "shot.txt").write_bytes(b"shot")
+    (addon_dir / "sound" / "ui.txt").write_bytes(b"ui")
+    return addon_dir
+
+
+def sync(tmp_path: Path, sources: Path, builder: Builder, transform: str = "sound_mapping",
+         params: dict | None = None) -> bool:
+    # every install makes a new group, only the manifest is kept between them
+    group = StagingGroup(tmp_path / "staging", "sound", transform)
+    for source in sorted(sources.rglob("*.txt")):
+        group.add(source.relative_to(sources).as_posix(), source, 0)
+    return group.sync(tmp_path / "to_be_vpk", builder, params or {})
+
+
+class TestStagingGroup:
+    def test_reuses_output(self, tmp_path, sources, monkeypatch):
+        builder = Builder()
+        assert sync(tmp_path, sources, builder)
+        assert (tmp_path / "to_be_vpk" / "sound" / "ui.txt").read_bytes() == b"ui built by addon 0"
+
+        hashed = []
+        monkeypatch.setattr(staging, "_hash_file", lambda file: hashed.append(file))
+        (tmp_path / "to_be_vpk" / "sound" / "ui.txt").unlink()
+
+        assert not sync(tmp_path, sources, builder), "Unchanged inputs must reuse the staged output"
+        assert builder.calls == 1
+        assert not hashed, "Inputs whose size and mtime are unchanged must not be hashed again"
+        assert (tmp_path / "to_be_vpk" / "sound" / "ui.txt").read_bytes() == b"ui built by addon 0", \
+            "Reused output must be linked into the staging folder"
+
+    def test_reuses_output_of_touched_inputs(self, tmp_path, sources):
+        builder = Builder()
+        sync(tmp_path, sources, builder)
+
+        source = sources / "sound" / "ui.txt"
+        os.utime(source, ns=(source.stat().st_atime_ns, source.stat().st_mtime_ns + 10**9))
+        assert not sync(tmp_path, sources, builder), "Touching an input without changing it must not rebuild"
+        assert builder.calls == 1
+
+        manifest = json.loads((tmp_path / "staging" / "sound" / "manifest.json").read_text())
+        assert manifest["files"]["sound/ui.txt"]["mtime_ns"] == source.stat().st_mtime_ns, \
+            "The manifest must keep the new mtime so the input isn't hashed again"
+
+    def test_rebuilds_when_input_changes(self, tmp_path, sources):
+        builder = Builder()
+        sync(tmp_path, sources, builder)
+
+        (sources / "sound" / "ui.txt").write_bytes(b"changed")
+        assert sync(tmp_path, sources, builder)
+        assert builder.calls == 2
+        assert (tmp_path / "to_be_vpk" / "sound" / "ui.txt").read_bytes() == b"changed built by addon 0"
+
+        (sources / "sound" / "weapons" / "shot.txt").unlink()
+        assert sync(tmp_path, sources, builder), "Removing an input must rebuild"
+        assert not (tmp_path / "staging" / "sound" / "files" / "sound" / "weapons" / "shot.txt").exists()
+
+    def test_rebuilds_when_transform_changes(self, tmp_path, sources):
+        builder = Builder()
+        sync(tmp_path, sources, builder, transform="sound_mapping")
+
+        assert sync(tmp_path, sources, builder, transform="sound_mapping_v2")
+        assert not sync(tmp_path, sources, builder, transform="sound_mapping_v2")
+        assert builder.calls == 2
+
+    def test_rebuilds_when_params_change(self, tmp_path, sources):
+        builder = Builder()
+        sync(tmp_path, sources, builder, params={"mode": "a"})
+
+        assert sync(tmp_path, sources, builder, params={"mode": "b"})
+        assert not sync(tmp_path, sources, builder, params={"mode": "b"})
+        assert builder.calls == 2
+
+    def test_rebuilds_when_file_states_change(self, tmp_path, sources):
+        # e.g. a game VPK the transform reads from, which isn't one of the group's inputs
+        game_vpk = tmp_path / "tf2_misc_dir.vpk"
+        game_vpk.write_bytes(b"vpk")
+        builder = Builder()
+        sync(tmp_path, sources, builder, params={"game_vpks": file_states([game_vpk])})
+
+        assert not sync(tmp_path, sources, builder, params={"game_vpks": file_states([game_vpk])})
+
+        game_vpk.write_bytes(b"updated vpk")
+        assert sync(tmp_path, sources, builder, params={"game_vpks": file_states([game_vpk])})
+        assert builder.calls == 2
+
+    def test_rebuilds_when_output_is_missing(self, tmp_path, sources):
+        builder = Builder()
+        sync(tmp_path, sources, builder)
+
+        # an interrupted rebuild leaves no manifest
+        (tmp_path / "staging" / "sound" / "manifest.json").unlink()
+        assert sync(tmp_path, sources, builder)
+        assert builder.calls == 2
+
+
+def test_file_states_skips_missing_files(tmp_path):
+    existing = tmp_path / "existing.vpk"
+    existing.write_bytes(b"vpk")
+
+    assert file_states([existing, tmp_path / "missing.vpk"]) == {
+        str(existing): [existing.stat().st_size, existing.stat().st_mtime_ns]
+    }
@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+
+import pytest
+
+from core.util import trace
+from core.util.trace import span, traced, write_trace
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    trace_file = tmp_path / "logs" / "trace.json"
+    monkeypatch.setattr(trace, "_events", [])
+    monkeypatch.setattr(trace, "_active", 0)
+    monkeypatch.setattr(trace, "_trace_file", None)
+    trace.enable_tracing(trace_file)
+    return trace_file
+
+
+def read_events(trace_file) -> dict[str, dict]:
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    return {event["name"]: event for event in events}
+
+
+class TestTrace:
+    def test_write_trace(self, trace_file):
+        with span("install"):
+            with span("install.models.mdl_relocation", items=2) as relocation_span:
+                relocation_span.add(3)
+            assert not trace_file.exists(), "Only top-level spans write the trace"
+
+        events = read_events(trace_file)
+        assert list(events) == ["install.models.mdl_relocation", "install"]
+
+        outer, inner = events["install"], events["install.models.mdl_relocation"]
+        for event in (outer, inner):
+            assert event["ph"] == "X"
+            assert event["cat"] == "install"
+            assert set(event["args"]) == {"thread_cpu_ms", "items"}
+        assert inner["args"]["items"] == 5
+        assert outer["ts"] <= inner["ts"]
+        assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+        assert not list(trace_file.parent.glob("*.tmp")), "The temporary file must be swapped in"
+
+    def test_thread_cpu_time(self, trace_file):
+        def busy():
+            end = time.thread_time() + 0.2
+            while time.thread_time() < end:
+                pass
+
+        # the span's own thread only waits, the CPU time is spent on another one
+        with span("install.particles"):
+            worker = threading.Thread(target=busy)
+            worker.start()
+            worker.join()
+
+        event = read_events(trace_file)["install.particles"]
+        assert event["dur"] >= 200_000
+        assert event["args"]["thread_cpu_ms"] < 100, "Only the calling thread's CPU time may be counted"
+
+    def test_latest_run_only(self, trace_file):
+        @traced("import")
+        def run_import():
+            pass
+
+        with span("install"):
+            pass
+        run_import()
+
+        assert list(read_events(trace_file)) == ["import"], "A new top-level span starts a new trace"
+
+    def test_disabled(self, trace_file, monkeypatch):
+        monkeypatch.setattr(trace, "_trace_file", None)
+
+        with span("install", items=1) as current:
+            current.add()
+        write_trace()
+
+        assert current.items == 2
+        assert trace.tracing_enabled() is False
+        assert not trace_file.parent.exists()
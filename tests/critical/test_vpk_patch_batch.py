@@ -0,0 +1,120 @@
+import tempfile
+from pathlib import Path
+
+import pytest
+from valve_parsers import VPKFile
+
+from core.util.vpk import VPKPatchBatch, update_vpk
+
+
+class TestVPKPatchBatch:
+    @pytest.fixture
+    def game_vpk(self):
+        # small multi-archive VPK laid out like tf2_misc_dir.vpk, split so entries land in different archives
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            source = temp_path / "source"
+            (source / "materials" / "skybox").mkdir(parents=True)
+            (source / "particles").mkdir(parents=True)
+
+            (source / "materials" / "skybox" / "sky_a.vmt").write_bytes(b"A" * 64)
+            (source / "materials" / "skybox" / "sky_b.vmt").write_bytes(b"B" * 64)
+            (source / "particles" / "explosion.pcf").write_bytes(b"P" * 128)
+
+            assert VPKFile.create(str(source), str(temp_path / "tf2_misc"), 100)
+            yield temp_path / "tf2_misc_dir.vpk"
+
+    def test_commit_writes_all_entries(self, game_vpk):
+        batch = VPKPatchBatch(game_vpk)
+        assert batch.queue("materials/skybox/sky_a.vmt", b"a" * 64)
+        assert batch.queue("particles/explosion.pcf", b"p" * 128)
+
+        assert batch.commit() == 2, "Every queued entry should be written"
+        assert len(batch) == 0, "Batch should be empty after committing"
+
+        vpk = VPKFile(game_vpk)
+        assert vpk.get_file_data("materials/skybox/sky_a.vmt") == b"a" * 64
+        assert vpk.get_file_data("materials/skybox/sky_b.vmt") == b"B" * 64, "Untouched entries must not change"
+        assert vpk.get_file_data("particles/explosion.pcf") == b"p" * 128
+
+    def test_size_mismatch_is_rejected(self, game_vpk):
+        archives = {path: path.read_bytes() for path in game_vpk.parent.glob("tf2_misc_*.vpk")}
+
+        batch = VPKPatchBatch(game_vpk)
+        assert not batch.queue("materials/skybox/sky_a.vmt", b"a" * 65), "Oversized data must be rejected"
+        assert not batch.queue("materials/skybox/sky_a.vmt", b"a" * 63), "Undersized data must be rejected"
+        assert not batch.queue("materials/skybox/missing.vmt", b"a" * 64), "Missing entries must be rejected"
+        assert batch.commit() == 0
+
+        for path, content in archives.items():
+            assert path.read_bytes() == content, f"{path.name} was modified by a rejected patch"
+
+    def test_last_queued_data_wins(self, game_vpk):
+        batch = VPKPatchBatch(game_vpk)
+        batch.queue("materials/skybox/sky_b.vmt", b"1" * 64)
+        batch.queue("Materials\\Skybox\\SKY_B.vmt", b"2" * 64)
+
+        assert len(batch) == 1, "Queuing the same entry twice should replace the earlier data"
+        batch.commit()
+
+        assert VPKFile(game_vpk).get_file_data("materials/skybox/sky_b.vmt") == b"2" * 64
+
+    def test_unchanged_entries_are_not_written(self, game_vpk):
+        batch = VPKPatchBatch(game_vpk)
+        batch.queue("materials/skybox/sky_a.vmt", b"A" * 64)
+        batch.queue("particles/explosion.pcf", b"p" * 128)
+        assert batch.commit() == 1, "Entries already matching the VPK should be skipped"
+
+        batch.queue("particles/explosion.pcf", b"p" * 128)
+        assert batch.commit() == 0, "Re-applying the same state should write nothing"
+        assert VPKFile(game_vpk).get_file_data("particles/explosion.pcf") == b"p" * 128
+
+    def test_read_sees_queued_data(self, game_vpk):
+        batch = VPKPatchBatch(game_vpk)
+        assert batch.read("materials/skybox/sky_a.vmt") == b"A" * 64
+        batch.queue("materials/skybox/sky_a.vmt", b"a" * 64)
+        assert batch.read("Materials\\Skybox\\sky_a.vmt") == b"a" * 64, "Pending patches should be visible before commit"
+
+
+class TestUpdateVPK:
+    @pytest.fixture
+    def staged(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            source = temp_path / "source"
+            (source / "materials").mkdir(parents=True)
+            for i in range(8):
+                (source / "materials" / f"mat_{i}.vmt").write_bytes(bytes([65 + i]) * 100)
+            yield source, temp_path / "_casual_preloader"
+
+    def assert_matches(self, source, base_path):
+        vpk = VPKFile(f"{base_path}_dir.vpk")
+        files = [file for file in source.rglob("*") if file.is_file()]
+        assert len(vpk.list_files()) == len(files)
+        for file in files:
+            assert vpk.get_file_data(str(file.relative_to(source))) == file.read_bytes()
+
+    def test_unchanged_entries_keep_their_offsets(self, staged):
+        source, base_path = staged
+        assert not update_vpk(source, base_path, 10_000), "First run has nothing to update"
+        before = VPKFile(f"{base_path}_dir.vpk").get_file_info("materials/mat_0.vmt")
+
+        (source / "materials" / "mat_3.vmt").write_bytes(b"x" * 100)
+        (source / "materials" / "new.vmt").write_bytes(b"new")
+        assert update_vpk(source, base_path, 10_000), "Small changes should be applied in place"
+        self.assert_matches(source, base_path)
+
+        after = VPKFile(f"{base_path}_dir.vpk").get_file_info("materials/mat_0.vmt")
+        assert (after["archive_index"], after["offset"]) == (before["archive_index"], before["offset"])
+
+    def test_dead_space_triggers_compaction(self, staged):
+        source, base_path = staged
+        update_vpk(source, base_path, 10_000)
+        archive = Path(f"{base_path}_000.vpk")
+        size = archive.stat().st_size
+
+        for i in range(4):
+            (source / "materials" / f"mat_{i}.vmt").unlink()
+        assert not update_vpk(source, base_path, 10_000), "Half the archive is dead, it should be rebuilt"
+        self.assert_matches(source, base_path)
+        assert archive.stat().st_size == size // 2